@@ -61,12 +61,7 @@ class AnnotatedData(object):
         elif file_name.endswith('.csv'):
             df = pd.read_csv(request.files['file'], dtype=object, header=None).fillna('')
 
-        if dataset_qnode:
-            # only update metadata if we are going to insert data, if the request is only to return files, skip
-            if not files_only:
-                # update dataset metadata last_updated field
-                DatasetMetadataUpdater().update(dataset)
-        else:
+        if not dataset_qnode:
             try:
                 dataset_dict = {
                     'dataset_id': df.iloc[0, 1],
@@ -121,6 +116,8 @@ class AnnotatedData(object):
             variable_ids, kgtk_exploded_df = self.generate_kgtk_dataset(dataset, dataset_qnode, df, rename_columns, t2wml_yaml, is_request_put)
 
             self.import_to_database(kgtk_exploded_df)
+            # update dataset metadata last_updated field, once the data is in
+            DatasetMetadataUpdater().update(dataset)
 
             temp_tar_dir = tempfile.mkdtemp()
 
@@ -157,6 +154,8 @@ class AnnotatedData(object):
             variable_ids, kgtk_exploded_df = self.generate_kgtk_dataset(dataset, dataset_qnode, df, rename_columns, t2wml_yaml, is_request_put)
 
             self.import_to_database(kgtk_exploded_df)
+            # update dataset metadata last_updated field, once the data is in
+            DatasetMetadataUpdater().update(dataset)
 
             variables_metadata = self.generate_variable_metadata(dataset, variable_ids)
 
@@ -0,0 +1,96 @@
+# Conditional GET support. A dataset's data and metadata only change when its last_update (P5017) is bumped, so
+# last_update serves as the validator of all the resources under the dataset. Clients that send back the ETag or
+# Last-Modified of their copy get a 304 without any data being queried.
+#
+# The same URL returns different representations depending on its query arguments and the negotiated format, so the
+# ETag covers those as well, and responses vary by Accept.
+
+import datetime
+import functools
+import hashlib
+
+from flask import request, Response
+from werkzeug.http import http_date, quote_etag
+
+from db.sql import dal
+
+
+def _negotiated_format() -> str:
+    # Imported here, as the api.variable package imports this module
+    from api.variable.formats import FormatError, get_format
+    try:
+        return get_format(request)
+    except FormatError:
+        return ''  # The method rejects the request, and its error response carries no validators
+
+
+def _validators(dataset, last_update):
+    args = sorted((name, sorted(values)) for (name, values) in request.args.lists())
+    args_hash = hashlib.sha1(repr(args).encode('utf-8')).hexdigest()
+    key = f'{dataset}/{last_update.isoformat()}/{_negotiated_format()}/{args_hash}'
+    tag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    last_modified = last_update.replace(microsecond=0, tzinfo=None)
+    return tag, last_modified
+
+
+def _is_not_modified(tag, last_modified) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since, as in RFC 7232
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(tag)
+    since = request.if_modified_since
+    if since:
+        if since.tzinfo:  # Werkzeug 2 returns aware datetimes, earlier versions naive UTC datetimes
+            since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return last_modified <= since
+    return False
+
+
+def _add_headers(result, headers):
+    # Adds headers to a successful result of a resource method - a Response or a flask_restful (data, code[, headers])
+    if isinstance(result, Response):
+        if result.status_code == 200:
+            for (name, value) in headers.items():
+                result.headers[name] = value
+        return result
+
+    if isinstance(result, tuple):
+        (data, code, *rest) = result
+        result_headers = dict(rest[0]) if rest else {}
+    else:
+        (data, code, result_headers) = (result, 200, {})
+    if code != 200:
+        return result
+
+    result_headers.update(headers)
+    return data, code, result_headers
+
+
+def conditional_on_dataset(method):
+    """ Makes a GET method of a dataset resource conditional on the dataset's last_update.
+
+    Responses carry an ETag and a Last-Modified header, and requests whose If-None-Match or If-Modified-Since match
+    the dataset's current last_update are answered with a 304 without calling the method. The ETag also depends on
+    the query arguments and the negotiated format. Resources without a dataset, and datasets without a last_update,
+    are served as usual.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        dataset = kwargs.get('dataset')
+        last_update = dal.request_dataset_last_update(dataset) if dataset else None
+        if not last_update:
+            return method(self, *args, **kwargs)
+
+        (tag, last_modified) = _validators(dataset, last_update)
+        headers = {
+            'ETag': quote_etag(tag, weak=True),  # Row order is not guaranteed, so the ETag is weak
+            'Last-Modified': http_date(last_modified.replace(tzinfo=datetime.timezone.utc)),
+            'Vary': 'Accept',
+        }
+        if _is_not_modified(tag, last_modified):
+            response = Response(status=304)
+            response.headers.extend(headers)
+            return response
+
+        return _add_headers(method(self, *args, **kwargs), headers)
+
+    return wrapper
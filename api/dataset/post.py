@@ -79,6 +79,7 @@ class DatasetData(object):
                 traceback.print_exc(file=sys.stdout)
                 raise e
         print('All files have been imported')
+        DatasetMetadataUpdater().update(dataset)
         print(f'time take to import kgtk file into database: {time() - s} seconds')
 
         # Clean up
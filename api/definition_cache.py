@@ -0,0 +1,48 @@
+# This module caches variable definitions - the variable's identity, qualifiers and tags, which are needed before its
+# data can be queried. A definition only changes along with its dataset's last_update, so cached definitions are
+# served for as long as last_update stays the same.
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from db.sql import dal
+
+
+class _DefinitionCache:
+    MAX_ENTRIES = 4096
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._definitions: Dict[Tuple[str, str], Dict[str, Any]] = OrderedDict()
+
+    def get(self, dataset: str, variable: str) -> Optional[Dict[str, Any]]:
+        # Returns the result of dal.query_variable_definition, from the cache if the dataset has not been updated
+        # since it was read
+        key = (dataset, variable)
+        with self._lock:
+            definition = self._definitions.get(key)
+        if definition and definition['last_update'] == dal.request_dataset_last_update(dataset):
+            with self._lock:
+                if key in self._definitions:
+                    self._definitions.move_to_end(key)
+            return definition
+
+        definition = dal.query_variable_definition(dataset, variable)
+        if definition and definition['last_update']:  # Datasets without a last_update cannot be versioned
+            with self._lock:
+                self._definitions[key] = definition
+                self._definitions.move_to_end(key)
+                while len(self._definitions) > self.MAX_ENTRIES:
+                    self._definitions.popitem(last=False)
+        return definition
+
+    def invalidate(self, dataset: str = None):
+        # Drops the definitions of dataset, or all definitions if dataset is None
+        with self._lock:
+            for key in list(self._definitions.keys()):
+                if dataset is None or key[0] == dataset:
+                    del self._definitions[key]
+
+
+definition_cache = _DefinitionCache()  # Public, process-wide
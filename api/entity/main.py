@@ -12,6 +12,7 @@ from flask_restful import request, Resource
 from api.util import get_edges_from_request
 from db.sql.dal.entity import has_entity_other_labels, is_entity_used, check_existing_entities, delete_entity, query_entity
 from db.sql.kgtk import import_kgtk_dataframe
+from api.region_utils import region_cache
 
 def is_same_as_existing(entity, edges):
     existing_def = query_entity(entity)
@@ -81,8 +82,8 @@ class EntityResource(Resource):
 
         with postgres_connection() as conn:
             # Remove the current definition before updating the new definition
-            for ent in existing_entities:
-                delete_entity(ent, EntityResource.label_white_list, conn=conn)
+            if existing_entities:
+                delete_entity(existing_entities, EntityResource.label_white_list, conn=conn)
             try:
                 import_kgtk_dataframe(edges, is_file_exploded=False, conn=conn)
             except Exception as e:
@@ -93,7 +94,7 @@ class EntityResource(Resource):
                 }
                 return content, 400
 
-
+        region_cache.invalidate(list(entities))
 
         return None, 201
 
@@ -153,6 +154,8 @@ class EntityResource(Resource):
                 }
                 return content, 400
 
+        region_cache.invalidate([entity])
+
         if entity in existing_entities:
             return None, 200
         else:
@@ -185,4 +188,5 @@ class EntityResource(Resource):
 
 
         delete_entity(entity, None)
+        region_cache.invalidate([entity])
         return None, 200
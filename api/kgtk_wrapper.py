@@ -1,5 +1,7 @@
 # This file contains functions that wrap access to kgtk
 import csv
+import hashlib
+import re
 import tempfile
 from typing import Tuple
 from pathlib import Path
@@ -65,7 +67,111 @@ def explode(ctx: KGTKPipeline, infile: str = 'input.tsv', outfile: str = 'explod
                          False,
                          False,
                          KgtkWriter.OUTPUT_FORMAT_KGTK,
-                         allow_lax_nodes=True)
+                         allow_lax_nodes=True,
+                         allow_lax_qnodes=True)  # Units such as QFSI-U002, as explode_frame accepts them
 
 def add_ids(ctx: KGTKPipeline, infile: str = 'input.tsv', outfile: str = 'with-ids.tsv') -> None:
     kgtk.cli.add_id.run(ctx.get_file(infile), ctx.get_file(outfile), id_style='wikidata')
+
+
+# The columns kgtk explode adds, in the order it adds them
+EXPLODED_FIELDS = ['data_type', 'valid', 'list_len', 'number', 'low_tolerance', 'high_tolerance', 'si_units',
+                   'units_node', 'text', 'language', 'language_suffix', 'latitude', 'longitude', 'date_and_time',
+                   'precision', 'truth', 'symbol']
+EXPLODED_COLUMNS = ['node2;kgtk:' + field for field in EXPLODED_FIELDS]
+
+# The node2 forms this API produces, which are exploded without running kgtk. The named groups are the exploded
+# fields. Anything else (escaped strings, lists, booleans, coordinates, dates with time zones, etc...) is left to kgtk.
+# test/test_kgtk_wrapper.py checks the output is the same as kgtk's.
+_NUMBER = r'[+-]?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?'
+_NODE2_FORMS = [
+    ('string', re.compile(r'^(?P<text>"[^"\\|]*")$')),
+    # kgtk checks language codes against ISO 639, only English is exploded here
+    ('language_qualified_string', re.compile(r"^'(?P<text>[^'\"\\|]*)'@(?P<language>en)$")),
+    ('date_and_times', re.compile(r'^\^(?P<date_and_time>\d{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12]\d|3[01])'
+                                  r'T(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\dZ?)(?:/(?P<precision>\d{1,2}))?$')),
+    ('number', re.compile(f'^(?P<number>{_NUMBER})$')),
+    ('quantity', re.compile(f'^(?P<number>{_NUMBER})(?:\\[(?P<low_tolerance>{_NUMBER}),(?P<high_tolerance>{_NUMBER})\\])?'
+                            r'(?P<units_node>Q[A-Za-z0-9_-]+)?$')),
+    ('symbol', re.compile(r'^(?!True$|False$)(?P<symbol>[A-Za-z_][^\s|"\']*)$')),
+]
+
+_QUOTED_FIELDS = ('text', 'date_and_time')
+
+
+def _kgtk_number(text: str) -> str:
+    # kgtk parses the number of a quantity to an int, or a float if it has a decimal point or an exponent
+    return str(float(text)) if '.' in text or 'e' in text.lower() else str(int(text))
+
+
+# kgtk writes these fields as the numbers it parsed, not as they appear in node2
+_NUMBER_FIELDS = {'number': _kgtk_number, 'low_tolerance': lambda text: str(float(text)),
+                  'high_tolerance': lambda text: str(float(text)), 'precision': lambda text: str(int(text))}
+
+
+def _explode_known_forms(node2: pd.Series) -> Tuple[DataFrame, pd.Series]:
+    # Explodes the node2 values that match one of the known forms.
+    # Returns the exploded columns and a mask of the values that did not match
+    exploded = DataFrame('', index=node2.index, columns=EXPLODED_COLUMNS)
+    remaining = pd.Series(True, index=node2.index)
+    for (data_type, pattern) in _NODE2_FORMS:
+        fields = node2[remaining].str.extract(pattern)
+        matched = fields.notna().any(axis=1)
+        matched = matched[matched].index
+        if not len(matched):
+            continue
+        exploded.loc[matched, 'node2;kgtk:data_type'] = data_type
+        for field in fields.columns:
+            values = fields.loc[matched, field].fillna('')
+            if field in _QUOTED_FIELDS and data_type != 'string':
+                values = '"' + values + '"'  # kgtk writes these fields as strings
+            elif field in _NUMBER_FIELDS:
+                values = values.map(lambda text: _NUMBER_FIELDS[field](text) if text else text)
+            exploded.loc[matched, 'node2;kgtk:' + field] = values
+        remaining[matched] = False
+
+    exploded.loc[~remaining, 'node2;kgtk:valid'] = 'True'
+    exploded.loc[~remaining, 'node2;kgtk:list_len'] = '0'
+    return exploded, remaining
+
+
+def explode_frame(frame: DataFrame) -> DataFrame:
+    """ Explodes the node2 column of a KGTK edge frame, like kgtk explode does, without a round trip through files.
+
+    The common node2 forms are exploded in memory, kgtk is only run on the rows with other forms.
+    """
+    index = frame.index  # Rows are matched by position, the caller's index may repeat labels
+    frame = frame.fillna('').astype(str).reset_index(drop=True)
+    exploded, remaining = _explode_known_forms(frame['node2'])
+    result = pd.concat([frame, exploded], axis=1)
+
+    if remaining.any():
+        with KGTKPipeline(frame[remaining]) as ctx:
+            explode(ctx, 'input.tsv', 'exploded.tsv')
+            by_kgtk = ctx.read_csv('exploded.tsv')
+        expected = frame.loc[remaining, ['node1', 'label']]
+        if len(by_kgtk) != len(expected) or (by_kgtk[['node1', 'label']].values != expected.values).any():
+            raise ValueError('kgtk explode did not return the edges it was given')
+        by_kgtk.index = expected.index
+        result.loc[remaining, EXPLODED_COLUMNS] = by_kgtk.reindex(columns=EXPLODED_COLUMNS).fillna('')
+
+    result.index = index
+    return result
+
+
+# The length of the node2 hash in wikidata style ids, kgtk add-id's default
+_VALUE_HASH_WIDTH = 6
+
+
+def add_ids_frame(frame: DataFrame) -> DataFrame:
+    """ Adds wikidata style ids to a KGTK edge frame, like kgtk add-id --id-style wikidata does.
+
+    The id is node1-label-node2 when node2 starts with P or Q, and node1-label-<hash of node2> otherwise. Each id
+    only depends on its own edge, so they are computed in memory, without running kgtk.
+    """
+    frame = frame.fillna('').astype(str)
+    node2 = frame['node2']
+    hashes = node2.map(lambda value: hashlib.sha256(value.encode('utf-8')).hexdigest()[:_VALUE_HASH_WIDTH])
+    result = frame.copy()
+    result['id'] = frame['node1'] + '-' + frame['label'] + '-' + node2.where(node2.str.startswith(('P', 'Q')), hashes)
+    return result
@@ -4,10 +4,13 @@ from flask_restful import Resource
 from flask import request, make_response
 
 from api.util import get_edges_from_request
+from api.conditional import conditional_on_dataset
 from api.variable.delete import VariableDeleter
 from api.metadata.metadata import DatasetMetadata, VariableMetadata
 from api.metadata.update import DatasetMetadataUpdater
 from api.region_utils import get_query_region_ids, UnknownSubjectError
+from api.definition_cache import definition_cache
+from api.response_cache import response_cache
 from db.sql import dal
 from db.sql.kgtk import import_kgtk_dataframe, unquote
 
@@ -154,6 +157,8 @@ class VariableMetadataResource(Resource):
         # import variable metadatga
         import_kgtk_dataframe(edges)
 
+        DatasetMetadataUpdater().update(dataset)
+
         results = []
         for i, edge in p1813_edges.iterrows():
             variable = unquote(edge['node2'])
@@ -197,6 +202,7 @@ class VariableMetadataResource(Resource):
 
         if 'test' not in request.args:
             import_kgtk_dataframe(edges)
+            DatasetMetadataUpdater().update(dataset)
 
         content = metadata.to_dict()
 
@@ -210,6 +216,7 @@ class VariableMetadataResource(Resource):
 
         return content, 201
 
+    @conditional_on_dataset
     def get(self, dataset, variable=None):
         if variable is None:
             results = dal.query_dataset_variables(dataset, True)
@@ -252,6 +259,7 @@ class VariableMetadataResource(Resource):
             return {'Error': f"Please delete all variable data before deleting metadata"}, 409
 
         dal.delete_variable_metadata(dataset_id, qnodes)
+        DatasetMetadataUpdater().update(dataset)
         return {'Message': f'Successfully deleted {str(variables)} in the dataset: {dataset}.'}, 200
 
 
@@ -445,6 +453,7 @@ class DatasetMetadataResource(Resource):
 
         return content, 201
 
+    @conditional_on_dataset
     def get(self, dataset=None):
         results = dal.query_dataset_metadata(dataset)
         if results is None:
@@ -476,6 +485,8 @@ class DatasetMetadataResource(Resource):
                 return {'Error': f'Dataset {dataset} is not empty'}, 409
 
         dal.delete_dataset_metadata(dataset_metadata[0]['dataset_qnode'])
+        response_cache.invalidate(dataset)
+        definition_cache.invalidate(dataset)
         return {'Message': f'Dataset {dataset} deleted'}, 200
 
 
@@ -3,6 +3,8 @@ import datetime
 import pandas as pd
 
 from api.metadata.metadata import DatasetMetadata
+from api.definition_cache import definition_cache
+from api.response_cache import response_cache
 from db.sql import dal
 from db.sql.kgtk import import_kgtk_dataframe
 
@@ -29,17 +31,29 @@ class DatasetMetadataUpdater():
 
 
     def update(self, dataset_id: str, *, last_update: str = None) -> dict:
-        '''update dataset metadata last_updated field'''
-        if not last_update:
-            last_update = datetime.datetime.now().isoformat().split('.')[0]
+        '''update dataset metadata last_updated field
 
+        Every write path calls this once its changes are in the database. last_update versions the cached responses
+        and the conditional GET validators of the dataset in all processes, so it has to move forward on every write.
+        '''
         dataset_metadata = dal.query_dataset_metadata(dataset_id, include_dataset_qnode=True)
         if not dataset_metadata:
             raise Exception(f"No such dataset {dataset_id}")
 
-        # Remove previous last_update
         dataset_metadata = dataset_metadata[0]
         dataset_qnode = dataset_metadata.pop('dataset_qnode')
+
+        if not last_update:
+            # last_update has a precision of a second, two writes within the same second still get different ones
+            now = datetime.datetime.now().replace(microsecond=0)
+            previous = dataset_metadata.get('last_update')
+            if isinstance(previous, datetime.datetime):
+                previous = previous.replace(microsecond=0, tzinfo=None)
+                if now <= previous:
+                    now = previous + datetime.timedelta(seconds=1)
+            last_update = now.isoformat()
+
+        # Remove previous last_update
         if 'last_update' in dataset_metadata:
             dal.delete_dataset_last_update(dataset_qnode)
 
@@ -52,5 +66,10 @@ class DatasetMetadataUpdater():
         edge_list = [edge for edge in edge_list if edge['label'] == 'P5017']
         edges = pd.DataFrame(edge_list)
         import_kgtk_dataframe(edges)
+        dal.forget_dataset_last_update(dataset_id)
+
+        # Cached responses and variable definitions of the dataset are stale now
+        response_cache.invalidate(dataset_id)
+        definition_cache.invalidate(dataset_id)
 
         return dataset_metadata
@@ -0,0 +1,47 @@
+from flask_restful import request, Resource
+
+from api.region.search import region_search, REGION_TYPES
+
+
+class RegionResource(Resource):
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 100
+
+    def get(self):
+        '''Search regions by name or alias'''
+        query = request.args.get('q', '').strip()
+        if not query:
+            return {'Error': 'Missing q'}, 400
+
+        region_type = request.args.get('type', '').lower() or None
+        if region_type and region_type not in REGION_TYPES:
+            return {'Error': f"Unknown type {region_type}, expected one of {', '.join(REGION_TYPES.keys())}"}, 400
+
+        try:
+            limit = int(request.args.get('limit', self.DEFAULT_LIMIT))
+        except ValueError:
+            return {'Error': 'limit should be a number'}, 400
+        if limit < 1 or limit > self.MAX_LIMIT:
+            return {'Error': f'limit should be between 1 and {self.MAX_LIMIT}'}, 400
+
+        type_names = {qnode: name for (name, qnode) in REGION_TYPES.items()}
+        results = region_search.get().search(query, REGION_TYPES.get(region_type), limit)
+
+        regions = []
+        for (region, name, distance) in results:
+            regions.append({
+                'admin_id': region.admin_id,
+                'admin': region.admin,
+                'type': type_names[region.region_type],
+                'matched': name,
+                'distance': distance,
+                'country': region.country,
+                'country_id': region.country_id,
+                'admin1': region.admin1,
+                'admin1_id': region.admin1_id,
+                'admin2': region.admin2,
+                'admin2_id': region.admin2_id,
+                'admin3': region.admin3,
+                'admin3_id': region.admin3_id,
+            })
+        return regions
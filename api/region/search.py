@@ -0,0 +1,167 @@
+# Region name search, for autocompletion and for resolving misspelled region names.
+#
+# The names and aliases of all the regions (from the region cache) are kept sorted, so names starting with the query
+# are found with a binary search - a flat prefix tree - and are indexed by their character trigrams, so names that
+# share most of their trigrams with the query are found as well. Candidates are ranked by their edit distance from
+# the query, then by region level (countries first), then by length.
+
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from api.region_index import RegionIndex
+from api.region_utils import region_cache
+from db.sql.dal import Region
+
+# Region types by name, as in the variable data arguments
+REGION_TYPES = {
+    'country': Region.COUNTRY,
+    'admin1': Region.ADMIN1,
+    'admin2': Region.ADMIN2,
+    'admin3': Region.ADMIN3,
+}
+
+MAX_PREFIX_CANDIDATES = 1000
+MAX_FUZZY_CANDIDATES = 200
+
+
+def normalize(name: str) -> str:
+    # Lowercase, without accents and repeated spaces, so that sao paulo matches São Paulo
+    decomposed = unicodedata.normalize('NFKD', name.lower())
+    return ' '.join(''.join(char for char in decomposed if not unicodedata.combining(char)).split())
+
+
+def trigrams(name: str) -> List[str]:
+    padded = f' {name} '
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    # The Levenshtein distance between a and b, or max_distance + 1 if it is larger than max_distance
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for (i, char_a) in enumerate(a, 1):
+        current = [i]
+        for (j, char_b) in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class RegionSearchIndex:
+    def __init__(self, index):
+        # index is the region cache's RegionIndex or SharedRegionIndex
+        self._index = index
+        self._names: List[str] = []  # Normalized, sorted
+        self._regions: List[List[Tuple[str, int]]] = []  # The (admin id, level) of the regions of each name
+        self._trigrams: Dict[str, array] = {}
+
+        names: Dict[str, List[Tuple[str, int]]] = {}
+        for (name, ids) in index.names():
+            for admin_id in ids:
+                region = index.get(admin_id)
+                if region:
+                    regions = names.setdefault(normalize(name), [])
+                    if admin_id not in [region_id for (region_id, _) in regions]:
+                        regions.append((admin_id, RegionIndex.REGION_TYPES.index(region.region_type)))
+
+        for (name, regions) in sorted(names.items()):
+            position = len(self._names)
+            self._names.append(name)
+            self._regions.append(regions)
+            for trigram in set(trigrams(name)):
+                if trigram not in self._trigrams:
+                    self._trigrams[trigram] = array('i')
+                self._trigrams[trigram].append(position)
+
+    def _candidates(self, query: str, level: Optional[int], limit: int) -> Dict[int, int]:
+        # Positions of candidate names with their distance from the query. A name starting with the query is at
+        # distance 0, other names at their distance from the query or from their prefix of the query's length,
+        # whichever is smaller
+        candidates = {}
+        matches = 0
+        position = bisect_left(self._names, query)
+        while position < len(self._names) and len(candidates) < MAX_PREFIX_CANDIDATES and \
+                self._names[position].startswith(query):
+            candidates[position] = 0
+            matches += sum(1 for (_, region_level) in self._regions[position] if level in (None, region_level))
+            position += 1
+
+        # Misspelled names are further away than all the names starting with the query
+        query_trigrams = trigrams(query)
+        if len(query) < 3 or matches >= limit:
+            return candidates
+
+        counts = Counter()
+        for trigram in set(query_trigrams):
+            counts.update(self._trigrams.get(trigram, ()))
+        min_count = max(1, len(query_trigrams) // 3)
+        max_distance = max(1, len(query) // 4)
+        for (position, count) in counts.most_common(MAX_FUZZY_CANDIDATES):
+            if count < min_count:
+                break
+            if position in candidates:
+                continue
+            name = self._names[position]
+            distance = min(edit_distance(query, name, max_distance),
+                           edit_distance(query, name[:len(query)], max_distance))
+            if distance <= max_distance:
+                candidates[position] = distance
+        return candidates
+
+    def search(self, query: str, region_type: Optional[str] = None, limit: int = 10) -> List[Tuple[Region, str, int]]:
+        """ Returns up to limit (region, matched name, distance) tuples for query, best first, optionally only regions
+        of region_type """
+        query = normalize(query)
+        if not query:
+            return []
+        level = RegionIndex.REGION_TYPES.index(region_type) if region_type else None
+
+        ranked = []
+        for (position, distance) in self._candidates(query, level, limit).items():
+            name = self._names[position]
+            for (admin_id, region_level) in self._regions[position]:
+                if level is None or region_level == level:
+                    ranked.append((distance, name != query, region_level, len(name), name, admin_id))
+        ranked.sort()
+
+        results = []
+        seen = set()
+        for (distance, _, _, _, name, admin_id) in ranked:
+            if admin_id in seen:
+                continue
+            seen.add(admin_id)
+            region = self._index.get(admin_id)
+            if region:
+                results.append((region, name, distance))
+                if len(results) == limit:
+                    break
+        return results
+
+
+class _RegionSearch:
+    # The search index of the region cache's current regions, rebuilt when they change
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._search_index: Optional[RegionSearchIndex] = None
+        self._key = None
+
+    def get(self) -> RegionSearchIndex:
+        # Requires an app context
+        index = region_cache.get_index()
+        key = (id(index), index.changes)
+        with self._lock:
+            if key != self._key:
+                self._search_index = RegionSearchIndex(index)
+                self._key = key
+            return self._search_index
+
+
+region_search = _RegionSearch()  # Public, process-wide
@@ -0,0 +1,313 @@
+# A compact, column oriented index of regions, used by the region cache (see api.region_utils).
+#
+# Each region is a row in a set of column arrays. The regions a region is located in (country, admin1, ...) are stored
+# as integer references into a table of interned nodes, so their ids and labels are kept only once. Regions are
+# looked up by id, or by their lowercase name or alias, through hash indexes that map to row numbers. Region objects
+# are only created when a region is returned.
+#
+# An index can be filled from the database, from metadata/region.csv, or from a snapshot file written by save.
+# SharedRegionIndex serves the regions of a shared snapshot (see api.shared_snapshot) instead.
+
+import csv
+import gzip
+import json
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from db.sql import dal
+from db.sql.dal import Region
+from api.shared_snapshot import REGION_FIELDS, Snapshot
+
+
+class RegionIndex:
+    SNAPSHOT_VERSION = 1
+    REGION_TYPES = (Region.COUNTRY, Region.ADMIN1, Region.ADMIN2, Region.ADMIN3)
+    _LOCATED_IN = ('country', 'admin1', 'admin2', 'admin3')
+
+    def __init__(self, complete=False):
+        # complete is True if the index holds all the regions, so regions that are not in it do not exist
+        self.complete = complete
+        self.changes = 0  # Incremented whenever regions are added or removed
+
+        # Interned nodes
+        self._node_ids: List[str] = []
+        self._node_labels: List[Optional[str]] = []
+        self._nodes: Dict[str, int] = {}
+
+        # Region columns, -1 stands for no node
+        self._node = array('i')
+        self._type = array('b')
+        self._located_in = {column: array('i') for column in self._LOCATED_IN}
+        self._cameo: List[Optional[str]] = []
+        self._coordinate: List[Optional[str]] = []
+        self._alias: List[Optional[str]] = []
+
+        # Indexes. Most names belong to a single region, so a name maps to a row, or to a list of rows. The names of
+        # each row are kept as well, so a region is removed from the names it has, not from all of them
+        self._by_id: Dict[str, int] = {}
+        self._by_name: Dict[str, Union[int, List[int]]] = {}
+        self._row_names: List[List[str]] = []
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def _intern(self, node_id: Optional[str], label: Optional[str]) -> int:
+        if not node_id:
+            return -1
+        node = self._nodes.get(node_id)
+        if node is None:
+            node = len(self._node_ids)
+            self._nodes[node_id] = node
+            self._node_ids.append(node_id)
+            self._node_labels.append(label)
+        elif label and not self._node_labels[node]:
+            self._node_labels[node] = label
+        return node
+
+    def _index_name(self, name: str, row: int):
+        name = name.lower()
+        rows = self._by_name.get(name)
+        if rows is None:
+            self._by_name[name] = row
+        elif isinstance(rows, int):
+            if rows == row:
+                return
+            self._by_name[name] = [rows, row]
+        elif row not in rows:
+            rows.append(row)
+        else:
+            return
+        self._row_names[row].append(name)
+
+    def add(self, region: Region):
+        # Adds a region. A region that is already in the index only gets its alias added, as the region query
+        # returns a row per alias
+        self.changes += 1
+        row = self._by_id.get(region.admin_id)
+        if row is None:
+            row = len(self._node)
+            self._by_id[region.admin_id] = row
+            node = self._intern(region.admin_id, region.admin)
+            self._node_labels[node] = region.admin  # The region may have been renamed since it was interned
+            self._node.append(node)
+            self._type.append(self.REGION_TYPES.index(region.region_type))
+            for column in self._LOCATED_IN:
+                self._located_in[column].append(self._intern(region[f'{column}_id'], region[column]))
+            self._cameo.append(region.country_cameo)
+            self._coordinate.append(region.region_coordinate)
+            self._alias.append(region.alias)
+            self._row_names.append([])
+            self._index_name(region.admin, row)
+        elif region.alias and not self._alias[row]:
+            self._alias[row] = region.alias
+
+        if region.alias:
+            self._index_name(region.alias, row)
+
+    def add_regions(self, regions: Iterable[Region]):
+        for region in regions:
+            self.add(region)
+
+    def remove(self, admin_id: str):
+        # Removes a region from the indexes, its row is left unreferenced in the columns
+        row = self._by_id.pop(admin_id, None)
+        if row is None:
+            return
+        self.changes += 1
+        for name in self._row_names[row]:
+            rows = self._by_name[name]
+            if rows == row:
+                del self._by_name[name]
+            else:
+                rows.remove(row)
+                if len(rows) == 1:
+                    self._by_name[name] = rows[0]
+        self._row_names[row] = []
+
+    def _region(self, row: int) -> Region:
+        fields = dict(
+            admin_id=self._node_ids[self._node[row]],
+            admin=self._node_labels[self._node[row]],
+            region_type=self.REGION_TYPES[self._type[row]],
+            country_cameo=self._cameo[row],
+            region_coordinate=self._coordinate[row],
+            alias=self._alias[row],
+        )
+        for column in self._LOCATED_IN:
+            node = self._located_in[column][row]
+            fields[f'{column}_id'] = self._node_ids[node] if node >= 0 else None
+            fields[column] = self._node_labels[node] if node >= 0 else None
+        return Region(**fields)
+
+    def has_id(self, admin_id: str) -> bool:
+        return admin_id in self._by_id
+
+    def has_name(self, name: str) -> bool:
+        return name.lower() in self._by_name
+
+    def get(self, admin_id: str) -> Optional[Region]:
+        row = self._by_id.get(admin_id)
+        return self._region(row) if row is not None else None
+
+    def find(self, name: str) -> List[Region]:
+        # All the regions with this name or alias (case insensitive)
+        rows = self._by_name.get(name.lower(), [])
+        if isinstance(rows, int):
+            rows = [rows]
+        return [self._region(row) for row in rows]
+
+    def regions(self) -> Iterable[Region]:
+        for row in sorted(self._by_id.values()):
+            yield self._region(row)
+
+    def names(self) -> Iterable[Tuple[str, List[str]]]:
+        # The lowercase names and aliases, with the ids of their regions
+        for (name, rows) in self._by_name.items():
+            if isinstance(rows, int):
+                rows = [rows]
+            yield name, [self._node_ids[self._node[row]] for row in rows]
+
+    @staticmethod
+    def from_database() -> 'RegionIndex':
+        # All the regions in the database, requires an app context
+        index = RegionIndex(complete=True)
+        index.add_regions(dal.query_admins())
+        return index
+
+    @staticmethod
+    def from_region_csv(path: str) -> 'RegionIndex':
+        # The regions of a region.csv file (country,country_id,admin1,admin1_id,admin2,admin2_id,admin3,admin3_id),
+        # the file script/generate_region_edges.py creates the region edges from. It has no aliases, CAMEO codes or
+        # coordinates, and regions added later are missing from it, so the index is not complete
+        index = RegionIndex()
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                located_in = {}
+                for (column, region_type) in zip(RegionIndex._LOCATED_IN, RegionIndex.REGION_TYPES):
+                    if not row[f'{column}_id']:
+                        continue
+                    located_in[column] = row[column]
+                    located_in[f'{column}_id'] = row[f'{column}_id']
+                    if not index.has_id(row[f'{column}_id']):
+                        index.add(Region(admin=row[column], admin_id=row[f'{column}_id'], region_type=region_type,
+                                         **located_in))
+        return index
+
+    def save(self, path: str):
+        # Writes the index to a gzipped JSON snapshot file
+        snapshot = dict(
+            version=self.SNAPSHOT_VERSION,
+            complete=self.complete,
+            node_ids=self._node_ids,
+            node_labels=self._node_labels,
+            node=self._node.tolist(),
+            type=self._type.tolist(),
+            located_in={column: values.tolist() for (column, values) in self._located_in.items()},
+            cameo=self._cameo,
+            coordinate=self._coordinate,
+            alias=self._alias,
+            names=self._by_name,
+            live=sorted(self._by_id.values()) if len(self._by_id) < len(self._node) else None,
+        )
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+
+    @staticmethod
+    def load(path: str) -> 'RegionIndex':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != RegionIndex.SNAPSHOT_VERSION:
+            raise ValueError(f'{path} is not a version {RegionIndex.SNAPSHOT_VERSION} region snapshot')
+
+        index = RegionIndex(complete=snapshot['complete'])
+        index._node_ids = snapshot['node_ids']
+        index._node_labels = snapshot['node_labels']
+        index._nodes = {node_id: node for (node, node_id) in enumerate(index._node_ids)}
+        index._node = array('i', snapshot['node'])
+        index._type = array('b', snapshot['type'])
+        index._located_in = {column: array('i', values) for (column, values) in snapshot['located_in'].items()}
+        index._cameo = snapshot['cameo']
+        index._coordinate = snapshot['coordinate']
+        index._alias = snapshot['alias']
+        live = snapshot['live'] if snapshot['live'] is not None else range(len(index._node))
+        index._by_id = {index._node_ids[index._node[row]]: row for row in live}
+        index._by_name = snapshot['names']
+        index._row_names = [[] for _ in range(len(index._node))]
+        for (name, rows) in index._by_name.items():
+            for row in ([rows] if isinstance(rows, int) else rows):
+                index._row_names[row].append(name)
+        return index
+
+
+class SharedRegionIndex:
+    # The regions of a shared snapshot, with the same interface as RegionIndex. The snapshot is read-only, so regions
+    # added or removed later are kept in a process local RegionIndex on top of it
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+        self.complete = snapshot.meta['regions']['complete']
+        self._regions = snapshot.table('regions')
+        self._names = snapshot.table('region_names')
+        self._local = RegionIndex()
+        self._removed: Set[str] = set()  # Snapshot regions that were removed or replaced by local regions
+
+    def __len__(self):
+        return len(self._regions) - len(self._removed) + len(self._local)
+
+    @property
+    def changes(self) -> int:
+        return self._local.changes + len(self._removed)
+
+    def _shared(self, admin_id: str) -> Optional[Region]:
+        if admin_id in self._removed:
+            return None
+        fields = self._regions.get(admin_id)
+        if fields is None:
+            return None
+        return Region(admin_id=admin_id, **dict(zip(REGION_FIELDS, fields)))
+
+    def add(self, region: Region):
+        if region.admin_id in self._regions:
+            self._removed.add(region.admin_id)
+        self._local.add(region)
+
+    def add_regions(self, regions: Iterable[Region]):
+        for region in regions:
+            self.add(region)
+
+    def remove(self, admin_id: str):
+        self._local.remove(admin_id)
+        if admin_id in self._regions:
+            self._removed.add(admin_id)
+
+    def has_id(self, admin_id: str) -> bool:
+        return self._local.has_id(admin_id) or (admin_id not in self._removed and admin_id in self._regions)
+
+    def has_name(self, name: str) -> bool:
+        return bool(self.find(name))
+
+    def get(self, admin_id: str) -> Optional[Region]:
+        return self._local.get(admin_id) or self._shared(admin_id)
+
+    def find(self, name: str) -> List[Region]:
+        regions = self._local.find(name)
+        for admin_id in self._names.get(name.lower(), []):
+            region = self._shared(admin_id)
+            if region:
+                regions.append(region)
+        return regions
+
+    def names(self) -> Iterable[Tuple[str, List[str]]]:
+        local = dict(self._local.names())
+        for name in self._names:
+            ids = [admin_id for admin_id in self._names[name] if admin_id not in self._removed] + local.pop(name, [])
+            if ids:
+                yield name, ids
+        yield from local.items()
+
+    def regions(self) -> Iterable[Region]:
+        for admin_id in self._regions:
+            region = self._shared(admin_id)
+            if region:
+                yield region
+        yield from self._local.regions()
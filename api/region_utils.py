@@ -1,63 +1,238 @@
 # This class encapsulates region queries and caches results, so that the database it not contacted over and over again
 # each time a region is required
 
-from typing import Dict, Set, List
+import os
+import threading
+import time
+from typing import Dict, Set, List, Optional
+
+from flask import current_app, has_app_context
+
 from db.sql.dal import Region
 from db.sql import dal
+from api.region_index import RegionIndex, SharedRegionIndex
+from api.shared_snapshot import shared_snapshot, Snapshot
 
 class _RegionCache:
-    # Region storage
-    _regions: Dict[str, Region]   # qnode to region mapping
-    _regions_by_name: Dict[str, Set[Region]] # region name (lowercase) to region mapping. There can be more than one region per name
-    _regions_by_alias: Dict[str, Set[Region]] # Region alias (lowercase)
+    # Regions are stored in a RegionIndex. By default the index starts empty and regions are added to it as they are
+    # queried. It can also be preloaded with all the regions (see preload), in which case regions that are not in it
+    # are only looked up in the database if the index is not complete.
+    #
+    # Names and ids that are not found in the database are remembered for negative_ttl seconds, so they are not looked
+    # up over and over again. Every version_check seconds the cache compares the regions' version stamp in the
+    # database (see dal.query_region_version, a cheap query) with the one it was filled at, and starts over if they
+    # differ - regions were added or redefined by another process.
+    # Write paths in this process call invalidate.
+    DEFAULTS = dict(negative_ttl=300, version_check=60)
+    MAX_NEGATIVE_ENTRIES = 100000
 
-    def __init__(self):
-        self._regions = {}
-        self._regions_by_name = {}
-        self._regions_by_type = {}
+    _index: RegionIndex
 
-    def _add_regions(self, regions: List[Region]):
-        for region in regions:
-            self._regions[region.admin_id] = region
-
-            name = region.admin.lower()
-            if not name in self._regions_by_name:
-                self._regions_by_name[name] = set()
-            self._regions_by_name[name].add(region)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = RegionIndex()
+        self._source = None  # The preload source
+        self._negative: Dict[str, float] = {}  # 'name:...' or 'id:...' to expiry time
+        self._version: Optional[str] = None
+        self._version_checked = None
+        self._attached: Optional[Snapshot] = None  # The last shared snapshot the cache was filled from
+        self._stats = dict(hits=0, misses=0, negative_hits=0, invalidations=0, reloads=0)
 
-            if region.alias:
-                alias = region.alias.lower()
-                if not alias in self._regions_by_name:
-                    self._regions_by_name[alias] = set()
-                self._regions_by_name[alias].add(region)
+    @staticmethod
+    def _config() -> Dict:
+        config = dict(_RegionCache.DEFAULTS)
+        if has_app_context():
+            config.update(current_app.config.get('REGION_CACHE') or {})
+        return config
 
     def _load_from_db(self, names: Set[str]=set(), ids: Set[str]=set()) -> None:
         if not names and not ids:
             return
 
         regions = dal.query_admins(admins = list(names), admin_ids = list(ids))
-        self._add_regions(regions)
+        with self._lock:
+            self._index.add_regions(regions)
+
+            # Remember what was not found
+            now = time.monotonic()
+            if len(self._negative) > self.MAX_NEGATIVE_ENTRIES:
+                self._negative = {key: expiry for (key, expiry) in self._negative.items() if expiry >= now}
+            expiry = now + self._config()['negative_ttl']
+            for name in names:
+                if not self._index.has_name(name):
+                    self._negative[f'name:{name}'] = expiry
+            for id in ids:
+                if not self._index.has_id(id):
+                    self._negative[f'id:{id}'] = expiry
+
+    def _is_negative(self, key: str, now: float) -> bool:
+        expiry = self._negative.get(key)
+        if expiry is None:
+            return False
+        if expiry < now:
+            self._negative.pop(key, None)
+            return False
+        return True
+
+    def _check_version(self) -> None:
+        # Starts over if the regions in the database have changed since the cache was filled
+        interval = self._config()['version_check']
+        if interval is None or not has_app_context():
+            return
+        now = time.monotonic()
+        if self._version_checked is not None and now - self._version_checked < interval:
+            return
+        self._version_checked = now
+
+        version = dal.query_region_version()
+        if self._version is not None and version != self._version:
+            self._reset()
+        self._version = version
+
+    def _check_shared(self) -> None:
+        # Attaches to the shared snapshot once the loader has replaced it
+        if self._config().get('preload') != 'shared':
+            return
+        snapshot = shared_snapshot.get()
+        if snapshot and snapshot is not self._attached:
+            self._attach(snapshot)
+
+    def _attach(self, snapshot: Snapshot) -> None:
+        index = SharedRegionIndex(snapshot)
+        with self._lock:
+            self._index = index
+            self._negative = {}
+            self._source = 'shared'
+            self._attached = snapshot
+            self._version, self._version_checked = snapshot.meta['regions']['version'], time.monotonic()
+
+    def _reset(self) -> None:
+        # Drops all the cached regions, reloading them if they were preloaded from the database. A snapshot no
+        # longer matches the database, so the cache falls back to loading regions as they are requested (until the
+        # loader replaces a shared snapshot)
+        if self._source == 'database':
+            index = RegionIndex.from_database()
+        else:
+            index = RegionIndex()
+        with self._lock:
+            if self._source == 'database':
+                self._stats['reloads'] += 1
+            else:
+                self._source = None
+            self._index = index
+            self._negative = {}
+
+    def preload(self, source: str, snapshot: str = None) -> None:
+        # Replaces the cached regions with all the regions - from the database if source is 'database', from the
+        # snapshot file written by script/region_index.py if source is 'snapshot', or from the SHARED_SNAPSHOT file
+        # written by script/shared_snapshot.py if source is 'shared'. Requires an app context
+        if source == 'shared':
+            snapshot = shared_snapshot.get()
+            if not snapshot:
+                raise ValueError('There is no shared snapshot')
+            self._attach(snapshot)
+            return
+
+        if source == 'database':
+            index = RegionIndex.from_database()
+        elif source == 'snapshot':
+            index = RegionIndex.load(snapshot)
+        else:
+            raise ValueError(f'Unknown region cache source {source}')
+        version = dal.query_region_version()
+        with self._lock:
+            self._index = index
+            self._negative = {}
+            self._source = source
+            self._version, self._version_checked = version, time.monotonic()
+
+    def invalidate(self, region_ids: List[str] = None) -> None:
+        # Called after regions are written. Drops the given regions (ids of other entities are ignored), or all the
+        # regions if region_ids is None, and forgets the names and ids that were not found. Requires an app context
+        if region_ids is None:
+            with self._lock:
+                self._stats['invalidations'] += 1
+            self._reset()
+            return
+
+        with self._lock:
+            self._stats['invalidations'] += 1
+            for id in region_ids:
+                self._index.remove(id)
+            self._negative = {}
+        if self._index.complete:  # Regions missing from a complete index do not exist, so read them again
+            self._load_from_db(ids=set(region_ids))
+        self._version = None  # The write changed the version, there is no need to start over when it is checked
+
+    def clear(self) -> None:
+        with self._lock:
+            self._index = RegionIndex()
+            self._negative = {}
+            self._source = self._version = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def stats(self) -> Dict:
+        # Counters for monitoring. Hits and misses are counted per requested name or id
+        with self._lock:
+            now = time.monotonic()
+            return dict(self._stats,
+                        regions=len(self._index),
+                        complete=self._index.complete,
+                        source=self._source,
+                        negative_entries=sum(1 for expiry in self._negative.values() if expiry >= now),
+                        version=self._version)
+
+    def get_index(self):
+        # The index of all the regions (a RegionIndex or SharedRegionIndex), preloading them from the database if the
+        # cache does not have all of them. Requires an app context
+        self._check_shared()
+        self._check_version()
+        if not self._index.complete:
+            self.preload('database')
+        return self._index
+
+    def find_regions(self, name: str) -> List[Region]:
+        # The cached regions with this name or alias, call get_regions first to load them
+        return self._index.find(name)
 
     def get_regions(self, region_names: List[str]=[], region_ids: List[str]=[], region_type=None) -> Dict[str, Region]:
-        # Find missing names and ids
+        self._check_shared()
+        self._check_version()
+
+        # Find missing names and ids, skipping those recently not found in the database
         region_names = [name.lower() for name in region_names]
-        missing_names = set(region_names) - set(self._regions_by_name.keys())
-        missing_ids = set(region_ids) - set(self._regions.keys())
+        missing_names = set()
+        missing_ids = set()
+        now = time.monotonic()
+        with self._lock:
+            index = self._index
+            for (keys, has, prefix, missing) in ((region_names, index.has_name, 'name', missing_names),
+                                                 (region_ids, index.has_id, 'id', missing_ids)):
+                for key in keys:
+                    if has(key):
+                        self._stats['hits'] += 1
+                    elif index.complete or self._is_negative(f'{prefix}:{key}', now):
+                        self._stats['negative_hits'] += 1
+                    else:
+                        self._stats['misses'] += 1
+                        missing.add(key)
 
-         # Query database for the rest
+        # Query database for the rest
         self._load_from_db(names=missing_names, ids=missing_ids)
+        index = self._index
 
         # Now return everything we have, first ids
         regions = {}
         for id in region_ids:
-            region = self._regions.get(id)
+            region = index.get(id)
             if region and (region_type is None or region.region_type==region_type):
                 regions[region.admin_id] = region
 
         # Now names
         for name in region_names:
-            name_regions = self._regions_by_name.get(name.lower(), set())
-            for region in name_regions:
+            for region in index.find(name):
                 if region_type is None or region.region_type == region_type:
                     regions[region.admin_id] = region
 
@@ -65,6 +240,22 @@ class _RegionCache:
 
 region_cache = _RegionCache()  # Public, process-wide
 
+def init_region_cache(app) -> None:
+    # Preloads the region cache when the app starts, if REGION_CACHE asks for it
+    config = app.config.get('REGION_CACHE') or {}
+    source = config.get('preload')
+    if not source:
+        return
+
+    snapshot = app.config.get('SHARED_SNAPSHOT') if source == 'shared' else config.get('snapshot')
+    if source in ('snapshot', 'shared') and not (snapshot and os.path.isfile(snapshot)):
+        print(f'Region snapshot {snapshot} does not exist, regions will be loaded as they are requested')
+        return
+
+    with app.app_context():
+        region_cache.preload(source, snapshot)
+    print(f'Region cache preloaded with {len(region_cache)} regions from the {source}')
+
 class UnknownSubjectError(Exception):
     def __init__(self, *errors):
         super().__init__()
@@ -97,20 +288,9 @@ def get_query_region_ids(request_args) -> Dict[str, List[str]]:
 
     # Query those regions
     found_regions_by_id = region_cache.get_regions(region_names=arg_names, region_ids=arg_ids)
-    found_regions_by_name: Dict[
-        str, Set[Region]] = {}  # Organize by name for easy lookup, there can be numerous regions per name
-    for region in found_regions_by_id.values():
-        name = region.admin.lower()
-        if not name in found_regions_by_name:
-            found_regions_by_name[name] = {region}
-        else:
-            found_regions_by_name[name].add(region)
-        if region.alias:
-            alias = region.alias.lower()
-            if not alias in found_regions_by_name:
-                found_regions_by_name[alias] = {region}
-            else:
-                found_regions_by_name[alias].add(region)
+    # Organize by name for easy lookup, there can be numerous regions per name, and a region can have several aliases
+    found_regions_by_name: Dict[str, List[Region]] = {name.lower(): region_cache.find_regions(name)
+                                                      for name in arg_names}
 
     # Now go over the queried regions and make sure we have everything we asked for
     errors = []
@@ -121,7 +301,7 @@ def get_query_region_ids(request_args) -> Dict[str, List[str]]:
         arg_names = [name for name in request_args.getlist(arg)]
         for name in arg_names:
             found = False
-            for candidate in found_regions_by_name.get(name.lower(), set()):
+            for candidate in found_regions_by_name.get(name.lower(), []):
                 if candidate.region_type == arg_type:
                     result_regions[arg].append(candidate.admin_id)
                     found = True
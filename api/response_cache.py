@@ -0,0 +1,161 @@
+# This module caches rendered variable data responses, so that clients polling the same variables do not run the data
+# query over and over again.
+#
+# Entries are keyed by the dataset's last_update. Every write path bumps it once its data is in (see
+# DatasetMetadataUpdater.update), so after a write in any process the old entries are no longer reachable. The writing
+# process also drops the dataset's entries right away, and entries expire after a while, in case the database is
+# written to behind the API's back.
+
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from flask import current_app
+
+CacheKey = Tuple[str, str, Tuple, str, str]
+
+# Query arguments that do not change the response
+_IGNORED_ARGS = {'stream', 'format'}
+
+
+class _CacheEntry:
+    __slots__ = ('dataset', 'body', 'path', 'size', 'created')
+
+    def __init__(self, dataset: str, body: bytes):
+        self.dataset = dataset
+        self.body = body  # None once the entry has been moved to disk
+        self.path = None
+        self.size = len(body)
+        self.created = time.monotonic()
+
+
+class _ResponseCache:
+    """ A process-wide LRU cache of response bodies.
+
+    Entries are kept in memory up to max_memory bytes. If a directory is configured, entries evicted from memory are
+    written there, up to max_disk bytes, otherwise they are dropped. Entries older than ttl seconds are not served.
+    """
+    DEFAULTS = dict(max_memory=256 * 1024 * 1024, directory=None, max_disk=4 * 1024 * 1024 * 1024, ttl=3600)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory: Dict[CacheKey, _CacheEntry] = OrderedDict()
+        self._disk: Dict[CacheKey, _CacheEntry] = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._disk_dir = None
+
+    @staticmethod
+    def _config() -> Dict:
+        config = dict(_ResponseCache.DEFAULTS)
+        config.update(current_app.config.get('RESPONSE_CACHE') or {})
+        return config
+
+    @staticmethod
+    def make_key(dataset: str, variable: str, args, last_update, fmt: str = 'csv') -> Optional[CacheKey]:
+        # Returns the cache key of a request, or None if the response should not be cached (datasets without a
+        # last_update cannot be versioned). args is the request's MultiDict of query arguments, fmt the negotiated
+        # response format
+        if not last_update:
+            return None
+        normalized = tuple(sorted((name, tuple(sorted(values))) for (name, values) in args.lists()
+                                  if name not in _IGNORED_ARGS))
+        return dataset, variable, normalized, str(last_update), fmt
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        ttl = self._config()['ttl']
+        with self._lock:
+            for entries in (self._memory, self._disk):
+                entry = entries.get(key)
+                if entry:
+                    break
+            else:
+                return None
+
+            if time.monotonic() - entry.created > ttl:
+                self._remove(key)
+                return None
+
+            entries.move_to_end(key)
+            if entry.body is not None:
+                return entry.body
+            path = entry.path
+
+        # Read outside the lock, the file may have been evicted meanwhile
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: CacheKey, dataset: str, body: bytes):
+        config = self._config()
+        if len(body) > max(config['max_memory'], config['max_disk'] if config['directory'] else 0):
+            return
+
+        with self._lock:
+            self._remove(key)
+            entry = _CacheEntry(dataset, body)
+            self._memory[key] = entry
+            self._memory_size += entry.size
+
+            # Evict the least recently used entries, moving them to disk if there is room for them there
+            while self._memory_size > config['max_memory']:
+                (old_key, old_entry) = self._memory.popitem(last=False)
+                self._memory_size -= old_entry.size
+                if config['directory'] and old_entry.size <= config['max_disk']:
+                    self._write_to_disk(old_key, old_entry, config)
+
+    def invalidate(self, dataset: str = None):
+        # Drops the cached responses of dataset, or of all datasets if dataset is None
+        with self._lock:
+            for entries in (self._memory, self._disk):
+                for (key, entry) in list(entries.items()):
+                    if dataset is None or entry.dataset == dataset:
+                        self._remove(key)
+
+    def _write_to_disk(self, key: CacheKey, entry: _CacheEntry, config: Dict):
+        # Called with the lock held
+        if not self._disk_dir:
+            os.makedirs(config['directory'], exist_ok=True)
+            self._disk_dir = tempfile.mkdtemp(prefix='responses-', dir=config['directory'])
+            atexit.register(shutil.rmtree, self._disk_dir, True)
+
+        while self._disk and self._disk_size + entry.size > config['max_disk']:
+            self._remove(next(iter(self._disk)))
+
+        path = os.path.join(self._disk_dir, hashlib.sha256(repr(key).encode('utf-8')).hexdigest())
+        try:
+            with open(path, 'wb') as f:
+                f.write(entry.body)
+        except OSError:
+            return  # Out of disk space or similar, just drop the entry
+
+        entry.body = None
+        entry.path = path
+        self._disk[key] = entry
+        self._disk_size += entry.size
+
+    def _remove(self, key: CacheKey):
+        # Called with the lock held
+        entry = self._memory.pop(key, None)
+        if entry:
+            self._memory_size -= entry.size
+            return
+
+        entry = self._disk.pop(key, None)
+        if entry:
+            self._disk_size -= entry.size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+response_cache = _ResponseCache()  # Public, process-wide
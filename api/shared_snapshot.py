@@ -0,0 +1,215 @@
+# A read-only snapshot file shared by all the worker processes of a deployment.
+#
+# The snapshot holds the regions and the country wikifier memo. It is built by a loader process
+# (script/shared_snapshot.py) and memory-mapped by the workers, so its pages are shared by all of them instead of each
+# worker building its own copy. Entries are read straight from the mapping through hash tables of offsets, and
+# decoded only when they are looked up.
+#
+# The loader writes a new snapshot next to the current one and renames it over it. Workers keep reading the file they
+# mapped, and notice the new file within CHECK_INTERVAL seconds.
+#
+# File layout (integers are little endian):
+#   magic (8 bytes), header length (uint64), header (JSON - the tables' offsets, slot and entry counts, and meta data)
+#   each table: slots (uint64 key hash, uint64 entry offset - 0 for an empty slot), then entries
+#   each entry: key length (uint32), value length (uint32), key (UTF-8), value (UTF-8 JSON)
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import current_app, has_app_context
+
+MAGIC = b'DMSNAP01'
+_SLOT = struct.Struct('<QQ')
+_ENTRY = struct.Struct('<II')
+_LENGTH = struct.Struct('<Q')
+
+CHECK_INTERVAL = 5  # Seconds between checks for a new snapshot file
+
+
+def _hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+class SnapshotTable(Mapping):
+    """ A read-only mapping from strings to JSON values, backed by the snapshot's memory map """
+
+    def __init__(self, buffer: mmap.mmap, offset: int, slots: int, count: int):
+        self._buffer = buffer
+        self._offset = offset
+        self._slots = slots
+        self._count = count
+
+    def _entry(self, entry_offset: int):
+        key_length, value_length = _ENTRY.unpack_from(self._buffer, entry_offset)
+        key_start = entry_offset + _ENTRY.size
+        return key_start, key_length, key_start + key_length, value_length
+
+    def _find(self, key: str) -> Optional[int]:
+        # The offset of key's entry, None if it is not in the table
+        encoded = key.encode('utf-8')
+        key_hash = _hash(encoded)
+        mask = self._slots - 1
+        slot = key_hash & mask
+        while True:
+            slot_hash, entry_offset = _SLOT.unpack_from(self._buffer, self._offset + slot * _SLOT.size)
+            if not entry_offset:
+                return None
+            if slot_hash == key_hash:
+                key_start, key_length, _, _ = self._entry(entry_offset)
+                if self._buffer[key_start:key_start + key_length] == encoded:
+                    return entry_offset
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, key: str) -> Any:
+        entry_offset = self._find(key)
+        if entry_offset is None:
+            raise KeyError(key)
+        _, _, value_start, value_length = self._entry(entry_offset)
+        return json.loads(self._buffer[value_start:value_start + value_length])
+
+    def __contains__(self, key) -> bool:
+        return isinstance(key, str) and self._find(key) is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[str]:
+        for slot in range(self._slots):
+            _, entry_offset = _SLOT.unpack_from(self._buffer, self._offset + slot * _SLOT.size)
+            if entry_offset:
+                key_start, key_length, _, _ = self._entry(entry_offset)
+                yield self._buffer[key_start:key_start + key_length].decode('utf-8')
+
+
+class Snapshot:
+    """ An open snapshot file """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a shared snapshot')
+        header_length, = _LENGTH.unpack_from(self._buffer, len(MAGIC))
+        header_start = len(MAGIC) + _LENGTH.size
+        self.header = json.loads(self._buffer[header_start:header_start + header_length])
+        self.meta: Dict[str, Any] = self.header['meta']
+        self._tables = {name: SnapshotTable(self._buffer, int(table['offset']), table['slots'], table['count'])
+                        for (name, table) in self.header['tables'].items()}
+
+    def table(self, name: str) -> Optional[SnapshotTable]:
+        return self._tables.get(name)
+
+    def is_current(self) -> bool:
+        # False if the file has been replaced since it was opened
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True  # Keep using the mapped file
+        return (stat.st_ino, stat.st_mtime_ns) == (self.stat.st_ino, self.stat.st_mtime_ns)
+
+
+def write_snapshot(path: str, tables: Dict[str, Dict[str, Any]], meta: Dict[str, Any]):
+    """ Writes a snapshot with the given tables (each a dictionary of JSON values), replacing the file at path
+    atomically """
+    encoded_tables = []
+    for (name, items) in tables.items():
+        slots = 8
+        while slots < len(items) * 2:
+            slots *= 2
+        entries = [(key.encode('utf-8'), json.dumps(value, separators=(',', ':')).encode('utf-8'))
+                   for (key, value) in items.items()]
+        encoded_tables.append((name, slots, entries))
+
+    # The header holds the table offsets, which depend on the header's length. Offsets are padded to a fixed width
+    # so that the header's length does not change when they are filled in
+    def make_header(offsets):
+        return json.dumps(dict(
+            meta=meta,
+            tables={name: dict(offset=f'{offsets.get(name, 0):015d}', slots=slots, count=len(entries))
+                    for (name, slots, entries) in encoded_tables},
+        )).encode('utf-8')
+
+    header_length = len(make_header({}))
+    offset = len(MAGIC) + _LENGTH.size + header_length
+    offsets = {}
+    for (name, slots, entries) in encoded_tables:
+        offsets[name] = offset
+        offset += slots * _SLOT.size + sum(_ENTRY.size + len(key) + len(value) for (key, value) in entries)
+
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        header = make_header(offsets)
+        f.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        for (name, slots, entries) in encoded_tables:
+            table_offset = f.tell()
+            slot_table = [(0, 0)] * slots
+            entry_offset = table_offset + slots * _SLOT.size
+            for (key, value) in entries:
+                key_hash = _hash(key)
+                slot = key_hash & (slots - 1)
+                while slot_table[slot][1]:
+                    slot = (slot + 1) & (slots - 1)
+                slot_table[slot] = (key_hash, entry_offset)
+                entry_offset += _ENTRY.size + len(key) + len(value)
+            f.write(b''.join(_SLOT.pack(*slot) for slot in slot_table))
+            for (key, value) in entries:
+                f.write(_ENTRY.pack(len(key), len(value)) + key + value)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class _SharedSnapshot:
+    # The process-wide open snapshot, reopened when the loader replaces the file
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._checked = 0
+
+    @staticmethod
+    def path() -> Optional[str]:
+        return current_app.config.get('SHARED_SNAPSHOT') if has_app_context() else None
+
+    def get(self) -> Optional[Snapshot]:
+        # The current snapshot, None if SHARED_SNAPSHOT is not set or there is no snapshot file
+        path = self.path()
+        if not path:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            if self._snapshot and self._snapshot.path == path and \
+                    (now - self._checked < CHECK_INTERVAL or self._snapshot.is_current()):
+                self._checked = now
+                return self._snapshot
+            self._checked = now
+            if os.path.isfile(path):
+                self._snapshot = Snapshot(path)
+            else:
+                self._snapshot = None
+            return self._snapshot
+
+
+shared_snapshot = _SharedSnapshot()  # Public, process-wide
+
+
+REGION_FIELDS = ('admin', 'region_type', 'country', 'country_id', 'country_cameo', 'admin1', 'admin1_id', 'admin2',
+                 'admin2_id', 'admin3', 'admin3_id', 'region_coordinate', 'alias')
+
+
+def region_tables(index) -> Dict[str, Dict[str, List]]:
+    """ The snapshot tables of a RegionIndex: regions maps an admin id to its fields (see REGION_FIELDS), region_names
+    a lowercase name or alias to the ids of its regions """
+    return dict(
+        regions={region.admin_id: [region[field] for field in REGION_FIELDS] for region in index.regions()},
+        region_names={name: ids for (name, ids) in index.names()},
+    )
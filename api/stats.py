@@ -0,0 +1,10 @@
+from flask import Blueprint, jsonify
+
+from api.region_utils import region_cache
+
+bp = Blueprint('stats', __name__)
+
+@bp.route('/stats/region-cache')
+def region_cache_stats():
+    # Counters of this worker process's region cache, for monitoring
+    return jsonify(region_cache.stats())
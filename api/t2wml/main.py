@@ -1,4 +1,6 @@
 from db.sql.kgtk import import_kgtk_tsv
+from api.metadata.update import DatasetMetadataUpdater
+from db.sql import dal
 from flask_restful import Resource
 import tempfile
 import os
@@ -26,7 +28,10 @@ class T2WMLResource(Resource):
         tmp_filename = tempfile.mktemp('.tsv')
         try:
             edges.save(tmp_filename)
-            import_kgtk_tsv(tmp_filename, replace=True)
+            import_kgtk_tsv(tmp_filename, replace=True, method='copy')
+            if dal.get_dataset_id(dataset):
+                # update dataset metadata last_updated field, once the data is in
+                DatasetMetadataUpdater().update(dataset)
         finally:
             try:
                 os.remove(tmp_filename)
@@ -25,10 +25,6 @@ class IngestT2WMLOutput(object):
         if not dataset_qnode:
             return {'Error': 'Dataset not found: {}'.format(dataset)}, 404
 
-        if dataset_qnode:
-            # update dataset metadata last_updated field
-            DatasetMetadataUpdater().update(dataset)
-
         t2wml_file_name = request.files['kgtk_output'].filename
         item_defs_file_name = request.files['item_definitions'].filename
         if not t2wml_file_name.endswith('.tsv'):
@@ -54,6 +50,9 @@ class IngestT2WMLOutput(object):
         # All good ingest the tsv file into database.
         import_kgtk_dataframe(df, is_file_exploded=True)
 
+        # update dataset metadata last_updated field, once the data is in
+        DatasetMetadataUpdater().update(dataset)
+
         variables_metadata = []
         for v in variable_ids:
             variables_metadata.append(self.vmr.get(dataset, variable=v)[0])
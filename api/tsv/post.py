@@ -97,6 +97,7 @@ class TsvData(object):
                 traceback.print_exc(file=sys.stdout)
                 raise e
         print('All files have been imported')
+        DatasetMetadataUpdater().update(dataset)
         print(f'time take to import kgtk file into database: {time() - s} seconds')
 
         # Clean up
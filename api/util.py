@@ -168,11 +168,9 @@ def get_edges_from_request() -> pd.DataFrame:
 
     edges = edges.loc[:, valid_column_names]
 
-    with kgtk_wrapper.KGTKPipeline(edges) as pipeline:
-        #ok, err = kgtk_wrapper.validate(pipeline)
-        #if not ok:
-        #    raise ValueError({ 'Error': f'Invalid edge file: {err}' })
-        kgtk_wrapper.add_ids(pipeline)
-        edges = pipeline.read_csv('with-ids.tsv')
+    #ok, err = kgtk_wrapper.validate(pipeline)
+    #if not ok:
+    #    raise ValueError({ 'Error': f'Invalid edge file: {err}' })
+    edges = kgtk_wrapper.add_ids_frame(edges)
 
     return edges
@@ -1 +1 @@
-from .main import VariableResource, VariableResourceAll
\ No newline at end of file
+from .main import VariableResource, VariableResourceAll, VariableAggregateResource
\ No newline at end of file
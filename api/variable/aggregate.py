@@ -0,0 +1,80 @@
+import pandas as pd
+from db.sql import dal
+from flask import request
+from api.definition_cache import definition_cache
+from api.region_utils import get_query_region_ids, UnknownSubjectError
+from api.variable.get import get_query_time_filter
+from api.variable.formats import get_format, frame_response, FormatError
+
+
+class VariableAggregator:
+    DEFAULT_INTERVAL = 'year'
+    DEFAULT_FUNCTIONS = ['mean']
+
+    def get(self, dataset, variable):
+        # Aggregates a variable's values by region level and time bucket in the database, for clients that only need
+        # the rollups and not the raw (and much larger) data
+        level = request.args.get('by', '').lower() or None
+        if level and level not in dal.ADMIN_EDGES:
+            return {'Error': f"Unknown by {level}, expected one of {', '.join(dal.ADMIN_EDGES.keys())}"}, 400
+
+        interval = request.args.get('interval', self.DEFAULT_INTERVAL).lower()
+        if interval not in dal.AGGREGATE_INTERVALS:
+            return {'Error': f"Unknown interval {interval}, expected one of {', '.join(dal.AGGREGATE_INTERVALS)}"}, 400
+
+        functions = []
+        for arg in request.args.getlist('fn') or [','.join(self.DEFAULT_FUNCTIONS)]:
+            for function in arg.split(','):
+                function = function.strip().lower()
+                if function not in dal.AGGREGATE_FUNCTIONS:
+                    return {'Error': f"Unknown fn {function}, expected one of "
+                                     f"{', '.join(dal.AGGREGATE_FUNCTIONS.keys())}"}, 400
+                if function not in functions:
+                    functions.append(function)
+
+        try:
+            time_filter = get_query_time_filter(request.args)
+        except ValueError as ex:
+            return {'Error': str(ex)}, 400
+
+        try:
+            fmt = get_format(request)
+        except FormatError as ex:
+            return ex.get_error_dict(), ex.status_code
+
+        try:
+            regions = get_query_region_ids(request.args)
+        except UnknownSubjectError as ex:
+            return ex.get_error_dict(), 404
+
+        result = definition_cache.get(dataset, variable)
+        if not result:
+            return {'Error': f'Could not find dataset {dataset} variable {variable}'}, 404
+
+        qualifiers = result['qualifiers']
+        if 'time' not in [q.name for q in qualifiers]:
+            return '', 204
+
+        results = dal.query_variable_aggregates(result['dataset_id'], result['property_id'], regions, qualifiers,
+                                                level, interval, functions, time_filter)
+
+        columns = ['dataset_id', 'variable_id', 'variable']
+        if level:
+            columns += [level, f'{level}_id']
+        columns += ['time', 'time_precision'] + functions
+
+        df = pd.DataFrame(results, columns=['region', 'region_id', 'time'] + functions)
+        if level:
+            df = df.rename(columns={'region': level, 'region_id': f'{level}_id'})
+        df['dataset_id'] = dataset
+        df['variable_id'] = variable
+        df['variable'] = result['variable_name']
+        df['time_precision'] = interval
+        df[functions] = df[functions].astype(float)  # Postgres numerics are read as Decimals
+        if 'count' in functions:
+            df['count'] = df['count'].astype(int)
+        label_columns = [column for column in columns if column not in functions]
+        df[label_columns] = df[label_columns].fillna('')
+        df = df[columns]
+
+        return frame_response(df, fmt, f'{variable}_aggregate')
@@ -4,6 +4,7 @@ import numpy as np
 from functools import partial
 import rltk.similarity as sim
 from config import METADATA_DIR
+from api.shared_snapshot import shared_snapshot
 from abc import ABC, abstractmethod
 import os.path
 
@@ -83,13 +84,29 @@ class HybridJaccardSimilarity(StringSimilarityModule):
         return sim.hybrid_jaccard_similarity(set(str1), set(str2))
 
 
+_memos = {}  # Memo files already read by this process
+
+
+def load_country_memo(cache_file: str = "country_wikifier_cache.json"):
+    """
+        The memo of a wikifier cache file, read once per process, or from the shared snapshot if there is one
+    """
+    snapshot = shared_snapshot.get()
+    if snapshot and snapshot.meta.get('country_wikifier') == cache_file:
+        return snapshot.table('country_wikifier')
+
+    if cache_file not in _memos:
+        with open(os.path.join(METADATA_DIR, cache_file), "r", encoding="utf-8") as f:
+            _memos[cache_file] = json.load(f)
+    return _memos[cache_file]
+
+
 class DatamartCountryWikifier:
     def __init__(self, cache_file: str = "country_wikifier_cache.json"):
         self.similarity_unit = HybridJaccardSimilarity(tl_args={"ignore_case": True}, tokenizer="word")
         self._logger = logging.getLogger(__name__)
 
-        with open(os.path.join(METADATA_DIR, cache_file), "r", encoding="utf-8") as f:
-            self.memo = json.load(f)
+        self.memo = load_country_memo(cache_file)
 
     def save(self, loc: str = "country_wikifier_cache.json") -> None:
         """
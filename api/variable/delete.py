@@ -11,6 +11,6 @@ class VariableDeleter():
             }
             return content, 404
 
-        DatasetMetadataUpdater().update(dataset)
         dal.delete_variable(result['dataset_id'], result['variable_id'], result['property_id'], False)
+        DatasetMetadataUpdater().update(dataset)
         return {"Message": f'Canonical data for Variable: {variable} in Dataset: {dataset} is deleted.'}, 200
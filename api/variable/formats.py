@@ -0,0 +1,117 @@
+# Output formats of variable data. CSV is always available, the columnar formats (Parquet, Arrow IPC and Feather)
+# require pyarrow. It is in requirements.txt, but the server also runs without it - requests for them are then
+# rejected with a 406.
+#
+# The columnar formats are typed: value is a float, time a UTC timestamp, and the other columns are strings, dictionary
+# encoded when they repeat (as most of them do - variable, units, regions and so on). Columns that are already numeric
+# in the data frame, such as aggregates, are kept as they are.
+
+import io
+
+import pandas as pd
+from flask import make_response, Response
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.feather
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'feather': 'application/vnd.apache.arrow.file',
+}
+
+EXTENSIONS = {
+    'csv': 'csv',
+    'parquet': 'parquet',
+    'arrow': 'arrows',
+    'feather': 'feather',
+}
+
+
+class FormatError(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+    def get_error_dict(self):
+        return {'Error': self.message}
+
+
+def get_format(request) -> str:
+    # Returns the format requested by the format query argument, or else by the Accept header. CSV is the default
+    fmt = request.args.get('format')
+    if fmt:
+        fmt = fmt.lower()
+        if fmt not in MIME_TYPES:
+            raise FormatError(f"Unknown format {fmt}, expected one of {', '.join(MIME_TYPES.keys())}", 400)
+    else:
+        mime_type = request.accept_mimetypes.best_match(list(MIME_TYPES.values()), default='text/csv')
+        fmt = [name for (name, value) in MIME_TYPES.items() if value == mime_type][0]
+
+    if fmt != 'csv' and pyarrow is None:
+        raise FormatError(f'Format {fmt} is not supported by this server, pyarrow is not installed', 406)
+    return fmt
+
+
+def body_response(body, fmt: str, filename: str) -> Response:
+    # Wraps an already serialized body in a response. filename has no extension
+    output = make_response(body)
+    output.headers['Content-Disposition'] = f'attachment; filename={filename}.{EXTENSIONS[fmt]}'
+    output.headers['Content-type'] = MIME_TYPES[fmt]
+    output.headers['Vary'] = 'Accept'
+    return output
+
+
+def to_arrow_table(df: pd.DataFrame) -> 'pyarrow.Table':
+    # Converts a variable's data frame, where everything is a string and N/A or '' are missing values, to a typed table
+    df = df.replace({'N/A': None, '': None})
+    if 'value' in df.columns:
+        df['value'] = pd.to_numeric(df['value'], errors='coerce')
+    df = df.astype({column: object for column in df.columns if column != 'value'})
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+
+    for (i, field) in enumerate(table.schema):
+        column = table.column(i)
+        if field.name == 'time':
+            # Times are ISO strings with second precision, parsed by pyarrow since they can fall out of pandas' range
+            column = pyarrow.compute.strptime(column.cast(pyarrow.string()), format='%Y-%m-%dT%H:%M:%SZ', unit='s',
+                                              error_is_null=True).cast(pyarrow.timestamp('s', tz='UTC'))
+        elif field.name != 'value' and not pyarrow.types.is_floating(field.type) \
+                and not pyarrow.types.is_integer(field.type):
+            column = column.cast(pyarrow.string())
+            if len(column) and pyarrow.compute.count_distinct(column).as_py() <= len(column) / 2:
+                column = column.dictionary_encode()
+        table = table.set_column(i, pyarrow.field(field.name, column.type), column)
+
+    return table
+
+
+def serialize_frame(df: pd.DataFrame, fmt: str) -> bytes:
+    # Serializes a variable's data frame in one of the columnar formats
+    table = to_arrow_table(df)
+    sink = io.BytesIO()
+    if fmt == 'parquet':
+        pyarrow.parquet.write_table(table, sink)
+    elif fmt == 'feather':
+        pyarrow.feather.write_feather(table, sink)
+    elif fmt == 'arrow':
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f'Unexpected format {fmt}')
+    return sink.getvalue()
+
+
+def frame_response(df: pd.DataFrame, fmt: str, filename: str) -> Response:
+    # Returns a response with the data frame in the requested format. filename has no extension
+    if fmt == 'csv':
+        return body_response(df.to_csv(index=False), fmt, filename)
+    return body_response(serialize_frame(df, fmt), fmt, filename)
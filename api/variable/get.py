@@ -1,11 +1,19 @@
+import base64
+import datetime
+import json
+import re
 import pandas as pd
 from enum import Enum
+from urllib.parse import urlencode
 from db.sql import dal
 from db.sql.dal import Region
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Tuple, Optional
 from api.util import TimePrecision
-from flask import request, make_response
+from flask import request, Response, stream_with_context
 from api.region_utils import get_query_region_ids, region_cache, UnknownSubjectError
+from api.definition_cache import definition_cache
+from api.response_cache import response_cache
+from api.variable.formats import get_format, body_response, frame_response, FormatError
 
 DROP_QUALIFIERS = [
     'pq:P585', 'P585'  # time
@@ -49,6 +57,72 @@ COMMON_COLUMN = {
 }
 
 
+def encode_page_token(main_subject_id: str, time: str, edge_id: str) -> str:
+    # The page token is opaque to clients, it holds the sort key of the last row of the page
+    token = json.dumps([main_subject_id, time, edge_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(token.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_page_token(page_token: str) -> Tuple[str, str, str]:
+    # Raises ValueError if the token was not returned by encode_page_token
+    try:
+        padded = page_token + '=' * (-len(page_token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except Exception as ex:
+        raise ValueError('Invalid page token') from ex
+    if not isinstance(key, list) or len(key) != 3 or not all(isinstance(value, str) for value in key):
+        raise ValueError('Invalid page token')
+    return key[0], key[1], key[2]
+
+
+def parse_time_arg(value: str) -> Tuple[datetime.datetime, datetime.datetime]:
+    # Parses a start_time or end_time argument - a year (2010), a month (2010-05), a date or an ISO timestamp.
+    # Returns the start of the period it names, and the start of the following period. Raises ValueError
+    value = value.strip()
+    if re.fullmatch(r'\d{4}', value):
+        year = int(value)
+        return datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+    if re.fullmatch(r'\d{4}-\d{2}', value):
+        (year, month) = [int(part) for part in value.split('-')]
+        start = datetime.datetime(year, month, 1)
+        return start, datetime.datetime(year + month // 12, month % 12 + 1, 1)
+    if re.fullmatch(r'\d{4}-\d{2}-\d{2}', value):
+        start = datetime.datetime.fromisoformat(value)
+        return start, start + datetime.timedelta(days=1)
+
+    if value[-1:] in ('Z', 'z'):  # fromisoformat only accepts Z from Python 3.11 on
+        value = value[:-1] + '+00:00'
+    start = datetime.datetime.fromisoformat(value)
+    if start.tzinfo:
+        start = start.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return start, start + datetime.timedelta(microseconds=1)
+
+
+def get_query_time_filter(request_args) -> Optional[dal.TimeFilter]:
+    # Returns the filter specified by the start_time, end_time and precision arguments, or None if there are none.
+    # Both ends of the range are inclusive - end_time=2010 includes all of 2010. Raises ValueError
+    start_time = request_args.get('start_time')
+    end_time = request_args.get('end_time')
+    precision = request_args.get('precision')
+    if not start_time and not end_time and not precision:
+        return None
+
+    try:
+        start = parse_time_arg(start_time)[0] if start_time else None
+        end = parse_time_arg(end_time)[1] if end_time else None
+    except ValueError:
+        raise ValueError('start_time and end_time should be a year, a month (YYYY-MM), a date or an ISO timestamp')
+
+    if precision:
+        if precision.isdigit():
+            precision = int(precision)
+            TimePrecision.to_name(precision)  # Raises ValueError for unknown precisions
+        else:
+            precision = TimePrecision.to_int(precision)
+
+    return dal.TimeFilter(start, end, precision)
+
+
 class GeographyLevel(Enum):
     COUNTRY = 0
     ADMIN1 = 1
@@ -58,6 +132,9 @@ class GeographyLevel(Enum):
 
 
 class VariableGetter:
+    STREAM_BATCH_SIZE = 10000  # Rows per chunk of streamed responses
+    DEFAULT_PAGE_SIZE = 10000  # Page size of requests with a page_token and no page_size
+
     def get(self, dataset, variable):
 
         include_cols = [col.lower() for col in request.args.getlist('include') or []]
@@ -70,13 +147,58 @@ class VariableGetter:
             except:
                 pass
 
+        stream = request.args.get('stream', 'false').lower() == 'true'
+
+        # Keyset pagination - page_token is the continuation token returned with the previous page
+        page_size = None
+        after = None
+        if request.args.get('page_size') is not None or request.args.get('page_token') is not None:
+            try:
+                page_size = int(request.args.get('page_size', self.DEFAULT_PAGE_SIZE))
+                if page_size <= 0:
+                    raise ValueError()
+            except ValueError:
+                return {'Error': 'page_size must be a positive integer'}, 400
+            if request.args.get('page_token'):
+                try:
+                    after = decode_page_token(request.args.get('page_token'))
+                except ValueError as ex:
+                    return {'Error': str(ex)}, 400
+
+        try:
+            time_filter = get_query_time_filter(request.args)
+        except ValueError as ex:
+            return {'Error': str(ex)}, 400
+
+        try:
+            fmt = get_format(request)
+        except FormatError as ex:
+            return ex.get_error_dict(), ex.status_code
+
         try:
             regions = get_query_region_ids(request.args)
         except UnknownSubjectError as ex:
             return ex.get_error_dict(), 404
 
+        if page_size:
+            # Pages are not cached, their responses carry the next page's link
+            return self.get_direct(dataset, variable, include_cols, exclude_cols, limit, regions, fmt=fmt,
+                                   page_size=page_size, after=after, time_filter=time_filter)
+
+        # Responses are cached until the dataset is updated
+        cache_key = response_cache.make_key(dataset, variable, request.args, dal.request_dataset_last_update(dataset),
+                                            fmt)
+        if cache_key:
+            body = response_cache.get(cache_key)
+            if body is not None:
+                return body_response(body, fmt, variable)
+
         # print((dataset, variable, include_cols, exclude_cols, limit, regions))
-        return self.get_direct(dataset, variable, include_cols, exclude_cols, limit, regions)
+        output = self.get_direct(dataset, variable, include_cols, exclude_cols, limit, regions, stream=stream, fmt=fmt,
+                                 time_filter=time_filter)
+        if cache_key and isinstance(output, Response) and output.status_code == 200 and not output.is_streamed:
+            response_cache.put(cache_key, dataset, output.get_data())
+        return output
 
     def get_result_regions(self, df_location) -> Dict[str, Region]:
         # Get all the regions that have rows in the dataframe
@@ -91,48 +213,88 @@ class VariableGetter:
         except ValueError:
             return 'N/A'
 
+    def next_page_headers(self, page_size, last_row) -> Dict[str, str]:
+        # The Link and X-Next-Page-Token headers pointing to the page after last_row
+        token = encode_page_token(last_row['main_subject_id'], last_row['time'].rstrip('Z'), last_row['edge_id'])
+        args = [(name, value) for (name, value) in request.args.items(multi=True)
+                if name not in ('page_token', 'page_size')]
+        args += [('page_size', page_size), ('page_token', token)]
+        url = f'{request.base_url}?{urlencode(args)}'
+        return {
+            'Link': f'<{url}>; rel="next"',
+            'X-Next-Page-Token': token,
+        }
+
     def get_direct(self, dataset, variable, include_cols, exclude_cols, limit, regions: Dict[str, List[str]] = {},
-                   return_df=False):
-        result = dal.query_variable(dataset, variable)
+                   return_df=False, stream=False, fmt='csv', page_size=None, after: Tuple[str, str, str] = None,
+                   time_filter: dal.TimeFilter = None):
+        # With page_size, returns a page of at most page_size rows following the row whose sort key is after, and
+        # limit and stream are ignored
+        result = definition_cache.get(dataset, variable)
         if not result:
             content = {
                 'Error': f'Could not find dataset {dataset} variable {variable}'
             }
             return content, 404
 
-        qualifiers = dal.query_qualifiers(result['dataset_id'], result['variable_qnode'])
+        qualifiers = result['qualifiers']
         qualifier_names = set([q.name for q in qualifiers])
         if 'time' not in qualifier_names:
             if return_df:
                 return None
             return '', 204
 
-        tags = dal.query_tags(result['dataset_id'], result['variable_qnode'])
+        tags = result['tags']
 
-        location_qualifier = 'location' in [q.name for q in qualifiers]
         # qualifiers = {key: value for key, value in qualifiers.items() if key not in DROP_QUALIFIERS}
         select_cols = self.get_columns(include_cols, exclude_cols, qualifiers)
 
-        # Needed for place columns
-        if 'main_subject_id' in select_cols:
-            temp_cols = select_cols
+        temp_cols = self.get_temp_cols(select_cols, qualifiers)
+
+        def enrich(result_df):
+            return self.enrich_data_frame(result_df, dataset, variable, result['variable_name'], select_cols, tags,
+                                          exclude_cols)
+
+        if stream and not return_df and fmt == 'csv':
+            batches = dal.query_variable_data_batches(result['dataset_id'], result['property_id'], regions,
+                                                      qualifiers, limit, temp_cols, self.STREAM_BATCH_SIZE,
+                                                      time_filter=time_filter)
+            return self.stream_csv(batches, temp_cols, enrich, f'{variable}.csv')
+
+        next_page_headers = {}
+        if page_size:
+            # Read one more row to know whether there is a next page
+            results = dal.query_variable_data(result['dataset_id'], result['property_id'], regions, qualifiers,
+                                              page_size + 1, temp_cols, after=after, time_filter=time_filter)
+            if len(results) > page_size:
+                results = results[:page_size]
+                next_page_headers = self.next_page_headers(page_size, results[-1])
         else:
-            temp_cols = ['main_subject_id'] + select_cols
+            results = dal.query_variable_data(result['dataset_id'], result['property_id'], regions, qualifiers, limit,
+                                              temp_cols, time_filter=time_filter)
 
-        if location_qualifier and 'location_id' not in temp_cols:
-            temp_cols = ['location_id'] + temp_cols
+        result_df = pd.DataFrame(results, columns=temp_cols).fillna('')
+        result_df = enrich(result_df)
 
-        results = dal.query_variable_data(result['dataset_id'], result['property_id'], regions, qualifiers, limit,
-                                          temp_cols)
+        if return_df:
+            return result_df
 
-        result_df = pd.DataFrame(results, columns=temp_cols).fillna('')
+        result_df = self.prepare_csv_frame(result_df)
+        output = frame_response(result_df, fmt, variable)
+        output.headers.extend(next_page_headers)
+        return output
 
+    def enrich_data_frame(self, result_df, dataset, variable, variable_name, select_cols, tags, exclude_cols):
+        # Turn the raw query results into the variable's data frame - fill the variable columns, add regions and tags
         if 'dataset_id' in result_df.columns:
             result_df['dataset_id'] = dataset
         if 'variable_id' in result_df.columns:
             result_df['variable_id'] = variable
-        result_df.loc[:, 'variable'] = result['variable_name']
-        result_df['time_precision'] = result_df['time_precision'].map(self.fix_time_precision)
+        result_df.loc[:, 'variable'] = variable_name
+        # There are only a handful of distinct precisions, convert each of them once
+        precisions = result_df['time_precision']
+        result_df['time_precision'] = precisions.map({precision: self.fix_time_precision(precision)
+                                                      for precision in precisions.unique()})
 
         self.add_region_columns(result_df, select_cols)
         self.add_tag_columns(result_df, tags, exclude_cols)
@@ -140,19 +302,47 @@ class VariableGetter:
         if 'main_subject_id' not in select_cols:
             result_df = result_df.drop(columns=['main_subject_id'])
 
-        if return_df:
-            return result_df
+        return result_df
 
+    def prepare_csv_frame(self, result_df):
         result_df.replace('N/A', '', inplace=True)
         # TODO SUPER HACK FOR CAUSX on Nov 3, 2020: IF COLUMNS HAVE "Units", REMOVE 'value_unit'
         if 'Units' in result_df and 'value_unit' in result_df:
             result_df.drop(columns=['value_unit'], inplace=True)
-        csv = result_df.to_csv(index=False)
-        output = make_response(csv)
-        output.headers['Content-Disposition'] = f'attachment; filename={variable}.csv'
+        return result_df
+
+    def stream_csv(self, batches, temp_cols, enrich, filename):
+        # Writes the CSV one batch at a time into a chunked response. Only one batch is held in memory, and the
+        # first rows are sent before the rest of the variable has been read from the database.
+        def generate():
+            header = True
+            for batch_df in batches:
+                batch_df = enrich(batch_df.reindex(columns=temp_cols).fillna(''))
+                yield self.prepare_csv_frame(batch_df).to_csv(index=False, header=header)
+                header = False
+
+            if header:  # No rows at all, we still need the header line
+                empty_df = enrich(pd.DataFrame([], columns=temp_cols))
+                yield self.prepare_csv_frame(empty_df).to_csv(index=False)
+
+        output = Response(stream_with_context(generate()), mimetype='text/csv')
+        output.headers['Content-Disposition'] = f'attachment; filename={filename}'
         output.headers['Content-type'] = 'text/csv'
         return output
 
+    def get_temp_cols(self, select_cols, qualifiers) -> List[str]:
+        # The columns to query - the selected columns, and the columns needed to find the rows' regions
+        if 'main_subject_id' in select_cols:
+            temp_cols = select_cols
+        else:
+            temp_cols = ['main_subject_id'] + select_cols
+
+        location_qualifier = 'location' in [q.name for q in qualifiers]
+        if location_qualifier and 'location_id' not in temp_cols:
+            temp_cols = ['location_id'] + temp_cols
+
+        return temp_cols
+
     def get_columns(self, include_cols, exclude_cols, qualifiers) -> List[str]:
         result = []
         for col, status in COMMON_COLUMN.items():
@@ -193,12 +383,18 @@ class VariableGetter:
         # if not location_in_qualifier:
         #    df['main_subject'] = location_df.map(lambda msid: regions[msid].admin if msid in regions else 'N/A')
 
-        # Add the other columns
+        # Add the other columns, looking all of them up at once in a table of the regions indexed by their id
         region_columns = ['country', 'country_id', 'country_cameo', 'admin1', 'admin1_id', 'admin2', 'admin2_id',
                           'admin3', 'admin3_id', 'region_coordinate']
-        for col in region_columns:
-            if col in select_cols:
-                df[col] = location_df.map(lambda msid: regions[msid][col] if msid in regions else 'N/A')
+        columns = [col for col in region_columns if col in select_cols]
+        if not columns:
+            return
+
+        region_df = pd.DataFrame([[region[col] for col in columns] for region in regions.values()],
+                                 index=list(regions.keys()), columns=columns, dtype=object)
+        region_values = region_df.reindex(location_df.values)
+        region_values[~location_df.isin(regions.keys()).values] = 'N/A'
+        df[columns] = region_values.values
 
     def add_tag_columns(self, df, tags: List[str], exclude_cols: List[str]):
         def tag_to_columns():
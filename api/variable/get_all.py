@@ -1,14 +1,20 @@
 import pandas as pd
+from collections import OrderedDict
+from typing import List
 from db.sql import dal
-from flask import request, make_response
-from api.variable.get import VariableGetter
-from api.metadata.main import VariableMetadataResource
+from flask import request
+from api.variable.get import VariableGetter, get_query_time_filter
 from api.region_utils import get_query_region_ids, UnknownSubjectError
+from api.variable.formats import get_format, frame_response, FormatError
 
 
 class VariableGetterAll:
     vg = VariableGetter()
-    vmr = VariableMetadataResource()
+
+    # Columns that describe the main subject and time of an observation, rather than a variable
+    SUBJECT_COLUMNS = ['dataset_id', 'main_subject', 'main_subject_id', 'time_precision', 'country', 'country_id',
+                       'country_cameo', 'admin1', 'admin1_id', 'admin2', 'admin2_id', 'admin3', 'admin3_id', 'place',
+                       'place_id', 'region_coordinate', 'shape']
 
     def get(self, dataset):
         # check if the dataset exists
@@ -28,59 +34,115 @@ class VariableGetterAll:
             except:
                 pass
 
+        try:
+            time_filter = get_query_time_filter(request.args)
+        except ValueError as ex:
+            return {'Error': str(ex)}, 400
+
+        # format=wide returns a CSV with a column per variable instead of a row per observation
+        wide = request.args.get('format', '').lower() == 'wide'
+        try:
+            fmt = 'csv' if wide else get_format(request)
+        except FormatError as ex:
+            return ex.get_error_dict(), ex.status_code
+
         try:
             regions = get_query_region_ids(request.args)
         except UnknownSubjectError as ex:
             return ex.get_error_dict(), 404
 
-        variables_metadata = []
+        # All the variable definitions are read with one query
         if len(request_variables) > 0:
-            variables = request_variables
-            for v in variables:
-                variables_metadata.append(self.vmr.get(dataset, variable=v)[0])
+            definitions = dal.query_dataset_variable_definitions(dataset, request_variables)
+            definitions_by_id = {definition['variable_id']: definition for definition in definitions}
+            missing = [v for v in request_variables if v not in definitions_by_id]
+            if missing:
+                return {'Error': f"No variable {', '.join(missing)} in dataset {dataset}"}, 404
+            definitions = [definitions_by_id[v] for v in request_variables]
         else:
-            variables_metadata = self.vmr.get(dataset)[0]
-
-        variables_metadata = variables_metadata[:limit]
-        df_list = []
-
-        # for variable in variables_metadata:
-        #
-        #     _ = self.vg.get_direct(dataset, variable['variable_id'], include_cols, exclude_cols, -1, regions,
-        #                            return_df=True)
-        #
-        #     qualifiers = variable['qualifier']
-        #     generic_qualifiers = [x['name'] for x in qualifiers if x['identifier'] not in ('P585', 'P248')]
-        #
-        #     if _ is not None:
-        #         _ = self.reshape_canonical_data(_, generic_qualifiers)
-        #         df_list.append(_)
-        for variable in variables_metadata:
-            df_list.append(self.vg.get_direct(dataset, variable['variable_id'], include_cols, exclude_cols, -1, regions,
-                                              return_df=True))
+            definitions = dal.query_dataset_variable_definitions(dataset)
+
+        definitions = definitions[:limit]
+
+        df_list = self.get_data_frames(dataset, definitions, include_cols, exclude_cols, regions, time_filter)
 
         if len(df_list) > 0:
             df = pd.concat(df_list).replace('N/A', '')
         else:
             df = pd.DataFrame()
 
-        csv = df.to_csv(index=False)
-        output = make_response(csv)
-        output.headers['Content-Disposition'] = f'attachment; filename={dataset}_variables_all.csv'
-        output.headers['Content-type'] = 'text/csv'
-        return output
-
-    def reshape_canonical_data(self, df, qualifier_columns_to_reshape):
-        new_df = pd.DataFrame(columns=df.columns)
-        for i, row in df.iterrows():
-            row[f"{row['variable_id']}"] = row['value']
-            row['{}_UNIT'.format(row['variable_id'])] = row['value_unit']
-            row['{}_NAME'.format(row['variable_id'])] = row['variable']
-            for q in qualifier_columns_to_reshape:
-                row['{}_QUALIFIER_{}'.format(row['variable_id'], q)] = row[q]
-
-            new_df = new_df.append(row)
-        c_to_d = qualifier_columns_to_reshape
-        c_to_d.extend(['value', 'value_unit', 'variable_id', 'variable'])
-        new_df.drop(columns=c_to_d, inplace=True)
-        return new_df
+        if wide:
+            return frame_response(self.to_wide(df, definitions), fmt, f'{dataset}_variables_all_wide')
+        return frame_response(df, fmt, f'{dataset}_variables_all')
+
+    def get_data_frames(self, dataset, definitions, include_cols, exclude_cols, regions, time_filter) -> List[pd.DataFrame]:
+        # Returns the data frames of the variables, in order. Variables whose qualifiers are the same are read with a
+        # single query, which returns the rows of all their properties
+        shapes = OrderedDict()
+        for definition in definitions:
+            qualifiers = definition['qualifiers']
+            if 'time' not in [q.name for q in qualifiers]:
+                continue  # Variables without a time qualifier have no data, as in VariableGetter.get_direct
+            shape = tuple(sorted((q.label, q.name, q.data_type) for q in qualifiers))
+            shapes.setdefault(shape, []).append(definition)
+
+        frames = {}
+        for shape_definitions in shapes.values():
+            columns = {}
+            for definition in shape_definitions:
+                select_cols = self.vg.get_columns(include_cols, exclude_cols, definition['qualifiers'])
+                columns[definition['variable_qnode']] = (select_cols,
+                                                         self.vg.get_temp_cols(select_cols, definition['qualifiers']))
+            shape_cols = list(OrderedDict.fromkeys(col for (_, temp_cols) in columns.values() for col in temp_cols))
+
+            first = shape_definitions[0]
+            property_ids = list(OrderedDict.fromkeys(definition['property_id'] for definition in shape_definitions))
+            results = dal.query_variable_data(first['dataset_id'], property_ids, regions, first['qualifiers'], -1,
+                                              shape_cols, time_filter=time_filter)
+            shape_df = pd.DataFrame(results, columns=shape_cols + ['property_id']).fillna('')
+            property_dfs = {property_id: property_df for (property_id, property_df)
+                            in shape_df.groupby('property_id', sort=False)}
+
+            for definition in shape_definitions:
+                (select_cols, temp_cols) = columns[definition['variable_qnode']]
+                property_df = property_dfs.get(definition['property_id'])
+                if property_df is None:
+                    result_df = pd.DataFrame([], columns=temp_cols)
+                else:
+                    result_df = property_df[temp_cols].reset_index(drop=True)
+                frames[definition['variable_qnode']] = self.vg.enrich_data_frame(
+                    result_df, dataset, definition['variable_id'], definition['variable_name'], select_cols,
+                    definition['tags'], exclude_cols)
+
+        return [frames[definition['variable_qnode']] for definition in definitions
+                if definition['variable_qnode'] in frames]
+
+    def to_wide(self, df, definitions) -> pd.DataFrame:
+        # Pivots the observations into one row per main subject, time and qualifier values, with the value, unit and
+        # name of each variable in the columns <variable_id>, <variable_id>_UNIT and <variable_id>_NAME. The
+        # subject's region columns are kept, other per-observation columns (stated in, tags) are dropped
+        if df.empty:
+            return df
+
+        qualifier_columns = []
+        for definition in definitions:
+            for qualifier in definition['qualifiers']:
+                if qualifier.label not in ('P585', 'P248') and qualifier.main_column in df.columns \
+                        and qualifier.main_column not in qualifier_columns:
+                    qualifier_columns.append(qualifier.main_column)
+        subject_column = 'main_subject_id' if 'main_subject_id' in df.columns else 'main_subject'
+        keys = [subject_column, 'time'] + qualifier_columns
+        df = df.reset_index(drop=True)
+        df[keys] = df[keys].fillna('')
+
+        values = df.groupby(keys + ['variable_id'])[['value', 'value_unit', 'variable']].first().unstack('variable_id')
+        variable_ids = list(OrderedDict.fromkeys(df['variable_id']))
+        suffixes = {'value': '', 'value_unit': '_UNIT', 'variable': '_NAME'}
+        values = values.reindex(columns=[(field, variable_id) for variable_id in variable_ids
+                                         for field in suffixes.keys()])
+        values.columns = [f'{variable_id}{suffixes[field]}' for (field, variable_id) in values.columns]
+
+        subject_columns = [column for column in self.SUBJECT_COLUMNS if column in df.columns and column not in keys]
+        subjects = df.groupby(keys)[subject_columns].first()
+
+        return subjects.join(values).reset_index().fillna('')
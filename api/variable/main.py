@@ -1,11 +1,14 @@
 from flask_restful import Resource
+from api.conditional import conditional_on_dataset
 from .get import VariableGetter
 from .put import CanonicalData
 from .delete import VariableDeleter
 from .get_all import VariableGetterAll
+from .aggregate import VariableAggregator
 
 
 class VariableResource(Resource):
+    @conditional_on_dataset
     def get(self, dataset=None, variable=None):
         imp = VariableGetter()
         return imp.get(dataset, variable)
@@ -24,6 +27,14 @@ class VariableResource(Resource):
 
 
 class VariableResourceAll(Resource):
+    @conditional_on_dataset
     def get(self, dataset=None):
         g = VariableGetterAll()
         return g.get(dataset)
+
+
+class VariableAggregateResource(Resource):
+    @conditional_on_dataset
+    def get(self, dataset=None, variable=None):
+        imp = VariableAggregator()
+        return imp.get(dataset, variable)
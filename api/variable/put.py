@@ -7,7 +7,8 @@ from db.sql import dal
 from flask import request
 from api.util import TimePrecision
 from db.sql.dal.general import sanitize
-from db.sql.utils import query_to_dicts
+from db.sql.utils import query_to_dicts, postgres_connection, delete_by_keys
+from db.sql import measurements
 from db.sql.kgtk import import_kgtk_dataframe
 from api.metadata.update import DatasetMetadataUpdater
 from api.variable.delete import VariableDeleter
@@ -82,8 +83,11 @@ class CanonicalData(object):
             seed += 1
         return _dict
 
-    def create_triple(self, node1, label, node2):
-        id_key = '{}-{}'.format(node1, label)
+    def create_triple(self, node1, label, node2, content=None):
+        # The id hashes the edge and an index that tells apart edges hashing the same. content is any additional text
+        # that identifies the edge - edges passing it are only counted against edges with the same node2 and content,
+        # so their ids do not depend on the edges created before them
+        id_key = '{}-{}'.format(node1, label) if content is None else (node1, label, node2, content)
         if id_key not in self.all_ids_dict:
             self.all_ids_dict[id_key] = 0
         else:
@@ -94,41 +98,45 @@ class CanonicalData(object):
             'label': label,
             'node2': node2,
             'id': 'Q{}'.format(
-                hashlib.sha256(bytes('{}{}{}{}'.format(node1, label, node2, id_index), encoding='utf-8')).hexdigest())
+                hashlib.sha256(bytes('{}{}{}{}{}'.format(node1, label, node2, content or '', id_index),
+                                     encoding='utf-8')).hexdigest())
         }
 
     def create_kgtk_measurements(self, row, dataset_id, variable_id, qualifier_dict):
         kgtk_measurement_temp = list()
         main_subject = row['main_subject_id'].strip()
         if main_subject:
-
-            if 'value_unit_id' in row:
-                main_triple = self.create_triple(main_subject, variable_id,
-                                                 '{}{}'.format(row['value'], row['value_unit_id']))
-            else:
-                main_triple = self.create_triple(main_subject, variable_id, '{}'.format(row['value']))
-            kgtk_measurement_temp.append(main_triple)
-
-            main_triple_id = main_triple['id']
-            kgtk_measurement_temp.append(self.create_triple(main_triple_id, 'P2006020004', dataset_id))
-
-            kgtk_measurement_temp.append(
-                self.create_triple(main_triple_id, 'P585',
-                                   '{}/{}'.format('{}{}'.format('^', row['time']),
-                                                  self.tp.to_int(row['time_precision'].lower()))))
+            # The qualifiers of the measurement, as (label, node2)
+            qualifiers = [('P2006020004', dataset_id),
+                          ('P585', '{}/{}'.format('{}{}'.format('^', row['time']),
+                                                  self.tp.to_int(row['time_precision'].lower())))]
             for k in qualifier_dict:
                 if row[k].strip():
-                    kgtk_measurement_temp.append(
-                        self.create_triple(main_triple_id, qualifier_dict[k], json.dumps(row[k])))
+                    qualifiers.append((qualifier_dict[k], json.dumps(row[k])))
             if 'country_id' in row:
                 country_id = row['country_id'].strip()
                 if country_id:
-                    kgtk_measurement_temp.append(self.create_triple(main_triple_id, 'P17', country_id))
+                    qualifiers.append(('P17', country_id))
 
             if 'source_id' in row:
                 source_id = row['source_id'].strip()
                 if source_id:
-                    kgtk_measurement_temp.append(self.create_triple(main_triple_id, 'P248', source_id))
+                    qualifiers.append(('P248', source_id))
+
+            # The main edge's id covers the whole measurement, so it does not change when other rows of the file are
+            # inserted, removed or reordered - incremental PUTs rely on it. Only identical rows are told apart by
+            # their order, which does not matter since they are identical
+            content = json.dumps(sorted(qualifiers))
+            if 'value_unit_id' in row:
+                main_triple = self.create_triple(main_subject, variable_id,
+                                                 '{}{}'.format(row['value'], row['value_unit_id']), content)
+            else:
+                main_triple = self.create_triple(main_subject, variable_id, '{}'.format(row['value']), content)
+            kgtk_measurement_temp.append(main_triple)
+
+            main_triple_id = main_triple['id']
+            for (label, node2) in qualifiers:
+                kgtk_measurement_temp.append(self.create_triple(main_triple_id, label, node2))
 
         return kgtk_measurement_temp
 
@@ -309,8 +317,40 @@ class CanonicalData(object):
 
         return edges, q_dict
 
+    @staticmethod
+    def replace_incrementally(dataset_id, variable_pnode, df_kgtk):
+        # Edge IDs are hashes of the measurements' contents (see create_kgtk_measurements), so measurements that did not
+        # change get the same IDs they have in the database, wherever they are in the file. Only the stale edges are
+        # deleted and only the new edges are imported, in one transaction.
+        with postgres_connection() as conn:
+            existing_edges = dal.query_variable_edges(dataset_id, variable_pnode, conn)
+            existing_ids = set(existing_edges.keys())
+            incoming_ids = set(df_kgtk['id']) if len(df_kgtk) else set()
+
+            stale_ids = existing_ids - incoming_ids
+            if stale_ids:
+                delete_by_keys('edges', 'id', stale_ids, conn=conn)
+
+            df_new = df_kgtk[~df_kgtk['id'].isin(existing_ids)] if len(df_kgtk) else df_kgtk
+            if len(df_new):
+                import_kgtk_dataframe(df_new, conn=conn)
+
+            # The import rebuilds the measurements of the edges it writes. Main edges that only lost qualifiers need
+            # theirs rebuilt as well (measurements of deleted main edges are deleted along with them)
+            changed_main_ids = {existing_edges[id] for id in stale_ids} - stale_ids
+            if changed_main_ids and measurements.does_table_exist(conn):
+                with conn.cursor() as cursor:
+                    measurements.refresh_measurements(cursor, changed_main_ids)
+
+        return {
+            'inserted': len(incoming_ids - existing_ids),
+            'deleted': len(stale_ids),
+            'unchanged': len(incoming_ids & existing_ids),
+        }
+
     def canonical_data(self, dataset, variable, is_request_put=True):
         wikify = request.args.get('wikify', 'false').lower() == 'true'
+        incremental = request.args.get('incremental', 'false').lower() == 'true'
 
         # check if the dataset exists
         dataset_id = dal.get_dataset_id(dataset)
@@ -469,12 +509,21 @@ class CanonicalData(object):
         for i, row in df.iterrows():
             kgtk_format_list.extend(self.create_kgtk_measurements(row, dataset_id, variable_pnode, qualifer_dict))
 
+        if is_request_put and incremental:
+            # this is an incremental PUT request, only the edges that changed are replaced
+            summary = self.replace_incrementally(dataset_id, variable_pnode, pd.DataFrame(kgtk_format_list))
+            summary['rows'] = len(df)
+            DatasetMetadataUpdater().update(dataset)
+            return summary, 201
+
         if is_request_put:
             # this is a PUT request, delete all data for this variable and upload the current data
             self.vd.delete(dataset, variable)
 
-        DatasetMetadataUpdater().update(dataset)
         df_kgtk = pd.DataFrame(kgtk_format_list)
         import_kgtk_dataframe(df_kgtk)
 
+        # last_update is bumped after the data is in, it versions the cached responses
+        DatasetMetadataUpdater().update(dataset)
+
         return '{} rows imported!'.format(len(df)), 201  # original file
@@ -1,5 +1,6 @@
 import os.path
 import api.hello
+import api.stats
 from flask import Flask
 from flask_cors import CORS
 from flask_restful import Api
@@ -8,10 +9,13 @@ from api.bulk import BulkResource
 from api.annotated import AnnotatedResource
 from api.dataset import DatasetResource
 from api.tsv import TsvResource
-from api.variable import VariableResource, VariableResourceAll
+from api.variable import VariableResource, VariableResourceAll, VariableAggregateResource
 from api.metadata import DatasetMetadataResource, VariableMetadataResource, FuzzySearchResource
 from api.property import PropertyResource
 from api.entity import EntityResource
+from api.region import RegionResource
+from api.region_utils import init_region_cache
+from db.sql.utils import close_request_connection
 
 app = Flask(__name__)
 CORS(app)
@@ -21,10 +25,17 @@ instance_config_path = os.path.join('instance', 'config.py')
 if os.path.isfile(instance_config_path):
     app.config.from_pyfile(instance_config_path)
 
+# Return the request's Postgres connection to the pool
+app.teardown_appcontext(close_request_connection)
+
+init_region_cache(app)
+
 app.register_blueprint(api.hello.bp)
+app.register_blueprint(api.stats.bp)
 api = Api(app)
 api.add_resource(VariableResource, '/datasets/<string:dataset>/variables/<string:variable>')
 api.add_resource(VariableResourceAll, '/datasets/<string:dataset>/variables')
+api.add_resource(VariableAggregateResource, '/datasets/<string:dataset>/variables/<string:variable>/aggregate')
 api.add_resource(DatasetMetadataResource, '/metadata/datasets', '/metadata/datasets/<string:dataset>')
 api.add_resource(VariableMetadataResource, '/metadata/datasets/<string:dataset>/variables',
                  '/metadata/datasets/<string:dataset>/variables/<string:variable>')
@@ -36,6 +47,7 @@ api.add_resource(T2WMLResource, '/datasets/<string:dataset>/t2wml')
 api.add_resource(BulkResource, '/datasets/bulk')
 api.add_resource(PropertyResource, '/properties', '/properties/<string:property>')
 api.add_resource(EntityResource, '/entities', '/entities/', '/entities/<string:entity>')
+api.add_resource(RegionResource, '/regions')
 
 if __name__ == '__main__':
     app.run(port=12543)
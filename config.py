@@ -19,8 +19,52 @@ POSTGRES = dict(
     password = 'postgres',
 )
 
+# Connections to POSTGRES are pooled, see db.sql.utils.postgres_connection
+POSTGRES_POOL = dict(
+    min_size = 1,            # Idle connections kept open even after idle_timeout
+    max_size = 20,           # Maximum number of open connections per worker process
+    idle_timeout = 300,      # Seconds before an idle connection is closed
+    health_check = 30,       # Ping connections idle for longer than this (seconds) on checkout. None to disable
+    checkout_timeout = 30,   # Seconds to wait for a free connection before failing
+)
+
+# Number of connections KGTK imports write with in parallel. Values above 1 require max_prepared_transactions
+# to be set in Postgres (imports are serial otherwise), see db.sql.kgtk.import_kgtk_frames
+IMPORT_WORKERS = 1
+
+# Read variable data from the denormalized measurements table instead of joining the edges. Create and fill the table
+# with script/measurements.py first - once it exists, KGTK imports keep it up to date. See db.sql.measurements
+USE_MEASUREMENTS_TABLE = False
+
+# Variable data responses are cached in memory, up to max_memory bytes, until their dataset is updated or they are
+# ttl seconds old. When directory is set, responses evicted from memory are kept there, up to max_disk bytes.
+# Set max_memory to 0 (without a directory) to disable the cache. See api.response_cache
+RESPONSE_CACHE = dict(
+    max_memory = 256 * 1024 * 1024,
+    directory = None,
+    max_disk = 4 * 1024 * 1024 * 1024,
+    ttl = 3600,
+)
+
 METADATA_DIR = os.path.join(BASE_DIR, 'metadata')
 
+# Regions are cached in each process as they are requested. Set preload to 'database' to load all the regions when
+# the app starts, to 'snapshot' to load them from the snapshot file built by script/region_index.py (much faster),
+# or to 'shared' to read them from SHARED_SNAPSHOT.
+# Region names and ids that do not exist are remembered for negative_ttl seconds. The cache starts over when the
+# regions in the database change, which it checks every version_check seconds (None to disable). See api.region_utils
+REGION_CACHE = dict(
+    preload = None,
+    snapshot = os.path.join(METADATA_DIR, 'region-index.json.gz'),
+    negative_ttl = 300,
+    version_check = 60,
+)
+
+# Worker processes can read the regions and the country wikifier memo from a shared, memory-mapped snapshot file
+# instead of each building its own copy. The file is built (and replaced when regions change) by
+# script/shared_snapshot.py. See api.shared_snapshot
+SHARED_SNAPSHOT = None
+
 RESTFUL_JSON = dict(
     cls = CustomEncoder,
 )
@@ -228,6 +228,13 @@ ALTER TABLE ONLY public.symbols
     ADD CONSTRAINT symbols_pkey PRIMARY KEY (edge_id);
 
 
+--
+-- Name: ix_dates_date_and_time; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX ix_dates_date_and_time ON public.dates USING btree (date_and_time);
+
+
 --
 -- Name: ix_edges_label_node2; Type: INDEX; Schema: public; Owner: postgres
 --
@@ -1,7 +1,7 @@
 from collections.abc import Iterable
-from typing import List, Optional
+from typing import List, Optional, Union
 from db.sql.dal.general import sanitize
-from db.sql.utils import query_edges_to_df, query_to_dicts, delete
+from db.sql.utils import query_edges_to_df, query_to_dicts, delete, delete_by_keys
 from pandas import DataFrame
 
 def query_entity(entity_name: str = None, entity_label: str = None) -> DataFrame:
@@ -37,13 +37,15 @@ def _label_where(labels: List[str]):
     return '(' + joined + ')'
 
     return joined
-def delete_entity(entity_name: str, labels: Optional[List[str]], conn=None):
-    sql = f"delete from edges where node1='{sanitize(entity_name)}'"
+def delete_entity(entity_names: Union[str, Iterable], labels: Optional[List[str]], conn=None):
+    if isinstance(entity_names, str):
+        entity_names = [entity_names]
 
+    where = None
     if labels:
-        sql += ' and label IN ' + _label_where(labels)
+        where = 'label IN ' + _label_where(labels)
 
-    delete(sql, conn=conn)
+    delete_by_keys('edges', 'node1', entity_names, where=where, conn=conn)
 
 def has_entity_other_labels(entity_name: str, labels: List[str]) -> bool:
     labels = _label_where(labels)
@@ -1,6 +1,7 @@
-from db.sql.dal.general import get_dataset_id
+from db.sql.dal.general import get_dataset_id, sanitize
 from db.sql.dal.variables import get_variable_id
-from db.sql.utils import query_to_dicts, postgres_connection
+from db.sql.utils import delete_by_keys, query_to_dicts, postgres_connection
+from flask import g, has_request_context
 from api.util import DataInterval, TimePrecision
 
 def query_dataset_metadata(dataset_name=None, include_dataset_qnode=False, debug=False):
@@ -60,6 +61,39 @@ def query_dataset_metadata(dataset_name=None, include_dataset_qnode=False, debug
         print(query)
     return query_to_dicts(query)
 
+def query_dataset_last_update(dataset_name, debug=False):
+    """ Returns the last_update of the dataset, None if there is no such dataset or it has no last_update """
+    dataset_name = sanitize(dataset_name)
+    query = f'''
+    SELECT d_last_update.date_and_time AS last_update
+        FROM edges e_dataset
+        JOIN edges e_p31 ON (e_dataset.node1=e_p31.node1 AND e_p31.label='P31')
+        JOIN edges e_last_update ON (e_dataset.node1=e_last_update.node1 AND e_last_update.label='P5017')
+        JOIN dates d_last_update ON (e_last_update.id=d_last_update.edge_id)
+    WHERE e_dataset.label='P1813' AND e_dataset.node2='{dataset_name}' AND e_p31.node2='Q1172284';
+    '''
+    if debug:
+        print(query)
+    result = query_to_dicts(query)
+    if result:
+        return result[0]['last_update']
+    return None
+
+def request_dataset_last_update(dataset_name):
+    """ query_dataset_last_update, read once per request. The conditional GET check, the response cache and the
+    definition cache of a request all see the same last_update """
+    if not has_request_context():
+        return query_dataset_last_update(dataset_name)
+    last_updates = g.setdefault('_dataset_last_updates', {})
+    if dataset_name not in last_updates:
+        last_updates[dataset_name] = query_dataset_last_update(dataset_name)
+    return last_updates[dataset_name]
+
+def forget_dataset_last_update(dataset_name):
+    """ Drops the last_update request_dataset_last_update read in this request, after it has been changed """
+    if has_request_context():
+        g.get('_dataset_last_updates', {}).pop(dataset_name, None)
+
 def query_dataset_variables(dataset, debug=False):
     def join_edge(alias, label, satellite_type=None, qualifier=False, left=False):
         return _join_edge_helper('e_var', alias, label, satellite_type=satellite_type, qualifier=qualifier, left=left)
@@ -259,15 +293,10 @@ def delete_variable_metadata(dataset_id, variable_qnodes, labels=None, debug=Fal
 
     if not variable_qnodes:
         raise ValueError("At least one variable QNode should be supplied")
-    variable_qnodes_str = ', '.join([f"'{qnode}'" for qnode in variable_qnodes])
-    variable_qnodes_where = f'node1 in ({variable_qnodes_str})'
 
-    with postgres_connection() as conn:
-        with conn.cursor() as cursor:
-            query = f"""DELETE FROM edges WHERE {variable_qnodes_where} AND {labels_where}"""
-            if debug:
-                print(query)
-            cursor.execute(query)
+    if debug:
+        print(f"Deleting edges of {', '.join(variable_qnodes)} where {labels_where}")
+    delete_by_keys('edges', 'node1', variable_qnodes, where=labels_where)
 
 def delete_dataset_metadata(dataset_qnode, labels=None, debug=False):
     if not labels:
@@ -19,6 +19,9 @@ class Region:
     region_coordinate: Optional[str]
     alias: Optional[str]
 
+    __slots__ = ('admin', 'admin_id', 'region_type', 'country', 'country_id', 'country_cameo', 'admin1', 'admin1_id',
+                 'admin2', 'admin2_id', 'admin3', 'admin3_id', 'region_coordinate', 'alias')
+
     COUNTRY = 'Q6256'
     ADMIN1 = 'Q10864048'
     ADMIN2 = 'Q13220204'
@@ -43,7 +46,7 @@ class Region:
         # country, admin1 and admin2 queries return both admin and country,admin1,admin2 fields.
         # admin3 queries do not, so we need to feel these fields ourselves
         if self.region_type == Region.ADMIN3:
-            self.admin3_id, self.admin_3 = self.admin_id, self.admin
+            self.admin3_id, self.admin3 = self.admin_id, self.admin
 
     def __getitem__(self, key: str) -> str:
         return getattr(self, key)
@@ -138,3 +141,19 @@ def query_admins(admins: List[str] = [], admin_ids: List[str] = [], debug=False)
     if debug:
         print(query)
     return _query_regions(query)
+
+
+def query_region_version(debug=False) -> str:
+    """ Returns a stamp of the regions in the database, that changes when a region is added, removed or redefined.
+
+    The stamp is cheap to read - it only looks at the regions' P31 edges, through ix_edges_label_node2. Adding or
+    removing a region changes their count, and redefining one through the entities endpoint writes its edges (P31
+    included) again, which changes the highest transaction id (xmin) that wrote them. """
+    query = f'''
+    SELECT count(*) || '-' || COALESCE(max(e_region.xmin::text::bigint), 0) AS version
+        FROM edges e_region
+    WHERE e_region.label='P31' AND e_region.node2 IN ('Q6256', 'Q10864048', 'Q13220204', 'Q13221722')
+    '''
+    if debug:
+        print(query)
+    return query_to_dicts(query)[0]['version']
@@ -1,6 +1,9 @@
 from db.sql.dal.general import sanitize
-from db.sql.utils import postgres_connection, query_to_dicts
-from typing import Union, Dict, List, Tuple, Any, Set
+from db.sql import measurements
+from db.sql.utils import postgres_connection, query_to_dicts, query_df_batches, DEFAULT_ITERSIZE
+from typing import Union, Dict, List, Tuple, Any, Set, Iterator, Optional
+from datetime import datetime
+from pandas import DataFrame
 from abc import ABC, abstractmethod, abstractproperty
 
 
@@ -12,6 +15,9 @@ class Qualifier:
     is_optional: bool
     join_clause: str
     fields: Dict[str, str]  # Field name to select_clause_field
+    measurement_fields: Dict[str, str]  # Field name to select_clause_field, when reading from the measurements table
+    date_fields: Tuple[str, str]  # The date and precision columns of date qualifiers
+    measurement_date_fields: Tuple[str, str]  # Same, when reading from the measurements table
 
     DATA_TYPES = ['date_and_time', 'string', 'symbol', 'quantity', 'coordinate', 'location']
 
@@ -28,6 +34,7 @@ class Qualifier:
             self.name = 'location'
 
         self._init_sql()
+        self._init_measurement_sql()
 
     LOCATION_PROPS = {'P17': 'country', 'P2006190001': 'admin1', 'P2006190002': 'admin2', 'P2006190003': 'admin3',
                       'P131': 'location'}
@@ -83,6 +90,7 @@ class Qualifier:
                 main_name: f"to_json({satellite_table}.date_and_time)#>>'{{}}' || 'Z'",
                 main_name + "_precision": f"{satellite_table}.precision",
             }
+            self.date_fields = (f"{satellite_table}.date_and_time", f"{satellite_table}.precision")
         elif self.data_type == 'quantity':
             satellite_table = 'q_' + underscored_main_name
             unit_table = 'e_' + underscored_main_name + '_unit_label'
@@ -135,6 +143,80 @@ class Qualifier:
             {join_on_clause}
         """
 
+    @staticmethod
+    def _label_sql(node):
+        return f"(SELECT s_label.text FROM edges e_label JOIN strings s_label ON (e_label.id=s_label.edge_id) " \
+               f"WHERE e_label.node1={node} AND e_label.label='label' LIMIT 1)"
+
+    def _init_measurement_sql(self):
+        # The same fields, taken from the measurement's columns and its qualifiers field
+        main_name = self.main_column
+        if self.label == 'P585':
+            self.measurement_fields = {
+                main_name: "to_json(m.time)#>>'{}' || 'Z'",
+                main_name + "_precision": 'm."precision"',
+            }
+            self.measurement_date_fields = ('m.time', 'm."precision"')
+            return
+
+        qualifier = f"m.qualifiers->'{sanitize(self.label)}'"
+        if self.data_type == 'date_and_time':
+            self.measurement_fields = {
+                main_name: f"{qualifier}->>'date'",
+                main_name + "_precision": f"{qualifier}->>'precision'",
+            }
+            self.measurement_date_fields = (f"({qualifier}->>'date')::timestamp", f"({qualifier}->>'precision')")
+        elif self.data_type == 'quantity':
+            self.measurement_fields = {
+                main_name: f"({qualifier}->>'number')::numeric",
+                main_name + "_unit_id": f"{qualifier}->>'unit'",
+                main_name + "_unit": self._label_sql(f"{qualifier}->>'unit'"),
+            }
+        elif self.data_type == 'symbol' or self.data_type == 'location':
+            self.measurement_fields = {
+                main_name: self._label_sql(f"{qualifier}->>'node2'"),
+                main_name + "_id": f"{qualifier}->>'node2'",
+            }
+        elif self.data_type == 'string':
+            self.measurement_fields = {
+                main_name: f"{qualifier}->>'text'",
+            }
+        elif self.data_type == 'coordinate':
+            self.measurement_fields = {
+                main_name: f"'POINT(' || ({qualifier}->>'longitude') || ' ' || ({qualifier}->>'latitude') || ')'"
+            }
+
+    @property
+    def measurement_node(self):
+        # The SQL expression of the qualifier's node2 in the measurements table
+        if self.label in measurements.LOCATION_QUALIFIERS:
+            return 'm.location'
+        return f"(m.qualifiers->'{sanitize(self.label)}'->>'node2')"
+
+
+class TimeFilter:
+    # Restricts variable data to times in [start, end) and to one time precision. Each part is optional
+    def __init__(self, start: datetime = None, end: datetime = None, precision: int = None):
+        self.start = start
+        self.end = end
+        self.precision = precision
+
+    def where(self, date_field: str, precision_field: str) -> str:
+        wheres = ['1=1']
+        if self.start:
+            wheres.append(f"{date_field} >= '{self.start.isoformat()}'::timestamp")
+        if self.end:
+            wheres.append(f"{date_field} < '{self.end.isoformat()}'::timestamp")
+        if self.precision is not None:
+            # Precisions are stored as strings, some of them as floats ('11.0')
+            wheres.append(f"{precision_field} IN ('{int(self.precision)}', '{int(self.precision)}.0')")
+        return ' AND '.join(wheres)
+
+
+def _time_qualifier(qualifiers: List[Qualifier]) -> Qualifier:
+    # Variables without a time qualifier have no data
+    return [q for q in qualifiers if q.main_column == 'time'][0]
+
 
 def get_variable_id(dataset_id, variable, debug=False) -> Union[str, None]:
     dataset_id = sanitize(dataset_id)
@@ -217,22 +299,118 @@ def query_tags(dataset_id, variable_qnode):
     
 
 
+def _query_variable_definitions(dataset, variable_where: str, debug=False) -> List[Dict[str, Any]]:
+    # The definitions of the dataset's variables whose short name (e_var.node2) matches variable_where
+    dataset = sanitize(dataset)
+
+    query = f'''
+    SELECT e_var.node1 AS variable_qnode, e_var.node2 AS variable_id, s_var_label.text AS variable_name, e_property.node2 AS property_id, e_dataset.node1 AS dataset_id, e_dataset_label.node2 AS dataset_name,
+        (SELECT d_last_update.date_and_time
+            FROM edges e_last_update
+            JOIN dates d_last_update ON (e_last_update.id=d_last_update.edge_id)
+            WHERE e_last_update.node1=e_dataset.node1 AND e_last_update.label='P5017' LIMIT 1) AS last_update,
+        EXISTS (SELECT 1 FROM edges e_p31 WHERE e_p31.node1=e_var.node1 AND e_p31.label='P31' AND e_p31.node2='Q50701') AS is_variable,
+        COALESCE((
+            SELECT json_agg(json_build_object('label', e_qualifier.node2, 'name', s_qualifier_label.text,
+                                              'wikidata_data_type', e_data_type.node2))
+                FROM edges e_qualifier
+                LEFT JOIN edges e_qualifier_label  -- Location qualifiers have no name
+                    JOIN strings s_qualifier_label ON (e_qualifier_label.id=s_qualifier_label.edge_id)
+                ON (e_qualifier.node2=e_qualifier_label.node1 AND e_qualifier_label.label='label')
+                LEFT JOIN edges e_data_type
+                    ON (e_qualifier.node2=e_data_type.node1 AND e_data_type.label='wikidata_data_type')
+            WHERE e_qualifier.node1=e_var.node1 AND e_qualifier.label='P2006020002'
+        ), '[]') AS qualifiers,
+        COALESCE((
+            SELECT json_agg(e_tag.node2)
+                FROM edges e_tag
+            WHERE e_tag.node1=e_var.node1 AND e_tag.label='P2010050001'
+        ), '[]') AS tags
+        FROM edges e_var
+        JOIN edges e_var_label ON (e_var.node1=e_var_label.node1 AND e_var_label.label='label')
+        JOIN strings s_var_label ON (e_var_label.id=s_var_label.edge_id)
+        JOIN edges e_property ON (e_property.node1=e_var.node1 AND e_property.label='P1687')
+        JOIN edges e_dataset ON (e_dataset.label='P2006020003' AND e_dataset.node2=e_property.node1)
+        JOIN edges e_dataset_label ON (e_dataset_label.node1=e_dataset.node1 AND e_dataset_label.label='P1813')
+    WHERE e_var.label='P1813' AND e_dataset_label.node2='{dataset}' AND {variable_where}
+    ORDER BY e_var.node1;
+    '''
+    if debug:
+        print(query)
+
+    definitions = query_to_dicts(query)
+    for definition in definitions:
+        # query_qualifiers and query_tags only return the qualifiers and tags of nodes that are variables (P31 Q50701)
+        if not definition.pop('is_variable'):
+            definition['qualifiers'] = []
+            definition['tags'] = []
+        definition['qualifiers'] = [Qualifier(**q) for q in definition['qualifiers']]
+    return definitions
+
+
+def query_variable_definition(dataset, variable, debug=False) -> Optional[Dict[str, Any]]:
+    """ Returns everything needed to query a variable's data in one round trip.
+
+    The result holds the fields of query_variable, the variable's qualifiers (as returned by query_qualifiers), its
+    tags (as returned by query_tags) and the dataset's last_update. Returns None if there is no such variable.
+    """
+    variable = sanitize(variable)
+    definitions = _query_variable_definitions(dataset, f"e_var.node2='{variable}'", debug)
+    if not definitions:
+        return None
+    return definitions[0]
+
+
+def query_dataset_variable_definitions(dataset, variables: List[str] = None, debug=False) -> List[Dict[str, Any]]:
+    # The definitions of all the variables of a dataset, or of the variables whose ids are listed in variables,
+    # in one round trip. Variables are ordered by their qnode
+    if variables is None:
+        variable_where = '1=1'
+    elif not variables:
+        return []
+    else:
+        variable_where = 'e_var.node2 IN (' + ', '.join(f"'{sanitize(variable)}'" for variable in variables) + ')'
+    return _query_variable_definitions(dataset, variable_where, debug)
+
+
+# The edges from a region to the regions that contain it, and the region types of each level
+ADMIN_EDGES = {
+    'country': 'P17',
+    'admin1': 'P2006190001',
+    'admin2': 'P2006190002',
+    'admin3': 'P2006190003',
+}
+
+ADMIN_TYPES = {
+    'country': 'Q6256',
+    'admin1': 'Q10864048',
+    'admin2': 'Q13220204',
+    'admin3': 'Q13221722',
+}
+
+# Aggregate functions of query_variable_aggregates
+AGGREGATE_FUNCTIONS = {
+    'mean': 'avg(data.value)',
+    'sum': 'sum(data.value)',
+    'count': 'count(data.value)',
+    'min': 'min(data.value)',
+    'max': 'max(data.value)',
+    'median': 'percentile_cont(0.5) WITHIN GROUP (ORDER BY data.value)',
+}
+
+# Time buckets of query_variable_aggregates, all supported by date_trunc
+AGGREGATE_INTERVALS = ['millennium', 'century', 'decade', 'year', 'month', 'day', 'hour', 'minute', 'second']
+
+
 def preprocess_places(places: Dict[str, List[str]], region_field) -> Tuple[str, str]:
     joins: List[str] = []
     wheres: List[str] = []
 
-    admin_edges = {
-        'country': 'P17',
-        'admin1': 'P2006190001',
-        'admin2': 'P2006190002',
-        'admin3': 'P2006190003',
-    }
-
     for (type, ids) in places.items():
         if not ids:
             continue
 
-        label = admin_edges[type]
+        label = ADMIN_EDGES[type]
         joins.append(f"LEFT JOIN edges e_{type} ON ({region_field}=e_{type}.node1 AND e_{type}.label='{label}')")
 
         quoted_ids = [f"'{id}'" for id in ids]
@@ -264,10 +442,103 @@ def preprocess_qualifiers(qualifiers: List[Qualifier], cols: List[str]) -> Tuple
     return ',\n\t\t'.join(fields), '\n'.join(joins)
 
 
-def query_variable_data(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, limit, cols, debug=False) -> \
-List[Dict[str, Any]]:
+def preprocess_measurement_qualifiers(qualifiers: List[Qualifier], cols: List[str]) -> Tuple[str, str]:
+    # The fields of the qualifiers when reading from the measurements table, and the condition on the required ones
+    col_set = set(cols)
+    fields = []
+    wheres = ['1=1']
+    for qualifier in qualifiers:
+        if not qualifier.is_optional:
+            wheres.append(f"{qualifier.measurement_fields[qualifier.main_column]} IS NOT NULL")
+
+        for field in set(qualifier.measurement_fields.keys()) & col_set:
+            fields.append(qualifier.measurement_fields[field] + " AS \"" + field + "\"")
+
+    return ',\n\t\t'.join(fields), ' AND '.join(wheres)
+
+
+def _seek_where(sort_fields: str, after: Tuple[str, str, str]) -> str:
+    # The keyset pagination condition - rows that come after the (main subject, time, edge id) of the last row of the
+    # previous page. Values are quoted rather than sanitized, so that the comparison is exact
+    if not after:
+        return '1=1'
+    (main_subject_id, time, edge_id) = [value.replace("'", "''") for value in after]
+    return f"({sort_fields}) > ('{main_subject_id}', '{time}'::timestamp, '{edge_id}')"
+
+
+def _property_where(field: str, property_id: Union[str, List[str]]) -> str:
+    # The data queries read one property, or several properties of the same dataset with the same qualifiers
+    if isinstance(property_id, str):
+        return f"{field}='{sanitize(property_id)}'"
+    return f"{field} IN (" + ', '.join(f"'{sanitize(id)}'" for id in property_id) + ')'
+
+
+def _measurement_data_query(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, limit, cols,
+                            after: Tuple[str, str, str] = None, time_filter: TimeFilter = None,
+                            ordered=True) -> str:
+    # Same as _variable_data_query, reading from the measurements table
+    dataset_id = sanitize(dataset_id)
+    property_where = _property_where('m.property', property_id)
+
+    location_qualifiers = [q for q in qualifiers if q.data_type == 'location']
+    if len(location_qualifiers) == 0:
+        location_node = 'm.main_subject'
+    elif len(location_qualifiers) == 1:
+        location_node = location_qualifiers[0].measurement_node
+    else:
+        raise ValueError("There are more than one location qualifiers for variable")
+
+    places_join, places_where = preprocess_places(places, location_node)
+    qualifier_fields, qualifier_where = preprocess_measurement_qualifiers(qualifiers, cols)
+    (date_field, precision_field) = _time_qualifier(qualifiers).measurement_date_fields
+    time_where = time_filter.where(date_field, precision_field) if time_filter else '1=1'
+    sort_fields = f'm.main_subject, {date_field}, m.edge_id'
+
+    query = f"""
+    SELECT  m.main_subject AS main_subject_id,
+            m.edge_id AS edge_id,
+            m.property AS property_id,
+            s_main_label.text AS main_subject,
+            m.dataset_qnode AS dataset_id,
+            m.value AS value,
+            s_value_unit.text AS value_unit,
+            {qualifier_fields}
+    FROM {measurements.TABLE_NAME} AS m
+        {places_join}
+        LEFT JOIN edges AS e_value_unit
+            LEFT JOIN strings AS s_value_unit ON (e_value_unit.id=s_value_unit.edge_id)
+        ON (e_value_unit.node1=m.unit AND e_value_unit.label='label')
+        LEFT JOIN edges AS e_main_label
+            JOIN strings AS s_main_label ON (e_main_label.id=s_main_label.edge_id)
+        ON (m.main_subject=e_main_label.node1 AND e_main_label.label='label')
+
+    WHERE m.dataset_qnode='{dataset_id}' AND {property_where} AND ({places_where}) AND {qualifier_where}
+        AND {time_where} AND {_seek_where(sort_fields, after)}
+    {'ORDER BY ' + sort_fields if ordered else ''}
+    """
+
+    if limit > 0:
+        query += f"\nLIMIT {limit}\n"
+
+    return query
+
+
+def _data_query(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, limit, cols,
+                after: Tuple[str, str, str] = None, time_filter: TimeFilter = None, ordered=True) -> str:
+    if measurements.use_measurements_table():
+        return _measurement_data_query(dataset_id, property_id, places, qualifiers, limit, cols, after, time_filter,
+                                       ordered)
+    return _variable_data_query(dataset_id, property_id, places, qualifiers, limit, cols, after, time_filter, ordered)
+
+
+def _variable_data_query(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, limit, cols,
+                         after: Tuple[str, str, str] = None, time_filter: TimeFilter = None, ordered=True) -> str:
+    # Rows are sorted by main subject, time and edge id, which is a unique key, unless ordered is False. after is the
+    # key of the last row of the previous page, for keyset pagination. time_filter is applied to the time
+    # qualifier's dates. property_id can be a list of properties whose variables have the same qualifiers, rows
+    # then carry their property in property_id
     dataset_id = sanitize(dataset_id)
-    property_id = sanitize(property_id)
+    property_where = _property_where('e_main.label', property_id)
 
     location_qualifiers = [q for q in qualifiers if q.data_type == 'location']
     if len(location_qualifiers) == 0:
@@ -279,9 +550,15 @@ List[Dict[str, Any]]:
 
     places_join, places_where = preprocess_places(places, location_node)
     qualifier_fields, qualifier_joins = preprocess_qualifiers(qualifiers, cols)
+    # The time qualifier is required, so its dates are always joined
+    (date_field, precision_field) = _time_qualifier(qualifiers).date_fields
+    time_where = time_filter.where(date_field, precision_field) if time_filter else '1=1'
+    sort_fields = f'e_main.node1, {date_field}, e_main.id'
 
     query = f"""
     SELECT  e_main.node1 AS main_subject_id,
+            e_main.id AS edge_id,
+            e_main.label AS property_id,
             s_main_label.text AS main_subject,
             e_dataset.node2 AS dataset_id,
             q_main.number AS value,
@@ -299,8 +576,9 @@ List[Dict[str, Any]]:
             JOIN strings AS s_main_label ON (e_main_label.id=s_main_label.edge_id)
         ON (e_main.node1=e_main_label.node1 AND e_main_label.label='label')
 
-    WHERE e_main.label='{property_id}' AND e_dataset.node2='{dataset_id}' AND ({places_where})
-    ORDER BY main_subject_id, time
+    WHERE {property_where} AND e_dataset.node2='{dataset_id}' AND ({places_where})
+        AND {time_where} AND {_seek_where(sort_fields, after)}
+    {'ORDER BY ' + sort_fields if ordered else ''}
     """
 
     # Some remarks on that query:
@@ -316,12 +594,90 @@ List[Dict[str, Any]]:
     if limit > 0:
         query += f"\nLIMIT {limit}\n"
 
+    return query
+
+
+def query_variable_data(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, limit, cols, debug=False,
+                        after: Tuple[str, str, str] = None, time_filter: TimeFilter = None) -> List[Dict[str, Any]]:
+    query = _data_query(dataset_id, property_id, places, qualifiers, limit, cols, after, time_filter)
     if debug:
         print(query)
 
     return query_to_dicts(query)
 
 
+def query_variable_data_batches(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, limit, cols,
+                                batch_size=DEFAULT_ITERSIZE, debug=False,
+                                time_filter: TimeFilter = None) -> Iterator[DataFrame]:
+    # Same as query_variable_data, but streams the rows from a server side cursor, one DataFrame per batch,
+    # so that large variables are never held in memory in their entirety
+    query = _data_query(dataset_id, property_id, places, qualifiers, limit, cols, time_filter=time_filter)
+    if debug:
+        print(query)
+
+    return query_df_batches(query, batch_size)
+
+
+def query_variable_aggregates(dataset_id, property_id, places: Dict[str, List[str]], qualifiers, level: Optional[str],
+                              interval: str, functions: List[str], time_filter: TimeFilter = None,
+                              debug=False) -> List[Dict[str, Any]]:
+    # Aggregates the variable's values by region and time bucket. Each row is mapped to the region of the requested
+    # level (country, admin1, admin2 or admin3) that contains its location, or to None if there is no such region.
+    # If level is None, the values are aggregated by time only. Rows hold region_id, region, time and a field
+    # per function.
+    location_qualifier = 'location' in [q.name for q in qualifiers]
+    cols = ['main_subject_id', 'value', 'time'] + (['location_id'] if location_qualifier else [])
+    data_query = _data_query(dataset_id, property_id, places, qualifiers, -1, cols, time_filter=time_filter,
+                             ordered=False)
+    location_node = 'data.location_id' if location_qualifier else 'data.main_subject_id'
+
+    if level:
+        # A region is mapped to itself if it is of the requested level, or else to the region of that level
+        # that contains it. Locations with several such regions (disputed regions, for instance) are mapped to one of
+        # them, so that their values are only counted once
+        region_joins = f"""
+        LEFT JOIN LATERAL (
+            SELECT e_level_type.node1 AS node FROM edges e_level_type
+            WHERE e_level_type.node1={location_node} AND e_level_type.label='P31' AND e_level_type.node2='{ADMIN_TYPES[level]}'
+            LIMIT 1
+        ) level_type ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT e_level.node2 AS node FROM edges e_level
+            WHERE e_level.node1={location_node} AND e_level.label='{ADMIN_EDGES[level]}'
+            ORDER BY e_level.node2
+            LIMIT 1
+        ) level ON TRUE
+        """
+        region_node = 'COALESCE(level_type.node, level.node)'
+    else:
+        region_joins = ''
+        region_node = 'NULL::character varying'
+
+    aggregate_fields = ',\n\t\t'.join(f'{AGGREGATE_FUNCTIONS[function]} AS "{function}"' for function in functions)
+    query = f"""
+    SELECT buckets.*, s_region_label.text AS region
+    FROM (
+        SELECT {region_node} AS region_id,
+            date_trunc('{interval}', data.time::timestamp) AS bucket,
+            {aggregate_fields}
+        FROM ({data_query}) data
+        {region_joins}
+        GROUP BY 1, 2
+    ) buckets
+        LEFT JOIN edges e_region_label
+            JOIN strings s_region_label ON (e_region_label.id=s_region_label.edge_id)
+        ON (e_region_label.node1=buckets.region_id AND e_region_label.label='label')
+    ORDER BY buckets.region_id, buckets.bucket
+    """
+    if debug:
+        print(query)
+
+    results = query_to_dicts(query)
+    for row in results:
+        row['time'] = row.pop('bucket').isoformat() + 'Z'
+    return results
+
+
 def delete_variable(dataset_id, variable_id, property_id, debug=False):
     with postgres_connection() as conn:
         with conn.cursor() as cursor:
@@ -332,7 +688,8 @@ def delete_variable(dataset_id, variable_id, property_id, debug=False):
             # and then use it to delete the actual edges
             #
             # Step 1. create the temporary table
-            query = f"""SELECT e_main.id INTO TEMPORARY TABLE to_be_deleted
+            query = f"""CREATE TEMPORARY TABLE to_be_deleted ON COMMIT DROP AS
+                        SELECT e_main.id
                             FROM edges AS e_main
                             JOIN edges AS e_dataset ON (e_dataset.node1=e_main.id AND e_dataset.label='P2006020004')
                         WHERE e_main.label='{property_id}' AND e_dataset.node2='{dataset_id}';
@@ -357,7 +714,28 @@ def delete_variable(dataset_id, variable_id, property_id, debug=False):
                 print(query)
             cursor.execute(query)
 
-            # We do not delete the temporary table, it is deleted automatically when the session is closed
+            # The temporary table is dropped when the transaction commits - pooled connections outlive the request,
+            # so it cannot be left for the end of the session
+
+def query_variable_edges(dataset_id, property_id, conn=None, debug=False) -> Dict[str, str]:
+    # Returns the IDs of all the measurement edges of a variable - the main edges and all the edges connected to them,
+    # each with the ID of its main edge
+    query = f"""
+            WITH e_main AS (
+                SELECT e_main.id
+                    FROM edges AS e_main
+                    JOIN edges AS e_dataset ON (e_dataset.node1=e_main.id AND e_dataset.label='P2006020004')
+                WHERE e_main.label='{property_id}' AND e_dataset.node2='{dataset_id}'
+            )
+            SELECT id, id AS main_id FROM e_main
+            UNION ALL
+            SELECT e_property.id, e_main.id AS main_id
+                FROM edges AS e_property JOIN e_main ON (e_property.node1=e_main.id)
+    """
+    if debug:
+        print(query)
+
+    return {row['id']: row['main_id'] for row in query_to_dicts(query, conn)}
 
 def variable_data_exists(dataset_id, property_ids, debug=False):
     # Check whether there is some data for any of the property_ids
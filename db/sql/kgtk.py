@@ -1,150 +1,318 @@
 # This file contains code that imports a KGTK file into the database. This code is taken from the postgres-wikidata
 # repository, and should at some point be united into the KGTK toolkit
 
-from api.kgtk_wrapper import KGTKPipeline
 import csv
 # Import edges from a KGTK TSV file
 import datetime
 import os.path
+import queue
 import shutil
 import subprocess
 import tempfile
+import threading
 import time
+import uuid
 from csv import DictReader
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Iterable, Iterator
 from api import kgtk_wrapper
 
-import dateutil.parser
+import pandas as pd
+from pandas import DataFrame
 
-from db.sql.models import (CoordinateValue, DateValue, Edge, QuantityValue,
-                           StringValue, SymbolValue)
-from db.sql.utils import create_sqlalchemy_session, postgres_connection
+from db.sql import measurements
+from db.sql.kgtk_classifier import classify_edges, iter_records, read_kgtk_frames
+from flask import current_app, has_app_context
 
+from db.sql.utils import LineStream, create_sqlalchemy_session, delete_by_keys, postgres_connection
 
-def create_edge_objects(row):
-    # Returns a tuple of a edge and an additional Value object (or None if there is no such object)
 
-    def get_edge_object(row):
-        edge = Edge(id=row['id'],
-                    node1=row['node1'],
-                    label=row['label'],
-                    node2=row['node2'],
-                    data_type=row['node2;kgtk:data_type'])  # rank is optional
-        return edge
+def unquote(string):
+    if len(string)>1 and string[0] == '"' and string[-1] == '"':
+        # Kgtk escapes double quotes, remove the escape characters
+        return string[1:-1].replace('\\"', '"')
+    else:
+        return string
 
-    def get_value_object(row):
-        # Try the value types one by one, until return the correct one (if any)
-        type_funcs = [get_date_object, get_coordinate_object,
-                      get_quantity_object, get_symbol_object, get_string_object]
-        for func in type_funcs:
-            obj = func(row)
-            if obj:
-                return obj
 
-        raise ValueError(f'Row has no value object', row)
+# Number of objects of a single value type kept in memory before they are written to the database
+DEFAULT_IMPORT_BATCH_SIZE = 50000
 
-    def get_date_object(row):
-        # node2;magnitude should be of a caret followed by an ISO date. node2;calendar and node2;precision are optional
 
-        date = row.get('node2;kgtk:date_and_time')
-        if not date:
-            return None
-        try:
-            date = dateutil.parser.isoparse(date)
-        except ValueError:
-            return None
-
-        calendar = row.get('node2;kgtk:calendar')
-        precision = row.get('node2;kgtk:precision')
-        obj = DateValue(edge_id=row['id'],
-                        date_and_time=date,
-                        calendar=calendar or None,
-                        precision=precision or None)
-
-        return obj
-
-    def get_coordinate_object(row):
-        longitude = row.get('node2;kgtk:longitude')
-        latitude = row.get('node2;kgtk:latitude')
-        precision = row.get('node2;precision')
-        if not longitude and not latitude:
-            return None
+def read_object_batches(frames: Iterable[Tuple[int, DataFrame]], batch_size=DEFAULT_IMPORT_BATCH_SIZE) \
+        -> Iterator[Tuple[str, DataFrame, DataFrame]]:
+    # Classifies chunks of exploded KGTK edges, yielding (value type, edges, values) whenever a type's buffer is full,
+    # and the remainders once the chunks are exhausted
+    buffers: Dict[str, List[Tuple]] = dict()   # Map from value type to list of (edges, values)
+    sizes: Dict[str, int] = dict()
 
-        try:
-            longitude = float(longitude)
-            latitude = float(latitude)
-        except ValueError:
-            raise ValueError('Long or lat not numeric', row)
+    def flush(value_type):
+        frames = buffers.pop(value_type)
+        sizes.pop(value_type)
+        edges = pd.concat([t[0] for t in frames]) if len(frames) > 1 else frames[0][0]
+        values = pd.concat([t[1] for t in frames]) if len(frames) > 1 else frames[0][1]
+        return value_type, edges, values
 
-        return CoordinateValue(edge_id=row['id'], longitude=longitude, latitude=latitude, precision=precision)
+    for (first_row, df) in frames:
+        for (value_type, (edges, values)) in classify_edges(df, first_row).items():
+            buffers.setdefault(value_type, []).append((edges, values))
+            sizes[value_type] = sizes.get(value_type, 0) + len(edges)
+            if sizes[value_type] >= batch_size:
+                yield flush(value_type)
 
-    def get_quantity_object(row):
-        number = row.get('node2;kgtk:number')
-        if not number:
-            return None
-        try:
-            number = float(number)
-        except ValueError:
-            return None
+    for value_type in list(buffers.keys()):
+        yield flush(value_type)
 
-        high_tolerance = row.get('node2;kgtk:high_tolerance') or None
-        low_tolerance = row.get('node2;kgtk:low_tolerance') or None
-        try:
-            if high_tolerance:
-                high_tolerance = float(high_tolerance)
-            if low_tolerance:
-                low_tolerance = float(low_tolerance)
-        except ValueError:
-            raise ValueError('High or low tolerance not numeric', row)
 
-        unit = row.get('node2;kgtk:units_node')
-        return QuantityValue(edge_id=row['id'],
-                             number=number, high_tolerance=high_tolerance, low_tolerance=low_tolerance, unit=unit)
+class _BackgroundIterator:
+    # Runs an iterator on a background thread, so that producing the next item overlaps with consuming the
+    # current one. At most maxsize items are kept in memory. Exceptions raised by the iterator are re-raised
+    # in the consuming thread.
+    _DONE = object()
 
-    def get_symbol_object(row):
-        symbol = row['node2;kgtk:symbol']
-        if symbol == '' or symbol is None:
-            return None
-        return SymbolValue(edge_id=row['id'], symbol=symbol)
+    def __init__(self, iterable: Iterable, maxsize=2):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(iterable,), daemon=True)
+        self._thread.start()
 
-    def get_string_object(row):
-        data_type = row.get('node2;kgtk:data_type')
-        text = row.get('node2;kgtk:text')
-        language = row.get('node2;kgtk:language')
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
 
-        if data_type != 'string' and not text:  # do not rely on data_type, but if it says string, accept empty strings as well
-            return None
-        if not language:
-            language = None
+    def _produce(self, iterable):
+        try:
+            for item in iterable:
+                if not self._put((item, None)):
+                    return
+        except BaseException as e:
+            self._put((self._DONE, e))
+            return
+        self._put((self._DONE, None))
+
+    def __iter__(self):
+        try:
+            while True:
+                item, error = self._queue.get()
+                if item is self._DONE:
+                    if error:
+                        raise error
+                    return
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        # Tell the producer to stop, in case the consumer quits early
+        self._stopped.set()
+        self._thread.join()
+
+
+def _import_workers(config=None, workers=None) -> int:
+    # The number of parallel import connections, IMPORT_WORKERS in the configuration by default
+    if workers is None:
+        if config is None and has_app_context():
+            config = current_app.config
+        workers = (config or {}).get('IMPORT_WORKERS') or 1
+    return max(int(workers), 1)
+
+
+def _prepared_transactions_enabled(config=None) -> bool:
+    # Parallel imports rely on two phase commits, which are disabled in Postgres by default
+    with postgres_connection(config) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW max_prepared_transactions")
+            return int(cursor.fetchone()[0]) > 0
+
+
+class _ImportWorker:
+    # Writes a partition of the edges on its own connection, in a transaction that is prepared (but not committed)
+    # once all the batches have been written
+    def __init__(self, conn, xid, import_batch):
+        self.conn = conn
+        self.error = None
+        self._aborted = False
+        self._queue = queue.Queue(maxsize=2)
+        self.conn.tpc_begin(xid)
+        self._thread = threading.Thread(target=self._run, args=(import_batch,), daemon=True)
+        self._thread.start()
+
+    def _run(self, import_batch):
+        finished = False
+        try:
+            with self.conn.cursor() as cursor:
+                while True:
+                    batch = self._queue.get()
+                    if batch is None:
+                        finished = True
+                        break
+                    import_batch(cursor, *batch)
+            if not self._aborted:
+                self.conn.tpc_prepare()
+        except BaseException as e:
+            self.error = e
+            while not finished and self._queue.get() is not None:  # Make sure put never blocks
+                pass
+
+    def put(self, type_name: str, edges: DataFrame, values: DataFrame):
+        self._queue.put((type_name, edges, values))
+
+    def finish(self, abort=False):
+        self._aborted = abort
+        self._queue.put(None)
+        self._thread.join()
+
+
+# Prefix of the global transaction ids of parallel imports
+_IMPORT_GTRID_PREFIX = 'kgtk-import-'
+
+# Prepared import transactions older than this were left behind by an import that died, the workers of a live import
+# commit theirs right after preparing them
+STALE_PREPARED_IMPORT_AGE = datetime.timedelta(minutes=10)
+
+
+def rollback_stale_imports(config=None, max_age: datetime.timedelta = STALE_PREPARED_IMPORT_AGE) -> int:
+    """ Rolls back the prepared transactions of parallel imports that are older than max_age, returning their number.
+
+    A worker whose process or connection dies after preparing its transaction leaves it behind, holding its locks until
+    it is resolved. This is called before every parallel import, and can be called when the application starts.
+    """
+    count = 0
+    with postgres_connection(config) as conn:
+        database = conn.info.dbname
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for xid in conn.tpc_recover():
+            if not (xid.gtrid or '').startswith(_IMPORT_GTRID_PREFIX) or xid.database != database:
+                continue
+            if xid.prepared and now - xid.prepared < max_age:
+                continue
+            print(f"Rolling back stale prepared import transaction {xid.gtrid} {xid.bqual}")
+            conn.tpc_rollback(xid)
+            count += 1
+    return count
+
+
+def _commit_prepared(conns, xids, config):
+    # Commits the prepared transactions of all the workers. There is no going back once the first one is committed: a
+    # commit that fails is retried on a new connection, and if that fails as well the import may be partially
+    # committed and an error is raised. Transactions left prepared are rolled back by rollback_stale_imports later on.
+    failed = []
+    for (conn, xid) in zip(conns, xids):
+        try:
+            conn.tpc_commit()
+        except Exception:
+            failed.append(xid)
 
-        return StringValue(edge_id=row['id'], text=text, language=language)
+    for xid in failed:
+        try:
+            with postgres_connection(config) as retry_conn:
+                retry_conn.tpc_commit(xid)
+        except Exception as e:
+            raise RuntimeError(f"Parallel import {xid.gtrid} may be partially committed, {len(failed)} of {len(conns)} "
+                               f"workers failed to commit") from e
+
+
+def _import_in_parallel(batches, config, workers: int, import_batch) -> int:
+    # Partitions the edges by their id, so that each edge and its value are written by the same worker, and the
+    # foreign keys are satisfied within each worker's transaction. The transactions are only committed once all the
+    # workers have successfully prepared theirs, otherwise they are all rolled back.
+    # The commits are not atomic - see _commit_prepared for the window in which an import can be partially committed.
+    rollback_stale_imports(config)
+    gtrid = f'{_IMPORT_GTRID_PREFIX}{uuid.uuid4()}'
+    conns = []
+    xids = []
+    import_workers: List[_ImportWorker] = []
+    count = 0
+    try:
+        for n in range(workers):
+            conns.append(postgres_connection(config))
+            xids.append(conns[n].xid(0, gtrid, str(n)))
+            import_workers.append(_ImportWorker(conns[n], xids[n], import_batch))
 
-    edge = get_edge_object(row)
-    value = get_value_object(row)
+        aborted = True
+        try:
+            for (type_name, edges, values) in batches:
+                if any(worker.error for worker in import_workers):
+                    break
+                partitions = pd.util.hash_pandas_object(edges['id'], index=False).values % workers
+                for (n, worker) in enumerate(import_workers):
+                    partition = partitions == n
+                    if partition.any():
+                        worker.put(type_name, edges[partition], values[partition])
+                count += len(edges)
+            else:
+                aborted = False
+        finally:
+            for worker in import_workers:
+                worker.finish(abort=aborted)
+
+        errors = [worker.error for worker in import_workers if worker.error]
+        if errors:
+            raise errors[0]
+    except:
+        for conn in conns:
+            try:
+                conn.tpc_rollback()
+            except Exception:
+                pass  # Not in a two phase transaction, the connection is gone (rollback_stale_imports cleans up)
+        for conn in conns:
+            conn.close()
+        raise
 
-    return edge, value
+    try:
+        _commit_prepared(conns, xids, config)
+    finally:
+        for conn in conns:
+            conn.close()
 
+    return count
 
-def unquote(string):
-    if len(string)>1 and string[0] == '"' and string[-1] == '"':
-        # Kgtk escapes double quotes, remove the escape characters
-        return string[1:-1].replace('\\"', '"')
-    else:
-        return string
 
-def unquote_dict(row: dict):
-    for key, value in row.items():
-        row[key] = unquote(value)
-
-def import_kgtk_tsv(filename: str, config=None, delete=False, replace=False, fail_if_duplicate=False, conn=None):
+def import_kgtk_tsv(filename: str, config=None, delete=False, replace=False, fail_if_duplicate=False, conn=None,
+                    method='insert', batch_size=DEFAULT_IMPORT_BATCH_SIZE, background=True, workers=None):
     """ This function takes an exploded KGTK edge file and imports it into the database.
 
+    See import_kgtk_frames for the different modes of operations.
+    """
+    frames = read_kgtk_frames(filename, batch_size)
+    import_kgtk_frames(frames, config, delete=delete, replace=replace, fail_if_duplicate=fail_if_duplicate, conn=conn,
+                       method=method, batch_size=batch_size, background=background, workers=workers)
+
+
+def import_kgtk_frames(frames: Iterable[Tuple[int, DataFrame]], config=None, delete=False, replace=False,
+                       fail_if_duplicate=False, conn=None, method='insert', batch_size=DEFAULT_IMPORT_BATCH_SIZE,
+                       background=True, workers=None):
+    """ This function takes chunks of exploded KGTK edges and imports them into the database.
+
+    frames yields pairs of (row number of the first edge, DataFrame of edges), the row number is used in errors.
+
     It has several modes of operations:
     delete = True  ==> edges from the kgtk file are deleted, not created
     replace = True => edges are overwritten (essentially deleted and then inserted)
     fail_duplicate = True => duplicate edges cause a failure
 
     If all flags are False, edges are going to be added. Duplicated edges are not touched in the database.
+
+    Rows are written with one of two methods:
+    method = 'insert' => multi-row INSERT statements
+    method = 'copy'   => each type is streamed into a temporary staging table with COPY FROM STDIN, and then
+                         merged into its table with INSERT ... SELECT. Considerably faster for large files.
+
+    The edges are classified in chunks - once batch_size objects of the same value type have been read, they are
+    written to the database and released. With background = True parsing is done on a separate thread, overlapping
+    with the database writes. Everything is still written in one transaction.
+
+    With workers > 1 (IMPORT_WORKERS in the configuration by default) the edges are split between several connections
+    writing in parallel. Each connection writes in a prepared transaction, and they are all committed or all rolled
+    back. This requires max_prepared_transactions to be set in Postgres, the import is serial otherwise, as it is
+    when conn is passed.
+
+    If the measurements table exists, the measurements of the imported (or deleted) edges are rebuilt once all the
+    edges have been written, see db.sql.measurements.
     """
     def column_names(fields):
         for field in fields:
@@ -188,11 +356,12 @@ def import_kgtk_tsv(filename: str, config=None, delete=False, replace=False, fai
         'SymbolValue': ('symbols', ['edge_id$', 'symbol$']),
     }
 
-    def write_objects(typename, objects, fail_if_duplicate):
+    def write_objects(cursor, typename, df: DataFrame, fail_if_duplicate):
         nonlocal OBJECT_INFO
 
         table_name, fields = OBJECT_INFO[typename]
         columns = list(column_names(fields))
+        objects = list(iter_records(typename, df))
 
         CHUNK_SIZE = 10000
         for x in range(0, len(objects), CHUNK_SIZE):
@@ -204,90 +373,135 @@ def import_kgtk_tsv(filename: str, config=None, delete=False, replace=False, fai
                 statement += "\nON CONFLICT DO NOTHING;"
             cursor.execute(statement)
 
-    def save_objects(type_name: str, objects: List[Tuple], fail_if_duplicate):
-        edges = [t[0] for t in objects]
-        write_objects('Edge', edges, fail_if_duplicate)
-        values = [t[1] for t in objects]
-        write_objects(type_name, values, fail_if_duplicate)
+    def copy_lines(df: DataFrame, fields, column_names):
+        # Formats the entire DataFrame in COPY's text format, one column at a time
+        formatted = []
+        for (idx, field) in enumerate(fields):
+            column = column_names[idx]
+            nulls = df[column].isna()
+            if nulls.any() and not '?' in field:
+                raise ValueError(f"Non nullable field {column} as a null value")
+            text = df[column].astype(str)
+            if '$' in field:
+                text = text.str.replace('\\', '\\\\', regex=False).str.replace('\t', '\\t', regex=False) \
+                    .str.replace('\n', '\\n', regex=False).str.replace('\r', '\\r', regex=False)
+            formatted.append(text.where(~nulls, '\\N'))
+        lines = formatted[0].str.cat(formatted[1:], sep='\t') + '\n'
+        return lines.tolist()
 
-    def delete_object_records(typename, objects):
+    def copy_objects(cursor, typename, df: DataFrame, fail_if_duplicate):
         nonlocal OBJECT_INFO
-        table_name, fields = OBJECT_INFO[typename]
-        columns = list(column_names(fields))
 
-        # The id is the first column
-        CHUNK_SIZE = 10000 # Delete 10000 rows at a time
-        for x in range(0, len(objects), CHUNK_SIZE):
-            slice = objects[x:x+CHUNK_SIZE]
-            ids = [object_values(obj, fields[:1], columns[:1])[0] for obj in slice]
-            ids_string = '(' + ','.join(ids) + ')'
-            statement = f"DELETE FROM {table_name} WHERE {columns[0]} IN {ids_string};"
-            cursor.execute(statement)
-
-    def delete_objects(type_name: str, objects: List[Tuple]):
-        edges = [t[0] for t in objects]
-        delete_object_records('Edge', edges)
-        values = [t[1] for t in objects]
-        delete_object_records(type_name, values)
+        table_name, fields = OBJECT_INFO[typename]
+        columns = ', '.join(column_names(fields))
+
+        if not parallel:
+            # The staging table is dropped when the transaction ends, we recreate it for every type since
+            # several imports can run in the same transaction
+            staging_table = f'staging_{table_name}'
+            cursor.execute(f"""DROP TABLE IF EXISTS {staging_table};
+                CREATE TEMPORARY TABLE {staging_table} (LIKE {table_name}) ON COMMIT DROP;""")
+        else:
+            # Prepared transactions cannot use temporary tables, so each connection uses its own unlogged table
+            staging_table = f'staging_{table_name}_{cursor.connection.get_backend_pid()}'
+            cursor.execute(f"""DROP TABLE IF EXISTS {staging_table};
+                CREATE UNLOGGED TABLE {staging_table} (LIKE {table_name});""")
+
+        lines = copy_lines(df, fields, list(column_names(fields)))
+        cursor.copy_expert(f"COPY {staging_table} ({columns}) FROM STDIN", LineStream(lines))
+
+        statement = f"INSERT INTO {table_name} ( {columns} ) SELECT {columns} FROM {staging_table}"
+        if not fail_if_duplicate:
+            statement += "\nON CONFLICT DO NOTHING"
+        cursor.execute(statement)
+        if parallel:
+            cursor.execute(f"DROP TABLE {staging_table}")
+
+    def save_objects(cursor, type_name: str, edges: DataFrame, values: DataFrame, fail_if_duplicate):
+        write = copy_objects if method == 'copy' else write_objects
+        write(cursor, 'Edge', edges, fail_if_duplicate)
+        write(cursor, type_name, values, fail_if_duplicate)
+
+    def delete_objects(cursor, edges: DataFrame):
+        # The values are deleted along with their edges, by the foreign keys' ON DELETE CASCADE
+        delete_by_keys('edges', 'id', edges['id'], conn=cursor.connection, temporary=not parallel)
+
+    def import_batch(cursor, type_name: str, edges: DataFrame, values: DataFrame):
+        if track_measurements:
+            # refresh_measurements resolves the main edges of the touched edges, except for deleted edges, which are
+            # gone by then - their node1 is the main edge of a deleted qualifier
+            with touched_lock:
+                touched_edges.update(edges['id'])
+                if delete:
+                    touched_edges.update(edges['node1'])
+        if delete or replace:
+            delete_objects(cursor, edges)
+            print(f"Deleted {len(edges)} of {type_name} - {time.time() - start}")
+        if not delete:
+            save_objects(cursor, type_name, edges, values, fail_if_duplicate)
+            print(f"Saved {len(edges)} of {type_name} - {time.time() - start}")
 
     flag_count = int(delete) + int(replace) + int(fail_if_duplicate)
     if flag_count > 1:
         raise ValueError("Only one of delete, replace and fail_duplicate may be True")
+    if method not in ('insert', 'copy'):
+        raise ValueError(f"Unknown import method {method}")
 
     if replace:  # Avoid the ON CONFLICT clause in case of replace, since we know for a fact there will not be duplicates
         fail_if_duplicate = True
 
-    obj_map: Dict[str, List[Tuple]] = dict()   # Map from value type to list of (edge, value)
     start = time.time()
     print("Reading rows")
-    with open(filename, "r", encoding="utf-8") as f:
-        reader = DictReader(f, delimiter='\t', quoting=csv.QUOTE_NONE)
-        row_num = 1
-        for row in reader:
-            row_num += 1
-            unquote_dict(row)
-            try:
-                edge, value = create_edge_objects(row)
-            except:
-                print(f"Error in row {row_num}")
-                raise
-            value_type = type(value).__name__
-            if value_type not in obj_map:
-                obj_map[value_type] = []
-            obj_map[value_type].append((edge, value))
-
-    count = 0
-    for (type_name, objects) in obj_map.items():
-        count += len(objects)
-        print(f"{type_name}\t{len(objects)}")
-    print(f"Read {count} objects in {time.time() - start}")
-
-    if count == 0:
-        return
+    batches = read_object_batches(frames, batch_size)
+    if background:
+        batches = _BackgroundIterator(batches)
 
-    # Time to write the edges
     if config and not 'POSTGRES' in config:
         config = dict(POSTGRES=config)
 
+    workers = _import_workers(config, workers)
+    parallel = workers > 1 and not conn
+    if parallel and not _prepared_transactions_enabled(config):
+        print("max_prepared_transactions is 0, importing serially")
+        parallel = False
+
+    # The ids of the imported edges, whose measurements need to be rebuilt
+    touched_edges = set()
+    touched_lock = threading.Lock()
+
+    count = 0
+    our_conn = False
     try:
         if not conn:
             conn = postgres_connection(config)
             our_conn = True
+        track_measurements = measurements.does_table_exist(conn)
+
+        if parallel:
+            conn.rollback()  # Do not sit idle in a transaction while the workers write
+            count = _import_in_parallel(batches, config, workers, import_batch)
+            if track_measurements:
+                # The edges are only visible once all the workers have committed
+                with conn.cursor() as cursor:
+                    written = measurements.refresh_measurements(cursor, touched_edges)
+                conn.commit()
+                print(f"Rebuilt {written} measurements - {time.time() - start}")
         else:
-            our_conn = False
-        with conn.cursor() as cursor:
-            # Everything here runs under one transaction
-            for (type_name, objects) in obj_map.items():
-                if delete or replace:
-                    delete_objects(type_name, objects)
-                    print(f"Deleted {len(objects)} of {type_name} - {time.time() - start}")
-                if not delete:
-                    save_objects(type_name, objects, fail_if_duplicate)
-                    print(f"Saved {len(objects)} of {type_name} - {time.time() - start}")
-
-        if our_conn:
-            conn.commit()
+            with conn.cursor() as cursor:
+                # Everything here runs under one transaction
+                for (type_name, edges, values) in batches:
+                    count += len(edges)
+                    import_batch(cursor, type_name, edges, values)
+
+                if track_measurements and touched_edges:
+                    written = measurements.refresh_measurements(cursor, touched_edges)
+                    print(f"Rebuilt {written} measurements - {time.time() - start}")
+
+            if our_conn:
+                conn.commit()
     finally:
+        if background:
+            batches.close()
         if our_conn:
             conn.close()
 
@@ -295,15 +509,17 @@ def import_kgtk_tsv(filename: str, config=None, delete=False, replace=False, fai
 
     return
 
-def import_kgtk_dataframe(df, config=None, is_file_exploded=False, fail_if_duplicate=False, conn=None):
-    with KGTKPipeline(df) as ctx:
-        if not is_file_exploded:
-            kgtk_wrapper.explode(ctx, 'input.tsv', 'exploded.tsv')
-            path = ctx.get_file('exploded.tsv')
-        else:
-            path = ctx.get_file('input.tsv')
+def import_kgtk_dataframe(df, config=None, is_file_exploded=False, fail_if_duplicate=False, conn=None, method='copy',
+                          batch_size=DEFAULT_IMPORT_BATCH_SIZE):
+    # The edges are exploded and imported in memory, kgtk is only run for unusual node2 values
+    if not is_file_exploded:
+        df = kgtk_wrapper.explode_frame(df)
+    else:
+        df = df.fillna('').astype(str)
 
-        import_kgtk_tsv(str(path), config, conn=conn, fail_if_duplicate=fail_if_duplicate)
+    frames = ((start + 2, df.iloc[start:start + batch_size]) for start in range(0, len(df), batch_size))
+    import_kgtk_frames(frames, config, conn=conn, fail_if_duplicate=fail_if_duplicate, method=method,
+                       batch_size=batch_size)
 
     # temp_dir = tempfile.mkdtemp()
     # try:
@@ -0,0 +1,284 @@
+# This file contains the columnar value type classifier used when importing exploded KGTK files.
+#
+# Instead of creating SQLAlchemy objects row by row, a batch of exploded rows is held in a DataFrame. Each value type
+# is detected with a column mask, dates and numbers are parsed for the entire column at once, and the result is a
+# DataFrame per table, ready to be copied into the database. Lightweight records are provided for code that still
+# needs row objects.
+
+import csv
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+import dateutil.parser
+import pandas as pd
+from pandas import DataFrame, Series
+
+
+class Record:
+    # A lightweight replacement for the SQLAlchemy models, holding one row of a table.
+    # The slots are the table's columns, in order
+    __slots__ = ()
+    type_name = ''
+
+    def __init__(self, *values):
+        for (column, value) in zip(self.__slots__, values):
+            setattr(self, column, value)
+
+    def __repr__(self):
+        values = ', '.join(f'{column}={getattr(self, column)!r}' for column in self.__slots__)
+        return f'{type(self).__name__}({values})'
+
+
+class EdgeRecord(Record):
+    __slots__ = ('id', 'node1', 'label', 'node2', 'data_type')
+    type_name = 'Edge'
+
+
+class StringRecord(Record):
+    __slots__ = ('edge_id', 'text', 'language')
+    type_name = 'StringValue'
+
+
+class DateRecord(Record):
+    __slots__ = ('edge_id', 'date_and_time', 'precision', 'calendar')
+    type_name = 'DateValue'
+
+
+class QuantityRecord(Record):
+    __slots__ = ('edge_id', 'number', 'unit', 'low_tolerance', 'high_tolerance')
+    type_name = 'QuantityValue'
+
+
+class CoordinateRecord(Record):
+    __slots__ = ('edge_id', 'latitude', 'longitude', 'precision')
+    type_name = 'CoordinateValue'
+
+
+class SymbolRecord(Record):
+    __slots__ = ('edge_id', 'symbol')
+    type_name = 'SymbolValue'
+
+
+RECORD_TYPES = OrderedDict((record_type.type_name, record_type) for record_type in
+                           (EdgeRecord, StringRecord, DateRecord, QuantityRecord, CoordinateRecord, SymbolRecord))
+
+# Called with the file row number and the error, when rows are skipped instead of failing the batch
+ErrorHandler = Callable[[int, ValueError], None]
+
+# ISO dates as accepted by dateutil.parser.isoparse, with an optional time zone suffix
+_ISO_DATE = r'^\d{4}(-\d{2}(-\d{2}([T ]\d{2}(:\d{2}(:\d{2}([.,]\d+)?)?)?)?)?)?(Z|[+-]\d{2}(:?\d{2})?)?$'
+_TIME_ZONE = r'(Z|[+-]\d{2}(:?\d{2})?)$'
+
+
+def read_kgtk_frames(filename: str, chunksize: int) -> Iterator[Tuple[int, DataFrame]]:
+    # Reads an exploded KGTK file in chunks, yielding the file row number of the first row and the chunk.
+    # All the values are read as strings, empty values are empty strings
+    reader = pd.read_csv(filename, sep='\t', quoting=csv.QUOTE_NONE, dtype=str, encoding='utf-8',
+                         keep_default_na=False, na_filter=False, chunksize=chunksize)
+    first_row = 2  # Row 1 is the header
+    for df in reader:
+        yield first_row, df.fillna('')
+        first_row += len(df)
+
+
+def unquote_frame(df: DataFrame) -> DataFrame:
+    # Vectorized version of kgtk.unquote - strips the quotes KGTK places around strings and removes the escape
+    # characters of quotes
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        quoted = (values.str.len() > 1) & values.str.startswith('"') & values.str.endswith('"')
+        if quoted.any():
+            df.loc[quoted, column] = values[quoted].str[1:-1].str.replace('\\"', '"', regex=False)
+    return df
+
+
+def _column(df: DataFrame, name: str, default: Optional[str] = '') -> Series:
+    if name in df.columns:
+        return df[name]
+    return Series(default, index=df.index, dtype=object)
+
+
+def _to_float(text: Series) -> Series:
+    # Converts a column to floats, like float() does. Values that are not numbers become NaN
+    numbers = pd.to_numeric(text.where(text != ''), errors='coerce').astype(float)
+
+    # to_numeric is stricter than float() (it does not accept '1_000' or surrounding spaces, for instance)
+    unparsed = numbers.isna() & (text != '')
+    for idx in unparsed[unparsed].index:
+        try:
+            numbers[idx] = float(text[idx])
+        except ValueError:
+            pass
+    return numbers
+
+
+def _to_dates(text: Series) -> Series:
+    # Converts a column of ISO dates, the way dateutil.parser.isoparse does, to naive datetimes, NaT for values
+    # that are not dates. The time zone is dropped, since the database stores timestamps without one.
+    iso = text.str.match(_ISO_DATE)
+    local = text.where(iso).str.replace(_TIME_ZONE, '', regex=True)
+    dates = pd.to_datetime(local, errors='coerce')
+
+    # Dates pandas cannot handle (such as those before 1677) are parsed one by one
+    unparsed = dates.isna() & (text != '')
+    fallback = {}
+    for idx in unparsed[unparsed].index:
+        try:
+            fallback[idx] = dateutil.parser.isoparse(text[idx]).replace(tzinfo=None)
+        except (ValueError, OverflowError):
+            pass
+    if fallback:
+        dates = dates.astype(object)
+        for (idx, date) in fallback.items():
+            dates[idx] = date
+    return dates
+
+
+def _nullable(values: Series) -> Series:
+    # Empty strings become None
+    return values.where(values != '', None).astype(object)
+
+
+def _row_error(df: DataFrame, first_row: int, mask: Series, message: str) -> Tuple[int, ValueError]:
+    position = int(mask.values.argmax())
+    row = df.iloc[position].to_dict()
+    return first_row + position, ValueError(message, row)
+
+
+def classify_edges(df: DataFrame, first_row=2, on_error: ErrorHandler = None) -> Dict[str, Tuple[DataFrame, DataFrame]]:
+    """ Splits a batch of exploded KGTK rows by the type of their value.
+
+    The result maps value type names (DateValue, QuantityValue and so on) to a pair of DataFrames - the edges and
+    their values, with the columns of the edges table and the value's table. Types are tried in the same order as
+    always: date, coordinate, quantity, symbol and string.
+
+    Rows that cannot be classified raise a ValueError, unless on_error is passed, in which case it is called and the
+    rows are skipped. first_row is the file row number of the first row in the batch, used in errors.
+    """
+    # Values are matched back to their edges by index label, which must be unique (frames passed by callers, such as
+    # concatenated frames, may repeat labels)
+    df = unquote_frame(df.fillna('').reset_index(drop=True))
+    remaining = Series(True, index=df.index)
+    values: Dict[str, DataFrame] = OrderedDict()
+
+    def fail(mask: Series, message: str):
+        row_num, error = _row_error(df, first_row, mask, message)
+        if not on_error:
+            print(f"Error in row {row_num}")
+            raise error
+        for position in mask.values.nonzero()[0]:
+            on_error(first_row + int(position), ValueError(message, df.iloc[position].to_dict()))
+        remaining[mask] = False
+
+    # Dates - node2;kgtk:date_and_time holds an ISO date. calendar and precision are optional
+    date_text = _column(df, 'node2;kgtk:date_and_time')
+    mask = remaining & (date_text != '')
+    if mask.any():
+        dates = _to_dates(date_text[mask])
+        mask[mask] = dates.notna()
+        if mask.any():
+            values['DateValue'] = DataFrame({
+                'edge_id': df['id'][mask],
+                'date_and_time': dates[mask[mask].index],
+                'precision': _nullable(_column(df, 'node2;kgtk:precision')[mask]),
+                'calendar': _nullable(_column(df, 'node2;kgtk:calendar')[mask]),
+            })
+            remaining &= ~mask
+
+    # Coordinates - once there is a longitude or a latitude, both must be numeric
+    longitude_text = _column(df, 'node2;kgtk:longitude')
+    latitude_text = _column(df, 'node2;kgtk:latitude')
+    mask = remaining & ((longitude_text != '') | (latitude_text != ''))
+    if mask.any():
+        longitude = _to_float(longitude_text[mask])
+        latitude = _to_float(latitude_text[mask])
+        invalid = mask.copy()
+        invalid[mask] = longitude.isna() | latitude.isna()
+        if invalid.any():
+            fail(invalid, 'Long or lat not numeric')
+            mask &= ~invalid
+        if mask.any():
+            values['CoordinateValue'] = DataFrame({
+                'edge_id': df['id'][mask],
+                'latitude': latitude[mask[mask].index],
+                'longitude': longitude[mask[mask].index],
+                'precision': _column(df, 'node2;precision', None)[mask].astype(object),
+            })
+            remaining &= ~mask
+
+    # Quantities - a numeric node2;kgtk:number, with optional tolerances and unit
+    number_text = _column(df, 'node2;kgtk:number')
+    mask = remaining & (number_text != '')
+    if mask.any():
+        numbers = _to_float(number_text[mask])
+        mask[mask] = numbers.notna()
+        if mask.any():
+            high_text = _column(df, 'node2;kgtk:high_tolerance')[mask]
+            low_text = _column(df, 'node2;kgtk:low_tolerance')[mask]
+            high = _to_float(high_text)
+            low = _to_float(low_text)
+            invalid = mask.copy()
+            invalid[mask] = (high.isna() & (high_text != '')) | (low.isna() & (low_text != ''))
+            if invalid.any():
+                fail(invalid, 'High or low tolerance not numeric')
+                mask &= ~invalid
+            if mask.any():
+                values['QuantityValue'] = DataFrame({
+                    'edge_id': df['id'][mask],
+                    'number': numbers[mask[mask].index],
+                    'unit': _column(df, 'node2;kgtk:units_node', None)[mask].astype(object),
+                    'low_tolerance': low[mask[mask].index],
+                    'high_tolerance': high[mask[mask].index],
+                })
+                remaining &= ~mask
+
+    # Symbols
+    symbols = _column(df, 'node2;kgtk:symbol')
+    mask = remaining & (symbols != '')
+    if mask.any():
+        values['SymbolValue'] = DataFrame({
+            'edge_id': df['id'][mask],
+            'symbol': symbols[mask],
+        })
+        remaining &= ~mask
+
+    # Strings - do not rely on data_type, but if it says string, accept empty strings as well
+    text = _column(df, 'node2;kgtk:text')
+    mask = remaining & ((_column(df, 'node2;kgtk:data_type') == 'string') | (text != ''))
+    if mask.any():
+        values['StringValue'] = DataFrame({
+            'edge_id': df['id'][mask],
+            'text': text[mask],
+            'language': _nullable(_column(df, 'node2;kgtk:language')[mask]),
+        })
+        remaining &= ~mask
+
+    if remaining.any():
+        fail(remaining.copy(), 'Row has no value object')
+
+    result = OrderedDict()
+    for (type_name, value_df) in values.items():
+        rows = df.loc[value_df.index]
+        edges = DataFrame({
+            'id': rows['id'],
+            'node1': rows['node1'],
+            'label': rows['label'],
+            'node2': rows['node2'],
+            'data_type': rows['node2;kgtk:data_type'],
+        })
+        result[type_name] = (edges, value_df)
+
+    return result
+
+
+def iter_records(type_name: str, df: DataFrame) -> Iterator[Record]:
+    # Yields a record for each row of a classified DataFrame. Missing values are None
+    record_type = RECORD_TYPES[type_name]
+    columns = []
+    for column in record_type.__slots__:
+        values = df[column]
+        present = values.notna().tolist()
+        columns.append([value if ok else None for (value, ok) in zip(values.tolist(), present)])
+    for values in zip(*columns):
+        yield record_type(*values)
@@ -0,0 +1,213 @@
+# Manage the optional measurements table - a denormalized copy of the variable data stored in the edges table.
+#
+# A measurement is a main edge (subject, variable property, quantity), with its dataset edge (P2006020004), its time
+# (P585) and any other qualifiers. Reading a variable from the edges table takes a self join per qualifier, reading
+# it from the measurements table takes a single index scan.
+#
+# The table is maintained by the KGTK import (see db.sql.kgtk.import_kgtk_frames) once it exists, and rows are
+# removed along with their main edges by the foreign key. The data API reads from it when USE_MEASUREMENTS_TABLE
+# is set. Imports that bypass the KGTK importer (such as script/bulk_copy.py) require a backfill.
+
+from typing import Dict, Iterable
+
+from flask import current_app, has_app_context
+
+from db.sql.utils import create_key_table, query_to_dicts
+
+TABLE_NAME = 'measurements'
+
+_CREATE_TABLE = """
+CREATE TABLE measurements (
+    edge_id character varying NOT NULL PRIMARY KEY REFERENCES edges(id) ON DELETE CASCADE DEFERRABLE,
+    dataset_qnode character varying NOT NULL,
+    property character varying NOT NULL,
+    main_subject character varying NOT NULL,
+    time timestamp without time zone,
+    "precision" character varying,
+    value numeric NOT NULL,
+    unit character varying,
+    location character varying NOT NULL,
+    qualifiers jsonb NOT NULL
+);
+
+CREATE INDEX ix_measurements_variable ON measurements (dataset_qnode, property, main_subject, time, edge_id);
+CREATE INDEX ix_measurements_time ON measurements (dataset_qnode, property, time);
+CREATE INDEX ix_measurements_location ON measurements (location);
+"""
+
+# Qualifiers that have their own columns, and are not repeated in the qualifiers field
+OWN_COLUMN_QUALIFIERS = ('P2006020004', 'P585')
+
+# Location qualifiers, whose value is stored in the location column. Measurements without one are located at their
+# main subject
+LOCATION_QUALIFIERS = ('P131', 'P276')
+
+# The measurements of the main edges in {key_table}. Each qualifier is a JSON object holding its node2, and its value
+# in the fields of its type - text, symbol, number and unit, date and precision, latitude and longitude.
+_MEASUREMENTS_QUERY = """
+SELECT DISTINCT ON (e_main.id)
+        e_main.id AS edge_id,
+        e_dataset.node2 AS dataset_qnode,
+        e_main.label AS property,
+        e_main.node1 AS main_subject,
+        d_time.date_and_time AS time,
+        d_time.precision AS "precision",
+        q_main.number AS value,
+        q_main.unit AS unit,
+        COALESCE(e_location.node2, e_main.node1) AS location,
+        COALESCE((
+            SELECT jsonb_object_agg(e_qualifier.label, jsonb_strip_nulls(jsonb_build_object(
+                        'node2', e_qualifier.node2,
+                        'text', s_qualifier.text,
+                        'symbol', y_qualifier.symbol,
+                        'number', q_qualifier.number,
+                        'unit', q_qualifier.unit,
+                        'date', to_json(d_qualifier.date_and_time)#>>'{{}}' || 'Z',
+                        'precision', d_qualifier.precision,
+                        'latitude', c_qualifier.latitude,
+                        'longitude', c_qualifier.longitude)))
+                FROM edges e_qualifier
+                LEFT JOIN strings s_qualifier ON (e_qualifier.id=s_qualifier.edge_id)
+                LEFT JOIN symbols y_qualifier ON (e_qualifier.id=y_qualifier.edge_id)
+                LEFT JOIN quantities q_qualifier ON (e_qualifier.id=q_qualifier.edge_id)
+                LEFT JOIN dates d_qualifier ON (e_qualifier.id=d_qualifier.edge_id)
+                LEFT JOIN coordinates c_qualifier ON (e_qualifier.id=c_qualifier.edge_id)
+            WHERE e_qualifier.node1=e_main.id AND e_qualifier.label NOT IN {own_column_qualifiers}
+        ), '{{}}'::jsonb) AS qualifiers
+    FROM (SELECT DISTINCT key FROM {key_table}) k
+    JOIN edges e_main ON (e_main.id=k.key)
+    JOIN quantities q_main ON (e_main.id=q_main.edge_id)
+    JOIN edges e_dataset ON (e_dataset.node1=e_main.id AND e_dataset.label='P2006020004')
+    LEFT JOIN edges e_time
+        JOIN dates d_time ON (e_time.id=d_time.edge_id)
+    ON (e_time.node1=e_main.id AND e_time.label='P585')
+    LEFT JOIN edges e_location ON (e_location.node1=e_main.id AND e_location.label IN {location_qualifiers})
+ORDER BY e_main.id
+"""
+
+_COLUMNS = 'edge_id, dataset_qnode, property, main_subject, time, "precision", value, unit, location, qualifiers'
+
+
+def _sql_list(values: Iterable[str]) -> str:
+    return '(' + ', '.join(f"'{value}'" for value in values) + ')'
+
+
+def _measurements_query(key_table: str) -> str:
+    return _MEASUREMENTS_QUERY.format(key_table=key_table, own_column_qualifiers=_sql_list(OWN_COLUMN_QUALIFIERS),
+                                      location_qualifiers=_sql_list(LOCATION_QUALIFIERS))
+
+
+def use_measurements_table() -> bool:
+    # Whether the data API should read variable data from the measurements table
+    return has_app_context() and bool(current_app.config.get('USE_MEASUREMENTS_TABLE'))
+
+
+def does_table_exist(conn) -> bool:
+    result = query_to_dicts(f"SELECT to_regclass('public.{TABLE_NAME}') IS NOT NULL AS exists", conn)
+    return result[0]['exists']
+
+
+def create_table(conn, debug=False):
+    with conn.cursor() as cursor:
+        if debug:
+            print(_CREATE_TABLE)
+        cursor.execute(_CREATE_TABLE)
+
+
+def drop_table(conn, debug=False):
+    query = f"DROP TABLE IF EXISTS {TABLE_NAME};"
+    with conn.cursor() as cursor:
+        if debug:
+            print(query)
+        cursor.execute(query)
+
+
+def _refresh_from_key_table(cursor, key_table: str, debug=False) -> int:
+    # Rebuilds the measurements of the main edges listed in key_table. Keys that are not main edges are ignored,
+    # and measurements whose main edge no longer qualifies are removed
+    query = f"""
+    DELETE FROM {TABLE_NAME} m USING {key_table} k WHERE m.edge_id=k.key;
+    INSERT INTO {TABLE_NAME} ({_COLUMNS})
+    {_measurements_query(key_table)};
+    """
+    if debug:
+        print(query)
+    cursor.execute(query)
+    return cursor.rowcount
+
+
+def refresh_measurements(cursor, edge_ids: Iterable[str], temporary=True, debug=False) -> int:
+    """ Rebuilds the measurements that edge_ids belong to, returning the number of measurements written.
+
+    edge_ids may contain any edge id: main edges, qualifiers (whose node1 is their main edge) or ids of deleted main
+    edges, whose measurements are removed. Ids of other edges are ignored. Set temporary to False in prepared
+    transactions.
+    """
+    key_table = create_key_table(cursor, 'measurement_keys', edge_ids, temporary)
+    # The main edges of the qualifiers
+    cursor.execute(f"""INSERT INTO {key_table} (key)
+                        SELECT DISTINCT e.node1 FROM edges e JOIN {key_table} k ON (e.id=k.key);
+                       ANALYZE {key_table};""")
+    count = _refresh_from_key_table(cursor, key_table, debug)
+    cursor.execute(f"DROP TABLE {key_table}")
+    return count
+
+
+def backfill(conn, dataset_qnode: str = None, debug=False) -> int:
+    # Rebuilds the measurements of all the main edges (or just those of one dataset)
+    dataset_where = f"AND node2='{dataset_qnode}'" if dataset_qnode else ''
+    table_where = f"AND dataset_qnode='{dataset_qnode}'" if dataset_qnode else ''
+    with conn.cursor() as cursor:
+        cursor.execute(f"""DROP TABLE IF EXISTS pg_temp.backfill_keys;
+            CREATE TEMPORARY TABLE backfill_keys AS
+                SELECT node1 AS key FROM edges WHERE label='P2006020004' {dataset_where};
+            ANALYZE backfill_keys;""")
+        # Measurements whose main edge has lost its dataset edge
+        cursor.execute(f"""DELETE FROM {TABLE_NAME}
+                            WHERE edge_id NOT IN (SELECT key FROM backfill_keys) {table_where}""")
+        count = _refresh_from_key_table(cursor, 'backfill_keys', debug)
+        cursor.execute("DROP TABLE backfill_keys")
+    return count
+
+
+def check_consistency(conn, dataset_qnode: str = None, sample_size=10, debug=False) -> Dict:
+    """ Compares the measurements table with the edges table.
+
+    Returns the number of measurements missing from the table, the number of extra measurements it has and the
+    number of measurements whose content differs, along with a sample of edge ids of each.
+    """
+    dataset_where = f"AND node2='{dataset_qnode}'" if dataset_qnode else ''
+    table_where = f"WHERE dataset_qnode='{dataset_qnode}'" if dataset_qnode else ''
+    with conn.cursor() as cursor:
+        query = f"""DROP TABLE IF EXISTS pg_temp.check_keys;
+            CREATE TEMPORARY TABLE check_keys AS
+                SELECT node1 AS key FROM edges WHERE label='P2006020004' {dataset_where};
+            DROP TABLE IF EXISTS pg_temp.expected_measurements;
+            CREATE TEMPORARY TABLE expected_measurements AS {_measurements_query('check_keys')};
+            DROP TABLE IF EXISTS pg_temp.actual_measurements;
+            CREATE TEMPORARY TABLE actual_measurements AS SELECT * FROM {TABLE_NAME} {table_where};"""
+        if debug:
+            print(query)
+        cursor.execute(query)
+
+    checks = {
+        'missing': """SELECT e.edge_id FROM expected_measurements e
+                        LEFT JOIN actual_measurements a ON (e.edge_id=a.edge_id) WHERE a.edge_id IS NULL""",
+        'extra': """SELECT a.edge_id FROM actual_measurements a
+                        LEFT JOIN expected_measurements e ON (e.edge_id=a.edge_id) WHERE e.edge_id IS NULL""",
+        'different': f"""SELECT e.edge_id FROM expected_measurements e
+                        JOIN actual_measurements a ON (e.edge_id=a.edge_id)
+                        WHERE ({', '.join('e.' + c.strip() for c in _COLUMNS.split(','))}) IS DISTINCT FROM
+                              ({', '.join('a.' + c.strip() for c in _COLUMNS.split(','))})""",
+    }
+    report = {}
+    for (name, query) in checks.items():
+        count = query_to_dicts(f"SELECT count(*) AS count FROM ({query}) ids", conn)[0]['count']
+        sample = query_to_dicts(f"{query} ORDER BY 1 LIMIT {sample_size}", conn)
+        report[name] = count
+        report[f'{name}_sample'] = [row['edge_id'] for row in sample]
+
+    with conn.cursor() as cursor:
+        cursor.execute("DROP TABLE check_keys, expected_measurements, actual_measurements")
+
+    return report
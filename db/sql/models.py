@@ -39,7 +39,7 @@ class DateValue(Base):
     __tablename__ = 'dates'
     edge_id = Column(String, ForeignKey('edges.id', ondelete="CASCADE", deferrable=True), primary_key=True)
 
-    date_and_time = Column(DateTime, nullable=False)
+    date_and_time = Column(DateTime, nullable=False, index=True)
     precision = Column(String, nullable=True)
     calendar = Column(String, nullable=True)
 
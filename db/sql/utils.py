@@ -1,8 +1,15 @@
-from typing import Dict, List
+import io
+import itertools
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from timeit import default_timer
 
 import psycopg2
-from flask import current_app
+import psycopg2.extensions
+import psycopg2.pool
+from flask import current_app, g, has_app_context
 from pandas import DataFrame
 from sqlalchemy.engine import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -18,11 +25,243 @@ def _get_postgres_config(config=None):
 
     return config['POSTGRES']
 
-def postgres_connection(config=None):
+def _get_pool_config(config=None):
+    # Returns the connection pool configuration. Scripts usually pass just dict(POSTGRES=...), in which
+    # case the defaults of _ConnectionPool are used
+    if config is None:
+        config = current_app.config
+    return config.get('POSTGRES_POOL') or {}
+
+
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    pass
+
+
+class _ConnectionPool:
+    """ A thread-safe pool of psycopg2 connections to one database.
+
+    Connections are opened lazily, up to max_size. Idle connections above min_size are closed once they have
+    been idle for more than idle_timeout seconds. Connections that have been idle for more than health_check
+    seconds are pinged before being handed out (None disables the check, 0 pings on every checkout).
+    """
+    def __init__(self, postgres: Dict, min_size=1, max_size=20, idle_timeout=300, health_check=30,
+                 checkout_timeout=30):
+        self._postgres = postgres
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.checkout_timeout = checkout_timeout
+
+        self._idle: List[Tuple[psycopg2.extensions.connection, float]] = []  # (connection, last returned)
+        self._size = 0  # Number of open connections, idle or borrowed
+        self._cond = threading.Condition()
+        self.pid = os.getpid()
+
+    def getconn(self) -> psycopg2.extensions.connection:
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                if self._idle:
+                    conn, last_used = self._idle.pop()  # Most recently used first, the others can time out
+                elif self._size < self.max_size:
+                    self._size += 1
+                    break
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(f'No free Postgres connection after {self.checkout_timeout} seconds')
+                    self._cond.wait(remaining)
+                    continue
+
+            # Check the idle connection outside of the lock, this may require a round trip
+            if self._is_usable(conn, time.monotonic() - last_used):
+                return conn
+            self._discard(conn)
+
+        try:
+            return psycopg2.connect(**self._postgres)
+        except:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn: psycopg2.extensions.connection):
+        try:
+            if not conn.closed:
+                # Make sure the next borrower starts with a clean session
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.readonly is not None:
+                    conn.readonly = None  # Reset before autocommit, so the session default is reset as well
+                if conn.autocommit:
+                    conn.autocommit = False
+        except psycopg2.Error:
+            pass
+
+        if conn.closed:
+            self._discard(conn)
+            return
+
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            self._idle.append((conn, now))
+            # Close connections that have been idle for too long, keeping at least min_size connections open
+            while self._size - len(expired) > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+                expired.append(self._idle.pop(0)[0])
+            self._cond.notify()
+
+        for old_conn in expired:
+            self._discard(old_conn)
+
+    def _is_usable(self, conn, idle_time: float) -> bool:
+        if conn.closed:
+            return False
+        if self.idle_timeout is not None and idle_time > self.idle_timeout:
+            return False
+        if self.health_check is not None and idle_time >= self.health_check:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle = self._idle
+            self._idle = []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+class PooledConnection:
+    """ A connection borrowed from a _ConnectionPool.
+
+    It behaves like a psycopg2 connection, except that close() returns it to the pool, and leaving a with
+    block commits (or rolls back) the transaction *and* returns the connection to the pool.
+    """
+    def __init__(self, pool: _ConnectionPool, conn: psycopg2.extensions.connection):
+        self.__dict__['_pool'] = pool
+        self.__dict__['_conn'] = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__['_conn']
+        if conn is None:
+            raise psycopg2.InterfaceError('connection already returned to the pool')
+        return getattr(conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        conn = self.__dict__['_conn']
+        if conn is None:
+            return
+        self.__dict__['_conn'] = None
+        if self._pool.pid == os.getpid():
+            self._pool.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+# Process-wide pools, one per Postgres configuration
+_pools: Dict[Tuple, _ConnectionPool] = {}
+_pools_lock = threading.Lock()
+_forked_pools: List[_ConnectionPool] = []  # Pools inherited from a parent process
+
+def _get_pool(config=None) -> _ConnectionPool:
     postgres = _get_postgres_config(config)
-    conn = psycopg2.connect(**postgres)
+    key = tuple(sorted(postgres.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is not None and pool.pid != os.getpid():
+            # We have been forked (pre-fork web servers). The inherited sockets belong to the parent process,
+            # so we keep the old pool referenced, to make sure the connections are never closed from here
+            _forked_pools.append(pool)
+            pool = None
+        if pool is None:
+            pool = _pools[key] = _ConnectionPool(postgres, **_get_pool_config(config))
+    return pool
+
+def postgres_connection(config=None) -> PooledConnection:
+    """ Borrows a connection from the process-wide connection pool.
+
+    Call close() (or use a with block) to return the connection to the pool.
+    """
+    pool = _get_pool(config)
+    return PooledConnection(pool, pool.getconn())
+
+def close_all_connections():
+    """ Closes all idle connections of all pools """
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
+
+def request_connection(config=None) -> Optional[PooledConnection]:
+    """ Returns a read-only, autocommit connection bound to the current Flask request.
+
+    All the queries of one request reuse this connection, it is returned to the pool by
+    close_request_connection when the request is torn down. Returns None outside of Flask.
+    """
+    if config is not None or not has_app_context():
+        return None
+    conn = g.get('_postgres_connection')
+    if conn is None or conn.closed:
+        conn = postgres_connection()
+        conn.autocommit = True
+        conn.readonly = True
+        g._postgres_connection = conn
     return conn
 
+def close_request_connection(exception=None):
+    """ Returns the request connection to the pool, registered with Flask's teardown_appcontext """
+    conn = g.pop('_postgres_connection', None)
+    if conn is not None:
+        conn.close()
+
+def _read_connection(conn=None, config=None) -> Tuple[PooledConnection, bool]:
+    # Returns the connection to use for a read-only query, and whether it should be closed by the caller
+    if conn is not None:
+        return conn, False
+    conn = request_connection(config)
+    if conn is not None:
+        return conn, False
+    return postgres_connection(config), True
+
 # Store the engine and session class
 _engine = None
 _session_cls = None
@@ -44,38 +283,82 @@ def create_sqlalchemy_session(config=None):
 
 def query_to_dicts(sql: str, conn=None, config=None) -> List[Dict]:
     """ Runs an SQL query, return a list of dictionaries - one for each row """
-    # If conn is none, a new connection is opened by using config
-    row_dicts = []
-    our_conn = False
-    if conn is None:
-        conn = postgres_connection(config)
-        our_conn = True
+    # If conn is none, the request's connection is used, or one is borrowed from the pool by using config
+    conn, our_conn = _read_connection(conn, config)
 
     try:
         with conn.cursor() as cursor:
             cursor.execute(sql)
             col_names = [desc[0] for desc in cursor.description] # From here: https://stackoverflow.com/a/10252273/871910
-            for row in cursor:
-                row_dict = {}
-                for idx, field in enumerate(row):
-                    row_dict[col_names[idx]] = field
-                row_dicts.append(row_dict)
+            row_dicts = [dict(zip(col_names, row)) for row in cursor.fetchall()]
     finally:
         if our_conn:
             conn.close()
 
     return row_dicts
 
+# Number of rows fetched from the server in each round trip by the streaming queries
+DEFAULT_ITERSIZE = 10000
+_cursor_counter = itertools.count()
+
+def _iter_cursor_batches(sql: str, conn, config, itersize: int) -> Iterator[Tuple[List[str], List[Tuple]]]:
+    # Runs the query with a server side (named) cursor, yields (column names, list of row tuples) for
+    # every batch of up to itersize rows.
+    # Named cursors only live inside a transaction, so the request connection (which is in autocommit mode)
+    # is not used - a connection is borrowed from the pool unless one is passed.
+    our_conn = conn is None
+    if our_conn:
+        conn = postgres_connection(config)
+
+    try:
+        cursor_name = f'stream_{next(_cursor_counter)}'
+        with conn.cursor(cursor_name, withhold=conn.autocommit) as cursor:
+            cursor.itersize = itersize
+            cursor.execute(sql)
+            col_names = None
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if col_names is None:
+                    col_names = [desc[0] for desc in cursor.description]
+                if not rows:
+                    break
+                yield col_names, rows
+    finally:
+        if our_conn:
+            conn.close()  # Rolls back the read transaction
+
+def query_iter(sql: str, conn=None, config=None, itersize=DEFAULT_ITERSIZE, batch_size: Optional[int] = None,
+               as_tuples=False) -> Iterator[Union[Dict, Tuple, List[Dict], List[Tuple]]]:
+    """ Runs an SQL query with a server side cursor, yielding the rows as they are fetched.
+
+    Only itersize rows are held in memory at any time. Rows are dictionaries, or plain tuples if as_tuples is
+    True (which skips the dictionary construction). If batch_size is specified, lists of up to batch_size rows
+    are yielded instead of single rows.
+    """
+    def convert(col_names, rows):
+        if as_tuples:
+            return rows
+        return [dict(zip(col_names, row)) for row in rows]
+
+    if batch_size:
+        itersize = batch_size
+    for col_names, rows in _iter_cursor_batches(sql, conn, config, itersize):
+        if batch_size:
+            yield convert(col_names, rows)
+        else:
+            yield from convert(col_names, rows)
+
+def query_df_batches(sql: str, batch_size=DEFAULT_ITERSIZE, conn=None, config=None) -> Iterator[DataFrame]:
+    """ Runs an SQL query with a server side cursor, yielding a DataFrame for each batch of rows """
+    for col_names, rows in _iter_cursor_batches(sql, conn, config, batch_size):
+        yield DataFrame.from_records(rows, columns=col_names)
+
 def query_edges_to_df(where_clause: str, conn=None, config=None, fix=True) -> DataFrame:
     """ Runs an SQL query on 'edges' table, return a dataframe. """
     sql = 'select id,node1,label,node2,data_type from edges ' + where_clause
 
-    # If conn is none, a new connection is opened by using config
-    row_dicts = []
-    our_conn = False
-    if conn is None:
-        conn = postgres_connection(config)
-        our_conn = True
+    # If conn is none, the request's connection is used, or one is borrowed from the pool by using config
+    conn, our_conn = _read_connection(conn, config)
 
     results = []
     try:
@@ -103,7 +386,7 @@ def query_edges_to_df(where_clause: str, conn=None, config=None, fix=True) -> Da
 
 def delete(sql: str, conn=None, config=None) -> int:
     """ Runs an SQL query """
-    # If conn is none, a new connection is opened by using config
+    # If conn is none, a connection is borrowed from the pool by using config
     row_dicts = []
     our_conn = False
     if conn is None:
@@ -120,3 +403,89 @@ def delete(sql: str, conn=None, config=None) -> int:
         if our_conn:
             conn.close()
     return rows_deleted
+
+
+class LineStream(io.TextIOBase):
+    # A read-only file object over an iterable of lines, used to feed COPY FROM STDIN without
+    # building the entire input in memory
+    def __init__(self, lines: Iterable[str]):
+        self._lines = iter(lines)
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_escape(val: str) -> str:
+    # Escape a value for COPY's text format
+    return val.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def create_key_table(cursor, name: str, keys: Iterable[str], temporary=True) -> str:
+    """ Creates a table with a single text column called key, copies keys into it and returns the table's name.
+
+    The table is temporary, unless temporary is False (temporary tables cannot be used in prepared transactions), in
+    which case an unlogged table, whose name is suffixed with the backend pid, is created. Drop it when done.
+    """
+    if temporary:
+        cursor.execute(f"""DROP TABLE IF EXISTS pg_temp.{name};
+            CREATE TEMPORARY TABLE {name} (key text);""")
+    else:
+        name = f'{name}_{cursor.connection.get_backend_pid()}'
+        cursor.execute(f"""DROP TABLE IF EXISTS {name};
+            CREATE UNLOGGED TABLE {name} (key text);""")
+
+    lines = (copy_escape(str(key)) + '\n' for key in keys)
+    cursor.copy_expert(f"COPY {name} (key) FROM STDIN", LineStream(lines))
+    cursor.execute(f"ANALYZE {name}")
+    return name
+
+
+def delete_by_keys(table: str, column: str, keys: Iterable[str], where: str = None, conn=None, config=None,
+                   temporary=True) -> int:
+    """ Deletes the rows of table whose column is one of keys, and returns the number of rows deleted.
+
+    The keys are copied into a key table and the rows are deleted with a join against it, instead of shipping the
+    keys in long IN (...) lists. where is an optional additional condition on the table's rows. Rows referencing the
+    deleted rows are removed by the database's ON DELETE CASCADE.
+
+    The key table is temporary, unless temporary is False (temporary tables cannot be used in prepared
+    transactions), in which case an unlogged table is created and dropped.
+    """
+    # If conn is none, a connection is borrowed from the pool by using config
+    our_conn = False
+    if conn is None:
+        conn = postgres_connection(config)
+        our_conn = True
+
+    try:
+        with conn.cursor() as cursor:
+            key_table = create_key_table(cursor, 'delete_keys', keys, temporary)
+
+            sql = f"DELETE FROM {table} USING {key_table} WHERE {table}.{column} = {key_table}.key"
+            if where:
+                sql += f" AND ({where})"
+            cursor.execute(sql)
+            rows_deleted = cursor.rowcount
+
+            cursor.execute(f"DROP TABLE {key_table}")
+            if our_conn:
+                conn.commit()
+    finally:
+        if our_conn:
+            conn.close()
+    return rows_deleted
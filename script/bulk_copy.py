@@ -55,6 +55,7 @@ def disable_indices(cursor):
     DROP INDEX ix_edges_node1_label;
     DROP INDEX ix_edges_node2;
     DROP INDEX ix_symbols_symbol;
+    DROP INDEX IF EXISTS ix_dates_date_and_time;
     SET CONSTRAINTS ALL DEFERRED;
     """
     print('Disabling indices and constraints')
@@ -67,6 +68,7 @@ def rebuild_indices(cursor):
         CREATE INDEX ix_edges_node1_label ON edges(node1, label);
         CREATE INDEX ix_edges_node2 ON edges(node2);
         CREATE INDEX ix_symbols_symbol ON symbols(symbol);
+        CREATE INDEX IF NOT EXISTS ix_dates_date_and_time ON dates(date_and_time);
     """
     print('Recreating indices')
     print(sql)
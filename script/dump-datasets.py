@@ -48,11 +48,17 @@ def get_dataset_variables(dataset):
     return response
 
 def dump_variables(dataset, dir):
+    # The dump is streamed to the file chunk by chunk, large datasets are never held in memory
+    global datamart_url
     print('Generating dump for ', dataset)
-    dump = get_dataset_variables(dataset)
+    url = f'{datamart_url}/datasets/{dataset}/variables?limit=1000000'
     dump_path = os.path.join(dir, f'{dataset}.csv')
-    with open(dump_path, 'w', encoding='utf-8') as of:
-        print(dump, file=of)
+    with requests.get(url, stream=True) as response:
+        if response.status_code > 299 or response.status_code < 200:
+            raise ValueError("Bad response for request to " + url)
+        with open(dump_path, 'wb') as of:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                of.write(chunk)
 
 def package_dump(dump_dir, tar_gz_path):
     print(f'Packaging dump into {tar_gz_path}')
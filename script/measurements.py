@@ -0,0 +1,65 @@
+# This script manages the measurements table - a denormalized copy of the variable data, see db/sql/measurements.py
+import argparse
+import os
+import sys
+
+# Allow running from the command line - python script/import... doesn't add the root project directory
+# to the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from config import POSTGRES
+from db.sql import measurements
+from db.sql.utils import postgres_connection
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['create', 'backfill', 'check', 'drop'],
+                        help='create the table and fill it, backfill an existing table, check it against the edges '
+                             'or drop it')
+    parser.add_argument('--dataset-qnode', help='Only backfill or check the measurements of this dataset')
+    parser.add_argument('--recreate', action='store_true', default=False, help='Recreates an existing table')
+    parser.add_argument('--debug', action='store_true', default=False, help='Print the queries')
+
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+
+    config = dict(POSTGRES=POSTGRES)
+    with postgres_connection(config) as conn:
+        exists = measurements.does_table_exist(conn)
+
+        if args.command == 'drop':
+            measurements.drop_table(conn, debug=args.debug)
+            print('Measurements table dropped')
+            return
+
+        if args.command == 'create':
+            if exists:
+                if not args.recreate:
+                    print('Measurements table already exists, use --recreate or backfill')
+                    return
+                measurements.drop_table(conn, debug=args.debug)
+            measurements.create_table(conn, debug=args.debug)
+            exists = True
+        elif not exists:
+            print('There is no measurements table, create it first')
+            return
+
+        if args.command in ('create', 'backfill'):
+            print('Filling the measurements table')
+            count = measurements.backfill(conn, args.dataset_qnode, debug=args.debug)
+            print(f'{count} measurements written')
+        elif args.command == 'check':
+            report = measurements.check_consistency(conn, args.dataset_qnode, debug=args.debug)
+            for name in ('missing', 'extra', 'different'):
+                print(f"{name}: {report[name]} {report[name + '_sample']}")
+            if report['missing'] or report['extra'] or report['different']:
+                sys.exit(1)
+
+    print('Done')
+
+if __name__ == '__main__':
+    run()
@@ -20,9 +20,10 @@ from colorama import Fore, Style
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 
-from db.sql.kgtk import create_edge_objects, import_kgtk_tsv
-from db.sql.models import (CoordinateValue, DateValue, Edge, QuantityValue,
-                           StringValue, SymbolValue)
+from db.sql.kgtk import import_kgtk_tsv
+from db.sql.kgtk_classifier import (CoordinateRecord, DateRecord, EdgeRecord, QuantityRecord,
+                                    StringRecord, SymbolRecord, classify_edges, iter_records,
+                                    read_kgtk_frames)
 from db.sql.utils import postgres_connection
 from config import POSTGRES
 
@@ -39,43 +40,54 @@ def parse_args():
 def warn(line, *args):
     print(f"{Fore.YELLOW}Line {line:7}:", *args, Style.RESET_ALL)
 
+CHUNK_SIZE = 100000
+
+def fix_ids(df, first_row, ids):
+    # Fills in missing ids and node1s. Returns the rows that can be used
+    if 'id' not in df.columns:
+        df['id'] = ''
+    if 'node1' not in df.columns:
+        df['node1'] = ''
+
+    missing = (df['id'] == '') & (df['node1'] == '')
+    for position in missing.values.nonzero()[0]:
+        warn(first_row + int(position), "Line must contain either id or node1")
+    df = df[~missing].copy()
+
+    # In some files, node1 is called 'id'
+    no_node1 = df['node1'] == ''
+    df.loc[no_node1, 'node1'] = df.loc[no_node1, 'id']
+    df.loc[no_node1, 'id'] = ''
+
+    for idx in df.index[df['id'] == '']:
+        node1 = df.at[idx, 'node1']
+        label = df.at[idx, 'label']
+        for edge_num in range(1, 100):
+            id = f"{node1}-{label}-{'%02d' % edge_num}"
+            if id not in ids:
+                break
+        df.at[idx, 'id'] = id
+
+    return df, int(missing.sum())
+
 def read_input_file(filename, ids):
+    # Yields (type name, edges, values) DataFrames for each chunk of the file
     print(f'{filename}...')
     count = 0
     errors = 0
-    with open(filename, "r", encoding="utf-8") as f:
-        reader = DictReader(f, delimiter='\t')
-        for row in reader:
-            count += 1
-            id = row.get('id')
-            node1 = row.get('node1')
-            label = row.get('label')
-            node2 = row.get('node2')
-
-            if not id and not node1:
-                warn(count, "Line must contain either id or node1")
-                errors += 1
-                continue
-            if not node1:
-                # In some files, node1 is called 'id'
-                node1 = id
-                id = None
-                row['node1'] = node1
-            if not id:
-                for edge_num in range(1, 100):
-                    id = f"{node1}-{label}-{'%02d' % edge_num}"
-                    if id not in ids:
-                        break
-                row['id'] = id
-
-            try:
-                edge, value = create_edge_objects(row)
-                yield edge, value
-            except ValueError:
-                warn(count, f"Can't deduce edge type, id is {id}")
-                errors += 1
-            if count % 100000 == 0:
-                print(f'Read {count} records from {filename}')
+
+    def on_error(row_num, error):
+        nonlocal errors
+        warn(row_num - 1, f"Can't deduce edge type, id is {error.args[1].get('id')}")
+        errors += 1
+
+    for first_row, df in read_kgtk_frames(filename, CHUNK_SIZE):
+        count += len(df)
+        df, missing = fix_ids(df, first_row - 1, ids)
+        errors += missing
+        for type_name, (edges, values) in classify_edges(df, first_row, on_error=on_error).items():
+            yield type_name, edges, values
+        print(f'Read {count} records from {filename}')
 
     print(f'Read {count} records with {errors} errors from {filename}')
 
@@ -110,7 +122,7 @@ class TypeProcessor:
 
 class EdgeProcessor(TypeProcessor):
     def __init__(self, output_dir):
-        super().__init__(Edge, output_dir, 'edges')
+        super().__init__(EdgeRecord, output_dir, 'edges')
 
     def get_row(self, object):
         return (object.id, object.node1, object.label, object.node2, object.data_type)
@@ -118,7 +130,7 @@ class EdgeProcessor(TypeProcessor):
 
 class StringProcessor(TypeProcessor):
     def __init__(self, output_dir):
-        super().__init__(StringValue, output_dir, 'strings')
+        super().__init__(StringRecord, output_dir, 'strings')
 
     def get_row(self, object):
         return (object.edge_id, object.text, object.language)
@@ -126,7 +138,7 @@ class StringProcessor(TypeProcessor):
 
 class DateProcessor(TypeProcessor):
     def __init__(self, output_dir):
-        super().__init__(DateValue, output_dir, 'dates')
+        super().__init__(DateRecord, output_dir, 'dates')
 
     def get_row(self, object):
         return (object.edge_id, object.date_and_time.isoformat(), object.calendar, object.precision)
@@ -134,7 +146,7 @@ class DateProcessor(TypeProcessor):
 
 class QuantityProcessor(TypeProcessor):
     def __init__(self, output_dir):
-        super().__init__(QuantityValue, output_dir, 'quantities')
+        super().__init__(QuantityRecord, output_dir, 'quantities')
 
     def get_row(self, object):
         return (object.edge_id, object.number, object.unit, object.low_tolerance, object.high_tolerance)
@@ -142,7 +154,7 @@ class QuantityProcessor(TypeProcessor):
 
 class CoordinateProcessor(TypeProcessor):
     def __init__(self, output_dir):
-        super().__init__(CoordinateValue, output_dir, 'coordinates')
+        super().__init__(CoordinateRecord, output_dir, 'coordinates')
 
     def get_row(self, object):
         return (object.edge_id, object.longitude, object.latitude, object.precision)
@@ -150,7 +162,7 @@ class CoordinateProcessor(TypeProcessor):
 
 class SymbolProcessor(TypeProcessor):
     def __init__(self, output_dir):
-        super().__init__(SymbolValue, output_dir, 'symbols')
+        super().__init__(SymbolRecord, output_dir, 'symbols')
 
     def get_row(self, object):
         return (object.edge_id, object.symbol)
@@ -162,7 +174,7 @@ def create_processors(dir):
     processors = {}
     for pt in processor_types:
         processor = pt(dir)
-        processors[processor.type.__name__] = processor
+        processors[processor.type.type_name] = processor
 
     return processors
 
@@ -208,19 +220,20 @@ def run():
 
     for pattern in args.input:
         for filename in glob.glob(pattern):
-            for edge, value in read_input_file(filename, new):
-                if not args.ignore_duplicates and edge.id in existing:
-                    # Edge already exists in database
-                    skipped += 1
-                    continue
-                if edge.id in new:
-                    # Edge already processed in this batch
-                    skipped += 1
-                    continue
-                processors[type(edge).__name__].write(edge)
-                processors[type(value).__name__].write(value)
-                new.add(edge.id)
-                written += 1
+            for type_name, edges, values in read_input_file(filename, new):
+                # Skip edges that already exist in the database, or have already been processed in this batch
+                duplicate = edges['id'].isin(new) | edges['id'].duplicated()
+                if not args.ignore_duplicates:
+                    duplicate |= edges['id'].isin(existing)
+                skipped += int(duplicate.sum())
+                edges = edges[~duplicate]
+                values = values[~duplicate]
+
+                for edge, value in zip(iter_records('Edge', edges), iter_records(type_name, values)):
+                    processors['Edge'].write(edge)
+                    processors[type_name].write(value)
+                new.update(edges['id'])
+                written += len(edges)
 
     print(f'Done, written {written} rows, skipped {skipped}')
 
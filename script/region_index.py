@@ -0,0 +1,53 @@
+# This script builds the region snapshot the region cache can be preloaded from, see REGION_CACHE in config.py
+# and api/region_index.py. Run it again to refresh the snapshot after regions are added, and restart the app.
+import argparse
+import os
+import sys
+import time
+
+# Allow running from the command line - python script/import... doesn't add the root project directory
+# to the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app import app
+from api.region_index import RegionIndex
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'info'],
+                        help='build (or refresh) the snapshot, or print the number of regions in it')
+    parser.add_argument('--source', choices=['database', 'csv'], default='database',
+                        help='Read all the regions from the database (default), or from a region.csv file')
+    parser.add_argument('--csv', default=os.path.join(app.config['METADATA_DIR'], 'region.csv'),
+                        help='The region.csv file to read with --source csv')
+    parser.add_argument('--output', default=app.config['REGION_CACHE']['snapshot'], help='The snapshot file')
+
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+
+    start = time.time()
+    if args.command == 'info':
+        index = RegionIndex.load(args.output)
+        print(f"{args.output}: {len(index)} regions, {'complete' if index.complete else 'partial'}, "
+              f"loaded in {time.time() - start:.2f} seconds")
+        return
+
+    if args.source == 'database':
+        with app.app_context():
+            index = RegionIndex.from_database()
+    else:
+        index = RegionIndex.from_region_csv(args.csv)
+    print(f'{len(index)} regions read in {time.time() - start:.2f} seconds')
+
+    # Write next to the snapshot and rename, so that processes starting meanwhile do not read a partial file
+    temp_path = args.output + '.tmp'
+    index.save(temp_path)
+    os.replace(temp_path, args.output)
+    print(f'Snapshot written to {args.output}')
+
+if __name__ == '__main__':
+    run()
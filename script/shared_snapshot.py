@@ -0,0 +1,73 @@
+# This script builds the snapshot file the worker processes share (see SHARED_SNAPSHOT in config.py and
+# api/shared_snapshot.py). With --watch it keeps running, and replaces the snapshot whenever the regions in the
+# database change. Workers pick up the new snapshot without a restart.
+import argparse
+import json
+import os
+import sys
+import time
+
+# Allow running from the command line - python script/import... doesn't add the root project directory
+# to the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from app import app
+from api.region_index import RegionIndex
+from api.shared_snapshot import region_tables, write_snapshot, Snapshot
+from db.sql import dal
+
+COUNTRY_WIKIFIER_FILE = 'country_wikifier_cache.json'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=['build', 'info'], help='build (or replace) the snapshot, or describe it')
+    parser.add_argument('--output', default=app.config.get('SHARED_SNAPSHOT'),
+                        help='The snapshot file (SHARED_SNAPSHOT by default)')
+    parser.add_argument('--watch', type=int, metavar='SECONDS',
+                        help='Keep running, checking for region changes every SECONDS seconds')
+
+    args = parser.parse_args()
+    if not args.output:
+        parser.error('Set SHARED_SNAPSHOT or pass --output')
+    return args
+
+
+def build(path: str, version: str):
+    start = time.time()
+    index = RegionIndex.from_database()
+    with open(os.path.join(app.config['METADATA_DIR'], COUNTRY_WIKIFIER_FILE), encoding='utf-8') as f:
+        country_memo = json.load(f)
+
+    tables = region_tables(index)
+    tables['country_wikifier'] = country_memo
+    meta = dict(regions=dict(complete=index.complete, version=version), country_wikifier=COUNTRY_WIKIFIER_FILE,
+                created=time.strftime('%Y-%m-%dT%H:%M:%S'))
+    write_snapshot(path, tables, meta)
+    print(f'{path}: {len(index)} regions written in {time.time() - start:.2f} seconds')
+
+
+def run():
+    args = parse_args()
+
+    if args.command == 'info':
+        snapshot = Snapshot(args.output)
+        print(f'{args.output}: {os.path.getsize(args.output)} bytes, {snapshot.meta}')
+        for name in snapshot.header['tables'].keys():
+            print(f'{name}: {len(snapshot.table(name))} entries')
+        return
+
+    with app.app_context():
+        version = dal.query_region_version()
+        build(args.output, version)
+
+    while args.watch:
+        time.sleep(args.watch)
+        with app.app_context():
+            current_version = dal.query_region_version()
+            if current_version != version:
+                version = current_version
+                build(args.output, version)
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,51 @@
+# This script adds the indices introduced after a database was created. It can be run any number of times, indices
+# that already exist are skipped.
+import argparse
+import os
+import sys
+
+# Allow running from the command line - python script/import... doesn't add the root project directory
+# to the PYTHONPATH
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+from config import POSTGRES
+from db.sql import measurements
+from db.sql.utils import postgres_connection
+
+# Supports the start_time and end_time filters of the variable data
+EDGE_INDICES = [
+    'CREATE INDEX IF NOT EXISTS ix_dates_date_and_time ON dates(date_and_time);',
+]
+
+MEASUREMENT_INDICES = [
+    'CREATE INDEX IF NOT EXISTS ix_measurements_time ON measurements (dataset_qnode, property, time);',
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--debug', action='store_true', default=False, help='Print the queries')
+
+    return parser.parse_args()
+
+
+def run():
+    print('Adding missing indices')
+
+    args = parse_args()
+
+    config = dict(POSTGRES=POSTGRES)
+    with postgres_connection(config) as conn:
+        statements = list(EDGE_INDICES)
+        if measurements.does_table_exist(conn):
+            statements += MEASUREMENT_INDICES
+        with conn.cursor() as cursor:
+            for statement in statements:
+                if args.debug:
+                    print(statement)
+                cursor.execute(statement)
+
+    print('Done')
+
+if __name__ == '__main__':
+    run()
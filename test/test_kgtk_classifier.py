@@ -0,0 +1,54 @@
+import unittest
+
+import pandas as pd
+
+from db.sql.kgtk_classifier import classify_edges
+
+COLUMNS = ['id', 'node1', 'label', 'node2', 'node2;kgtk:data_type', 'node2;kgtk:text', 'node2;kgtk:language',
+           'node2;kgtk:symbol', 'node2;kgtk:number', 'node2;kgtk:units_node', 'node2;kgtk:low_tolerance',
+           'node2;kgtk:high_tolerance', 'node2;kgtk:date_and_time', 'node2;kgtk:precision']
+
+
+def edge_row(edge_id, data_type, **values):
+    row = dict.fromkeys(COLUMNS, '')
+    row.update({'id': edge_id, 'node1': 'Q1', 'label': 'P1', 'node2': edge_id, 'node2;kgtk:data_type': data_type})
+    row.update({f'node2;kgtk:{column}': value for (column, value) in values.items()})
+    return row
+
+
+class TestClassifyEdges(unittest.TestCase):
+    def setUp(self):
+        # Two frames concatenated without ignore_index - the index labels repeat
+        first = pd.DataFrame([edge_row('e-date', 'date_and_times', date_and_time='2020-01-01T00:00:00Z',
+                                       precision='9'),
+                              edge_row('e-quantity', 'quantity', number='5')], columns=COLUMNS)
+        second = pd.DataFrame([edge_row('e-symbol', 'symbol', symbol='Q115'),
+                               edge_row('e-string', 'string', text='"hello"', language='en')], columns=COLUMNS)
+        self.df = pd.concat([first, second])
+        self.assertTrue(self.df.index.duplicated().any())
+
+    def test_duplicate_index_labels(self):
+        result = classify_edges(self.df)
+        self.assertEqual(list(result.keys()), ['DateValue', 'QuantityValue', 'SymbolValue', 'StringValue'])
+        for (type_name, edge_id) in [('DateValue', 'e-date'), ('QuantityValue', 'e-quantity'),
+                                     ('SymbolValue', 'e-symbol'), ('StringValue', 'e-string')]:
+            (edges, values) = result[type_name]
+            self.assertEqual(list(edges['id']), [edge_id], type_name)
+            self.assertEqual(list(values['edge_id']), [edge_id], type_name)
+
+        self.assertEqual(result['DateValue'][1]['date_and_time'].iloc[0], pd.Timestamp('2020-01-01'))
+        self.assertEqual(result['QuantityValue'][1]['number'].iloc[0], 5.0)
+        self.assertEqual(result['SymbolValue'][1]['symbol'].iloc[0], 'Q115')
+        self.assertEqual(result['StringValue'][1]['text'].iloc[0], 'hello')
+
+    def test_error_row_numbers(self):
+        df = pd.concat([self.df, pd.DataFrame([edge_row('e-bad', 'quantity', number='5', high_tolerance='high')],
+                                              columns=COLUMNS)])
+        errors = []
+        result = classify_edges(df, first_row=10, on_error=lambda row, error: errors.append(row))
+        self.assertEqual(errors, [14])
+        self.assertEqual(list(result['QuantityValue'][0]['id']), ['e-quantity'])
+
+
+if __name__ == '__main__':
+    unittest.main()
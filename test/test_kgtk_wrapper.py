@@ -0,0 +1,62 @@
+import csv
+import os
+import unittest
+
+import pandas as pd
+
+from api import kgtk_wrapper
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Edge files with the node2 forms the API stores, and how many of their rows to sample
+SAMPLES = [('metadata/region-ethiopia-exploded-edges.tsv', 500),
+           ('db/sql/data/base/fsi-datamart-kgtk-exploded-uniq-ids.tsv', 500),
+           ('db/sql/data/base/property-labels-exploded.tsv', 200)]
+
+# node2 forms produced by the API (canonical data, annotated spreadsheets, metadata) and some that are left to kgtk
+NODE2_FORMS = [
+    'Q115', 'P585', 'QUNITTESTDATASETUnit-0', 'symbol_name', 'True', 'Q1|Q2',
+    '"plain string"', '"escaped \\"quote\\""', '"a|b"', "'Addis Ababa'@en", "'Addis Ababa'@xx",
+    '^2019-01-01T00:00:00Z/9', '^2019-01-01T00:00:00/11', '^2019-01-01T00:00:00/09', '^2019-01-01T00:00:00+03:00/9',
+    '^2019-13-01T00:00:00Z/9', '^2019-02-30T00:00:00Z/11', '^2019-01-01T00:00:00Z/15', '^0000-00-00T00:00:00Z/9',
+    '^2019-01-01T25:00:00Z/9', '^2019-12-32T00:00:00Z/11',
+    '12', '007', '-1.5', '+5', '0.50', '12.', '.5', '1e3', '9.8QFSI-U002', '5[4,6]Q11573',
+    '@9.1/38.7', '@-9.1/-38.70', '@100/10',
+]
+
+
+def read_edges(path: str, rows: int) -> pd.DataFrame:
+    df = pd.read_csv(os.path.join(REPO_DIR, path), sep='\t', quoting=csv.QUOTE_NONE, dtype=object, nrows=rows)
+    return df.fillna('')[['node1', 'label', 'node2']]
+
+
+class TestKgtkWrapper(unittest.TestCase):
+    # The in-memory explode and add-id must give the same output as kgtk, or stored ids silently change
+    def setUp(self):
+        forms = pd.DataFrame({'node1': 'Q1', 'label': 'P1', 'node2': NODE2_FORMS})
+        self.edges = pd.concat([read_edges(path, rows) for (path, rows) in SAMPLES] + [forms], ignore_index=True)
+
+    def test_explode(self):
+        columns = ['node1', 'label', 'node2'] + kgtk_wrapper.EXPLODED_COLUMNS
+        exploded = kgtk_wrapper.explode_frame(self.edges)
+        with kgtk_wrapper.KGTKPipeline(self.edges) as ctx:
+            kgtk_wrapper.explode(ctx)
+            by_kgtk = ctx.read_csv('exploded.tsv').reindex(columns=columns).fillna('')
+        pd.testing.assert_frame_equal(exploded[columns], by_kgtk, check_dtype=False)
+
+    def test_add_ids(self):
+        with_ids = kgtk_wrapper.add_ids_frame(self.edges)
+        with kgtk_wrapper.KGTKPipeline(self.edges) as ctx:
+            kgtk_wrapper.add_ids(ctx)
+            by_kgtk = ctx.read_csv('with-ids.tsv')
+        self.assertEqual(list(with_ids['id']), list(by_kgtk['id']))
+
+    def test_repeated_index_labels(self):
+        edges = pd.concat([self.edges.iloc[:3], pd.DataFrame({'node1': 'Q1', 'label': 'P1', 'node2': ['12', 'True']})])
+        exploded = kgtk_wrapper.explode_frame(edges)
+        self.assertEqual(list(exploded.index), list(edges.index))
+        self.assertEqual(list(exploded['node2;kgtk:data_type'].iloc[-2:]), ['number', 'boolean'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from requests import get
+
+
+class TestRegionAPI(unittest.TestCase):
+    # Expects the Ethiopia regions (metadata/region-ethiopia-exploded-edges.tsv) to be in the database
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+
+    def test_missing_query(self):
+        response = get(f'{self.url}/regions')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_type(self):
+        response = get(f'{self.url}/regions?q=addis&type=city')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bad_limit(self):
+        response = get(f'{self.url}/regions?q=addis&limit=1000')
+        self.assertEqual(response.status_code, 400)
+
+    def test_exact_name(self):
+        response = get(f'{self.url}/regions?q=Ethiopia')
+        self.assertEqual(response.status_code, 200)
+        regions = response.json()
+        self.assertEqual(regions[0]['admin_id'], 'Q115')
+        self.assertEqual(regions[0]['type'], 'country')
+        self.assertEqual(regions[0]['distance'], 0)
+
+    def test_prefix(self):
+        response = get(f'{self.url}/regions?q=addis&type=admin1&limit=10')
+        self.assertEqual(response.status_code, 200)
+        regions = response.json()
+        self.assertEqual(regions[0]['admin_id'], 'Q3624')
+        self.assertEqual(regions[0]['country_id'], 'Q115')
+        self.assertTrue(all(region['type'] == 'admin1' for region in regions))
+        self.assertLessEqual(len(regions), 10)
+
+    def test_misspelled(self):
+        response = get(f'{self.url}/regions?q=etiopia&type=country')
+        self.assertEqual(response.status_code, 200)
+        regions = response.json()
+        self.assertEqual(regions[0]['admin_id'], 'Q115')
+        self.assertEqual(regions[0]['distance'], 1)
+
+    def test_no_match(self):
+        response = get(f'{self.url}/regions?q=xqzxqzxqz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
@@ -0,0 +1,101 @@
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+from api.region_index import RegionIndex
+from db.sql.dal import Region
+
+FIELDS = ('admin_id', 'admin', 'region_type', 'country', 'country_id', 'country_cameo', 'admin1', 'admin1_id',
+          'admin2', 'admin2_id', 'admin3', 'admin3_id', 'region_coordinate', 'alias')
+
+# The region query returns a row per alias, Ethiopia is returned twice
+REGIONS = [
+    Region(admin='Ethiopia', admin_id='Q115', region_type=Region.COUNTRY, country='Ethiopia', country_id='Q115',
+           country_cameo='ETH', region_coordinate='POINT(39 9)', alias='Abyssinia'),
+    Region(admin='Ethiopia', admin_id='Q115', region_type=Region.COUNTRY, country='Ethiopia', country_id='Q115',
+           country_cameo='ETH', region_coordinate='POINT(39 9)', alias='FDRE'),
+    Region(admin='Oromia', admin_id='Q202107', region_type=Region.ADMIN1, country='Ethiopia', country_id='Q115',
+           admin1='Oromia', admin1_id='Q202107'),
+    Region(admin='Arsi', admin_id='Q646859', region_type=Region.ADMIN2, country='Ethiopia', country_id='Q115',
+           admin1='Oromia', admin1_id='Q202107', admin2='Arsi', admin2_id='Q646859'),
+    Region(admin='Georgia', admin_id='Q230', region_type=Region.COUNTRY, country='Georgia', country_id='Q230'),
+    Region(admin='Georgia', admin_id='Q1428', region_type=Region.ADMIN1, country='United States of America',
+           country_id='Q30', admin1='Georgia', admin1_id='Q1428'),
+]
+
+
+def region_fields(region):
+    return tuple(region[field] for field in FIELDS) if region else None
+
+
+class TestRegionIndex(unittest.TestCase):
+    # A snapshot must restore the index it was saved from, without a database
+    def setUp(self):
+        self.index = RegionIndex(complete=True)
+        self.index.add_regions(REGIONS)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'regions.json.gz')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def reload(self, index):
+        index.save(self.path)
+        return RegionIndex.load(self.path)
+
+    def assertSameIndex(self, loaded, index):
+        self.assertEqual(loaded.complete, index.complete)
+        self.assertEqual(len(loaded), len(index))
+        self.assertEqual([region_fields(region) for region in loaded.regions()],
+                         [region_fields(region) for region in index.regions()])
+        self.assertEqual(sorted(loaded.names()), sorted(index.names()))
+
+    def test_lookups(self):
+        index = self.index
+        self.assertEqual(len(index), 5)
+        ethiopia = index.get('Q115')
+        self.assertEqual((ethiopia.admin, ethiopia.country_cameo, ethiopia.alias), ('Ethiopia', 'ETH', 'Abyssinia'))
+        arsi = index.get('Q646859')
+        self.assertEqual((arsi.country_id, arsi.admin1, arsi.admin2_id), ('Q115', 'Oromia', 'Q646859'))
+        self.assertIsNone(index.get('Q1'))
+
+        self.assertEqual([region.admin_id for region in index.find('fdre')], ['Q115'])
+        self.assertEqual([region.admin_id for region in index.find('ABYSSINIA')], ['Q115'])
+        self.assertEqual(sorted(region.admin_id for region in index.find('Georgia')), ['Q1428', 'Q230'])
+        self.assertEqual(index.find('Addis Ababa'), [])
+
+    def test_round_trip(self):
+        loaded = self.reload(self.index)
+        self.assertSameIndex(loaded, self.index)
+        self.assertEqual(region_fields(loaded.get('Q646859')), region_fields(self.index.get('Q646859')))
+        self.assertEqual(sorted(region.admin_id for region in loaded.find('georgia')), ['Q1428', 'Q230'])
+
+        # The loaded index can still be changed
+        loaded.remove('Q230')
+        self.assertEqual([region.admin_id for region in loaded.find('georgia')], ['Q1428'])
+        loaded.add(Region(admin='Afar', admin_id='Q194883', region_type=Region.ADMIN1, country='Ethiopia',
+                          country_id='Q115', admin1='Afar', admin1_id='Q194883'))
+        self.assertEqual(loaded.get('Q194883').country, 'Ethiopia')
+
+    def test_round_trip_after_remove(self):
+        # Removed regions keep their rows, the snapshot must not bring them back
+        self.index.remove('Q1428')
+        self.index.remove('Q202107')
+        loaded = self.reload(self.index)
+        self.assertSameIndex(loaded, self.index)
+        self.assertFalse(loaded.has_id('Q202107'))
+        self.assertFalse(loaded.has_name('Oromia'))
+        self.assertEqual([region.admin_id for region in loaded.find('georgia')], ['Q230'])
+        self.assertEqual(loaded.get('Q646859').admin1, 'Oromia')
+
+    def test_other_version(self):
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            json.dump(dict(version=RegionIndex.SNAPSHOT_VERSION + 1), f)
+        with self.assertRaises(ValueError):
+            RegionIndex.load(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
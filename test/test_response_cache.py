@@ -0,0 +1,87 @@
+import unittest
+from io import StringIO
+
+import pandas as pd
+from requests import get, post
+
+from test.utility import create_dataset, create_variable, delete_dataset, delete_variable, delete_variable_data, \
+    upload_canonical_data
+
+
+class TestResponseCache(unittest.TestCase):
+    # Cached responses and conditional GETs must reflect every upload
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+        self.data_url = f'{self.url}/datasets/unittestdataset/variables/unittestvariable'
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+        create_dataset(self.url)
+        create_variable(self.url, 'unittestdataset')
+
+    def tearDown(self):
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+
+    def test_post_changes_response(self):
+        response = upload_canonical_data(self.url,
+                                         [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']], method=post)
+        self.assertEqual(response.status_code, 201, response.text)
+        first = get(self.data_url)
+        self.assertEqual(first.status_code, 200, first.text)
+        self.assertEqual(len(pd.read_csv(StringIO(first.text))), 1)
+
+        response = upload_canonical_data(self.url,
+                                         [['Ethiopia', 2, '2020-01-01T00:00:00Z', 'year', 'Ethiopia']], method=post)
+        self.assertEqual(response.status_code, 201, response.text)
+        second = get(self.data_url)
+        self.assertEqual(second.status_code, 200, second.text)
+        self.assertEqual(sorted(pd.read_csv(StringIO(second.text))['value']), [1, 2])
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+
+        # The copy from before the upload is no longer current
+        response = get(self.data_url, headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+
+    def test_put_changes_response(self):
+        upload_canonical_data(self.url, [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']], method=post)
+        first = get(self.data_url)
+
+        response = upload_canonical_data(self.url, [['Ethiopia', 3, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']])
+        self.assertEqual(response.status_code, 201, response.text)
+        second = get(self.data_url)
+        self.assertEqual(list(pd.read_csv(StringIO(second.text))['value']), [3])
+        self.assertNotEqual(first.headers['ETag'], second.headers['ETag'])
+
+    def test_delete_changes_response(self):
+        upload_canonical_data(self.url, [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']], method=post)
+        first = get(self.data_url)
+
+        response = delete_variable_data(self.url)
+        self.assertEqual(response.status_code, 200, response.text)
+        second = get(self.data_url)
+        self.assertNotEqual(first.headers.get('ETag'), second.headers.get('ETag'))
+        self.assertNotEqual(first.text, second.text)
+
+    def test_etag_covers_args_and_format(self):
+        upload_canonical_data(self.url, [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']], method=post)
+        csv = get(self.data_url)
+        self.assertEqual(csv.headers['Vary'], 'Accept')
+        limited = get(f'{self.data_url}?limit=1')
+        self.assertNotEqual(csv.headers['ETag'], limited.headers['ETag'])
+
+        # The same arguments in a different order are the same representation
+        first = get(f'{self.data_url}?include=admin1&limit=1')
+        second = get(f'{self.data_url}?limit=1&include=admin1')
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+
+        parquet = get(self.data_url, headers={'Accept': 'application/vnd.apache.parquet'})
+        self.assertNotEqual(csv.headers['ETag'], parquet.headers['ETag'])
+        response = get(self.data_url, headers={'Accept': 'application/vnd.apache.parquet',
+                                               'If-None-Match': csv.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+
+        response = get(self.data_url, headers={'If-None-Match': csv.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['Vary'], 'Accept')
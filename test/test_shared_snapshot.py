@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+
+from api.region_index import RegionIndex, SharedRegionIndex
+from api.shared_snapshot import Snapshot, region_tables, write_snapshot
+from db.sql.dal import Region
+from test.test_region_index import REGIONS, region_fields
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'snapshot.bin')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+
+class TestSnapshot(SnapshotTestCase):
+    # Tables must read back what was written, straight from the memory map
+    def test_round_trip(self):
+        tables = dict(
+            numbers={str(i): i for i in range(1000)},
+            values={'Addis Ababa': ['Q3624', None], 'Ḫattuša': {'country': 'Türkiye'}, '': 'empty key'},
+            empty={},
+        )
+        write_snapshot(self.path, tables, dict(version=3))
+        snapshot = Snapshot(self.path)
+        self.assertEqual(snapshot.meta, dict(version=3))
+        for (name, items) in tables.items():
+            table = snapshot.table(name)
+            self.assertEqual(len(table), len(items))
+            self.assertEqual(dict(table), items)
+        self.assertEqual(snapshot.table('values')['Ḫattuša'], {'country': 'Türkiye'})
+        self.assertNotIn('1000', snapshot.table('numbers'))
+        self.assertNotIn(1, snapshot.table('numbers'))
+        self.assertIsNone(snapshot.table('numbers').get('missing'))
+        self.assertIsNone(snapshot.table('missing'))
+
+    def test_replace(self):
+        write_snapshot(self.path, dict(table={'key': 1}), {})
+        snapshot = Snapshot(self.path)
+        self.assertTrue(snapshot.is_current())
+
+        # The open snapshot keeps reading the file it mapped
+        write_snapshot(self.path, dict(table={'key': 2}), {})
+        self.assertFalse(snapshot.is_current())
+        self.assertEqual(snapshot.table('table')['key'], 1)
+        self.assertEqual(Snapshot(self.path).table('table')['key'], 2)
+        self.assertEqual(os.listdir(self.temp_dir.name), ['snapshot.bin'])
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'PAR1' * 8)
+        with self.assertRaises(ValueError):
+            Snapshot(self.path)
+
+
+class TestSharedRegionIndex(SnapshotTestCase):
+    # The regions of a shared snapshot, with the regions added and removed since it was written
+    def setUp(self):
+        super().setUp()
+        self.index = RegionIndex(complete=True)
+        self.index.add_regions(REGIONS)
+        write_snapshot(self.path, region_tables(self.index), dict(regions=dict(complete=self.index.complete)))
+        self.shared = SharedRegionIndex(Snapshot(self.path))
+
+    def assertIds(self, regions, ids):
+        self.assertEqual(sorted(region.admin_id for region in regions), sorted(ids))
+
+    def test_same_as_index(self):
+        shared = self.shared
+        self.assertTrue(shared.complete)
+        self.assertEqual(len(shared), len(self.index))
+        self.assertEqual(shared.changes, 0)
+        for region in self.index.regions():
+            self.assertEqual(region_fields(shared.get(region.admin_id)), region_fields(region))
+        self.assertIsNone(shared.get('Q1'))
+        self.assertIds(shared.find('GEORGIA'), ['Q230', 'Q1428'])
+        self.assertIds(shared.find('abyssinia'), ['Q115'])
+        self.assertEqual(sorted(shared.names()), sorted(self.index.names()))
+        self.assertEqual(sorted(region_fields(region) for region in shared.regions()),
+                         sorted(region_fields(region) for region in self.index.regions()))
+
+    def test_remove(self):
+        shared = self.shared
+        shared.remove('Q230')
+        self.assertEqual(shared.changes, 1)
+        self.assertEqual(len(shared), len(self.index) - 1)
+        self.assertFalse(shared.has_id('Q230'))
+        self.assertIsNone(shared.get('Q230'))
+        self.assertIds(shared.find('georgia'), ['Q1428'])
+        self.assertEqual(dict(shared.names())['georgia'], ['Q1428'])
+        self.assertNotIn('Q230', [region.admin_id for region in shared.regions()])
+
+        shared.remove('Q1428')
+        self.assertFalse(shared.has_name('Georgia'))
+        self.assertNotIn('georgia', dict(shared.names()))
+
+    def test_add(self):
+        shared = self.shared
+        afar = Region(admin='Afar', admin_id='Q194883', region_type=Region.ADMIN1, country='Ethiopia',
+                      country_id='Q115', admin1='Afar', admin1_id='Q194883', alias='Georgia')
+        shared.add(afar)
+        self.assertEqual(len(shared), len(self.index) + 1)
+        self.assertTrue(shared.has_id('Q194883'))
+        self.assertEqual(region_fields(shared.get('Q194883')), region_fields(afar))
+        self.assertIds(shared.find('afar'), ['Q194883'])
+        self.assertIds(shared.find('georgia'), ['Q230', 'Q1428', 'Q194883'])
+        self.assertEqual(sorted(dict(shared.names())['georgia']), ['Q1428', 'Q194883', 'Q230'])
+        self.assertIds(shared.regions(), ['Q115', 'Q202107', 'Q646859', 'Q230', 'Q1428', 'Q194883'])
+
+    def test_replace_shared_region(self):
+        # A region added again replaces the snapshot's copy, and is found under its new name only
+        shared = self.shared
+        renamed = Region(admin='Sakartvelo', admin_id='Q230', region_type=Region.COUNTRY, country='Sakartvelo',
+                         country_id='Q230')
+        shared.add(renamed)
+        self.assertEqual(len(shared), len(self.index))
+        self.assertEqual(shared.get('Q230').admin, 'Sakartvelo')
+        self.assertIds(shared.find('sakartvelo'), ['Q230'])
+        self.assertIds(shared.find('georgia'), ['Q1428'])
+        self.assertEqual([region.admin for region in shared.regions() if region.admin_id == 'Q230'], ['Sakartvelo'])
+
+        shared.remove('Q230')
+        self.assertFalse(shared.has_id('Q230'))
+        self.assertEqual(shared.find('sakartvelo'), [])
+        self.assertEqual(len(shared), len(self.index) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from io import StringIO
+
+import pandas as pd
+from requests import get
+
+import db.sql.utils as utils
+from test.utility import create_dataset, create_variable, delete_dataset, delete_variable, delete_variable_data, \
+    upload_canonical_data
+
+config = dict(POSTGRES=dict(
+    database='wikidata',
+    host='localhost',
+    port=5433,
+    user='postgres',
+    password='postgres',
+))
+
+
+class TestVariableAggregate(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+        self.aggregate_url = f'{self.url}/datasets/unittestdataset/variables/unittestvariable/aggregate'
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+        create_dataset(self.url)
+        create_variable(self.url, 'unittestdataset')
+        rows = [['Ethiopia', 1, '2018-01-01T00:00:00Z', 'month', 'Ethiopia'],
+                ['Ethiopia', 3, '2018-06-01T00:00:00Z', 'month', 'Ethiopia'],
+                ['Kenya', 8, '2018-06-01T00:00:00Z', 'month', 'Kenya'],
+                ['Ethiopia', 10, '2021-01-01T00:00:00Z', 'month', 'Ethiopia']]
+        response = upload_canonical_data(self.url, rows)
+        self.assertEqual(response.status_code, 201, response.text)
+
+    def tearDown(self):
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+
+    def get_aggregates(self, query=''):
+        response = get(f'{self.aggregate_url}?{query}')
+        self.assertEqual(response.status_code, 200, response.text)
+        return response.text, pd.read_csv(StringIO(response.text))
+
+    def test_default(self):
+        (_, df) = self.get_aggregates()
+        self.assertEqual(list(df.columns), ['dataset_id', 'variable_id', 'variable', 'time', 'time_precision', 'mean'])
+        self.assertEqual(list(df['time']), ['2018-01-01T00:00:00Z', '2021-01-01T00:00:00Z'])
+        self.assertEqual(list(df['time_precision']), ['year', 'year'])
+        self.assertEqual(list(df['mean']), [4.0, 10.0])
+
+    def test_functions(self):
+        (_, df) = self.get_aggregates('fn=sum,min&fn=max&fn=sum')
+        self.assertEqual(list(df.columns[-3:]), ['sum', 'min', 'max'])
+        self.assertEqual(list(df['sum']), [12.0, 10.0])
+        self.assertEqual(list(df['min']), [1.0, 10.0])
+        self.assertEqual(list(df['max']), [8.0, 10.0])
+
+    def test_count_is_an_integer(self):
+        (text, df) = self.get_aggregates('fn=count,median')
+        self.assertEqual(list(df['count']), [3, 1])
+        self.assertEqual(df['count'].dtype, 'int64')
+        self.assertEqual(text.splitlines()[1].split(',')[-2], '3')
+        self.assertEqual(list(df['median']), [3.0, 10.0])
+
+    def test_intervals(self):
+        (_, df) = self.get_aggregates('interval=decade&fn=count')
+        self.assertEqual(list(df['time']), ['2010-01-01T00:00:00Z', '2020-01-01T00:00:00Z'])
+        self.assertEqual(list(df['count']), [3, 1])
+
+        (_, df) = self.get_aggregates('interval=month&fn=count')
+        self.assertEqual(list(df['time']), ['2018-01-01T00:00:00Z', '2018-06-01T00:00:00Z', '2021-01-01T00:00:00Z'])
+        self.assertEqual(list(df['count']), [1, 2, 1])
+
+    def test_by_region(self):
+        (_, df) = self.get_aggregates('by=country&fn=count')
+        self.assertEqual(list(df.columns), ['dataset_id', 'variable_id', 'variable', 'country', 'country_id', 'time',
+                                            'time_precision', 'count'])
+        self.assertEqual(df['count'].sum(), 4)
+
+    def test_location_in_two_regions(self):
+        # A location with two P17 edges is counted once, in one of its countries
+        edges = [('unittest-Q115-P17-Q115', 'Q115', 'P17', 'Q115'), ('unittest-Q115-P17-Q1033', 'Q115', 'P17', 'Q1033')]
+        values = ', '.join(f"('{id}', '{node1}', '{label}', '{node2}', 'symbol')" for (id, node1, label, node2) in edges)
+        utils.delete(f"INSERT INTO edges (id, node1, label, node2, data_type) VALUES {values}", config=config)
+        try:
+            (_, df) = self.get_aggregates('by=country&fn=count&interval=century')
+        finally:
+            utils.delete("DELETE FROM edges WHERE id LIKE 'unittest-Q115-P17-%'", config=config)
+        self.assertEqual(df['count'].sum(), 4)
+        self.assertEqual(list(df[df['country_id'] == 'Q1033']['count']), [3])
+
+    def test_time_filter(self):
+        (_, df) = self.get_aggregates('start_time=2020&fn=count')
+        self.assertEqual(list(df['count']), [1])
+
+    def test_invalid_arguments(self):
+        for (query, error) in [
+            ('by=city', 'Unknown by city, expected one of country, admin1, admin2, admin3'),
+            ('interval=week', 'Unknown interval week, expected one of millennium, century, decade, year, month, '
+                              'day, hour, minute, second'),
+            ('fn=mean,mode', 'Unknown fn mode, expected one of mean, sum, count, min, max, median'),
+            ('start_time=soon', 'start_time and end_time should be a year, a month (YYYY-MM), a date or an ISO '
+                                'timestamp'),
+        ]:
+            response = get(f'{self.aggregate_url}?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json()['Error'], error)
+
+    def test_unknown_variable(self):
+        response = get(f'{self.url}/datasets/unittestdataset/variables/nosuchvariable/aggregate')
+        self.assertEqual(response.status_code, 404)
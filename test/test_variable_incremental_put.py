@@ -0,0 +1,124 @@
+import unittest
+from io import StringIO
+
+import pandas as pd
+from requests import get, put
+
+from test.utility import create_dataset, create_variable, delete_dataset, delete_variable, delete_variable_data
+
+
+class TestIncrementalUpload(unittest.TestCase):
+    # An incremental PUT (?incremental=true) must leave the variable with the same data as a full PUT of the same file
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+        self.data_url = f'{self.url}/datasets/unittestdataset/variables/unittestvariable'
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+        create_dataset(self.url)
+        create_variable(self.url, 'unittestdataset')
+
+    def tearDown(self):
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+
+    def upload(self, rows, incremental, columns=('main_subject', 'value', 'time', 'time_precision', 'country')):
+        df = pd.DataFrame(rows, columns=list(columns))
+        files = {'file': ('data.csv', StringIO(df.to_csv(index=False)), 'application/octet-stream')}
+        response = put(f'{self.data_url}?incremental=true' if incremental else self.data_url, files=files)
+        self.assertEqual(response.status_code, 201, response.text)
+        return response
+
+    def get_data(self):
+        response = get(self.data_url)
+        self.assertEqual(response.status_code, 200, response.text)
+        df = pd.read_csv(StringIO(response.text), dtype=object)
+        return df.sort_values(['time', 'value']).reset_index(drop=True)
+
+    def assert_same_as_full_replace(self, before, after, **kwargs):
+        self.upload(before, False, **kwargs)
+        self.upload(after, False, **kwargs)
+        expected = self.get_data()
+
+        self.upload(before, False, **kwargs)
+        summary = self.upload(after, True, **kwargs).json()
+        pd.testing.assert_frame_equal(self.get_data(), expected)
+        return summary
+
+    def test_add_row(self):
+        summary = self.assert_same_as_full_replace(
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']],
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 2, '2020-01-01T00:00:00Z', 'year', 'Ethiopia']])
+        self.assertEqual(summary['rows'], 2)
+        self.assertGreater(summary['inserted'], 0)
+        self.assertEqual(summary['deleted'], 0)
+        self.assertGreater(summary['unchanged'], 0)
+
+    def test_replace_row(self):
+        summary = self.assert_same_as_full_replace(
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 2, '2020-01-01T00:00:00Z', 'year', 'Ethiopia']],
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 3, '2020-01-01T00:00:00Z', 'year', 'Ethiopia']])
+        self.assertGreater(summary['inserted'], 0)
+        self.assertGreater(summary['deleted'], 0)
+
+    def test_remove_row(self):
+        summary = self.assert_same_as_full_replace(
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 2, '2020-01-01T00:00:00Z', 'year', 'Ethiopia']],
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']])
+        self.assertEqual(summary['inserted'], 0)
+        self.assertGreater(summary['deleted'], 0)
+
+    def test_change_qualifier(self):
+        columns = ('main_subject', 'value', 'time', 'time_precision', 'country', 'note')
+        summary = self.assert_same_as_full_replace(
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia', 'first'],
+             ['Ethiopia', 2, '2020-01-01T00:00:00Z', 'year', 'Ethiopia', 'first']],
+            [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia', 'first'],
+             ['Ethiopia', 2, '2020-01-01T00:00:00Z', 'year', 'Ethiopia', 'second']],
+            columns=columns)
+        # The changed measurement is replaced - its main edge, dataset, time, country and note edges
+        self.assertEqual(summary['inserted'], 5)
+        self.assertEqual(summary['deleted'], 5)
+        self.assertEqual(summary['unchanged'], 5)
+
+    def test_remove_qualifier(self):
+        self.upload([['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia', 'first']], False,
+                    columns=('main_subject', 'value', 'time', 'time_precision', 'country', 'note'))
+        summary = self.upload([['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']], True).json()
+        self.assertEqual(summary['inserted'], 4)
+        self.assertEqual(summary['deleted'], 5)
+        # The variable keeps the qualifier, the measurement has no value for it
+        self.assertTrue(self.get_data()['note'].isna().all())
+
+    def test_insert_row_in_the_middle(self):
+        # Measurements keep their ids when rows are inserted before them, only the new measurement is written
+        summary = self.assert_same_as_full_replace(
+            [['Ethiopia', 1, '2018-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 1, '2020-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 1, '2021-01-01T00:00:00Z', 'year', 'Ethiopia']],
+            [['Ethiopia', 1, '2018-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 1, '2020-01-01T00:00:00Z', 'year', 'Ethiopia'],
+             ['Ethiopia', 1, '2021-01-01T00:00:00Z', 'year', 'Ethiopia']])
+        self.assertEqual(summary['inserted'], 4)
+        self.assertEqual(summary['deleted'], 0)
+        self.assertEqual(summary['unchanged'], 12)
+
+    def test_reorder_rows(self):
+        rows = [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+                ['Ethiopia', 1, '2020-01-01T00:00:00Z', 'year', 'Ethiopia'],
+                ['Ethiopia', 1, '2020-01-01T00:00:00Z', 'year', 'Ethiopia']]
+        summary = self.assert_same_as_full_replace(rows, list(reversed(rows)))
+        self.assertEqual(summary['inserted'], 0)
+        self.assertEqual(summary['deleted'], 0)
+
+    def test_unchanged(self):
+        rows = [['Ethiopia', 1, '2019-01-01T00:00:00Z', 'year', 'Ethiopia']]
+        summary = self.assert_same_as_full_replace(rows, rows)
+        self.assertEqual(summary['inserted'], 0)
+        self.assertEqual(summary['deleted'], 0)
@@ -0,0 +1,80 @@
+import base64
+import json
+import unittest
+from io import StringIO
+from itertools import product
+
+import pandas as pd
+from requests import get
+
+from test.utility import create_dataset, create_variable, delete_dataset, delete_variable, delete_variable_data, \
+    upload_canonical_data
+
+
+class TestVariablePaging(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+        self.data_url = f'{self.url}/datasets/unittestdataset/variables/unittestvariable'
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+        create_dataset(self.url)
+        create_variable(self.url, 'unittestdataset')
+        rows = [[country, value, f'{year}-01-01T00:00:00Z', 'year', country]
+                for (value, (country, year)) in enumerate(product(('Ethiopia', 'Kenya'), range(2011, 2021)))]
+        response = upload_canonical_data(self.url, rows)
+        self.assertEqual(response.status_code, 201, response.text)
+
+    def tearDown(self):
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+
+    def test_round_trip(self):
+        full = pd.read_csv(StringIO(get(self.data_url).text), dtype=object)
+        self.assertEqual(len(full), 20)
+
+        pages = []
+        url = f'{self.data_url}?page_size=6'
+        while url:
+            response = get(url)
+            self.assertEqual(response.status_code, 200, response.text)
+            pages.append(pd.read_csv(StringIO(response.text), dtype=object))
+            self.assertLessEqual(len(pages[-1]), 6)
+            url = response.links.get('next', {}).get('url')
+            if url:
+                self.assertIn(f"page_token={response.headers['X-Next-Page-Token']}", url)
+        self.assertEqual([len(page) for page in pages], [6, 6, 6, 2])
+
+        paged = pd.concat(pages)
+        self.assertFalse(paged.duplicated().any())
+        key = ['main_subject_id', 'time', 'value']
+        pd.testing.assert_frame_equal(paged.sort_values(key).reset_index(drop=True),
+                                      full.sort_values(key).reset_index(drop=True))
+
+    def test_last_page(self):
+        response = get(f'{self.data_url}?page_size=20')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Link', response.headers)
+        self.assertNotIn('X-Next-Page-Token', response.headers)
+
+    def test_other_arguments_are_kept(self):
+        response = get(f'{self.data_url}?page_size=5&start_time=2015')
+        next_url = response.links['next']['url']
+        self.assertIn('start_time=2015', next_url)
+        rows = pd.read_csv(StringIO(get(next_url).text), dtype=object)
+        self.assertTrue((rows['time'] >= '2015').all())
+
+    def test_invalid_page_size(self):
+        for page_size in ('0', '-1', 'ten'):
+            response = get(f'{self.data_url}?page_size={page_size}')
+            self.assertEqual(response.status_code, 400, page_size)
+            self.assertEqual(response.json()['Error'], 'page_size must be a positive integer')
+
+    def test_invalid_token(self):
+        token = get(f'{self.data_url}?page_size=5').headers['X-Next-Page-Token']
+        wrong_shape = base64.urlsafe_b64encode(json.dumps(['Q115', 1]).encode('utf-8')).decode('ascii')
+        for page_token in ('not a token', token[:-4], token[1:], wrong_shape):
+            response = get(self.data_url, params={'page_size': 5, 'page_token': page_token})
+            self.assertEqual(response.status_code, 400, page_token)
+            self.assertEqual(response.json()['Error'], 'Invalid page token')
@@ -0,0 +1,77 @@
+import unittest
+from io import StringIO
+
+import pandas as pd
+from requests import get
+
+from test.utility import create_dataset, create_variable, delete_dataset, delete_variable, delete_variable_data, \
+    upload_canonical_data
+
+
+class TestVariableTimeFilter(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+        self.data_url = f'{self.url}/datasets/unittestdataset/variables/unittestvariable'
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+        create_dataset(self.url)
+        create_variable(self.url, 'unittestdataset')
+        rows = [['Ethiopia', year - 2000, f'{year}-01-01T00:00:00Z', 'year', 'Ethiopia'] for year in range(2015, 2021)]
+        rows += [['Ethiopia', 99, '2018-06-15T00:00:00Z', 'day', 'Ethiopia']]
+        response = upload_canonical_data(self.url, rows)
+        self.assertEqual(response.status_code, 201, response.text)
+
+    def tearDown(self):
+        delete_variable_data(self.url)
+        delete_variable(self.url)
+        delete_dataset(self.url)
+
+    def get_times(self, query, url=None):
+        response = get(f'{url or self.data_url}?{query}')
+        self.assertEqual(response.status_code, 200, response.text)
+        return sorted(pd.read_csv(StringIO(response.text), dtype=object)['time'])
+
+    def test_year_range(self):
+        # Both ends are inclusive, end_time=2018 includes all of 2018
+        self.assertEqual(self.get_times('start_time=2017&end_time=2018'),
+                         ['2017-01-01T00:00:00Z', '2018-01-01T00:00:00Z', '2018-06-15T00:00:00Z'])
+
+    def test_open_ranges(self):
+        self.assertEqual(self.get_times('start_time=2020'), ['2020-01-01T00:00:00Z'])
+        self.assertEqual(self.get_times('end_time=2015'), ['2015-01-01T00:00:00Z'])
+
+    def test_month_and_date(self):
+        self.assertEqual(self.get_times('start_time=2018-06&end_time=2018-06'), ['2018-06-15T00:00:00Z'])
+        self.assertEqual(self.get_times('start_time=2018-02-01&end_time=2018-06-15'), ['2018-06-15T00:00:00Z'])
+        self.assertEqual(self.get_times('start_time=2018-06-16&end_time=2018-12-31'), [])
+
+    def test_timestamp(self):
+        self.assertEqual(self.get_times('start_time=2020-01-01T00:00:00Z'), ['2020-01-01T00:00:00Z'])
+        self.assertEqual(self.get_times('end_time=2015-01-01T00:00:00%2B00:00'), ['2015-01-01T00:00:00Z'])
+
+    def test_precision(self):
+        self.assertEqual(self.get_times('precision=day'), ['2018-06-15T00:00:00Z'])
+        self.assertEqual(self.get_times('precision=11'), ['2018-06-15T00:00:00Z'])
+        self.assertEqual(len(self.get_times('precision=year&start_time=2018')), 3)
+
+    def test_all_variables(self):
+        url = f'{self.url}/datasets/unittestdataset/variables'
+        self.assertEqual(self.get_times('variable=unittestvariable&start_time=2019', url),
+                         ['2019-01-01T00:00:00Z', '2020-01-01T00:00:00Z'])
+
+    def test_invalid_time(self):
+        for query in ('start_time=last year', 'end_time=2018-13', 'start_time=2018-02-30', 'end_time=20'):
+            response = get(f'{self.data_url}?{query}')
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json()['Error'],
+                             'start_time and end_time should be a year, a month (YYYY-MM), a date or an ISO timestamp')
+
+    def test_invalid_precision(self):
+        response = get(f'{self.data_url}?precision=fortnight')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['Error'], 'Illegal precision value: fortnight')
+
+        response = get(f'{self.data_url}?precision=99')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['Error'], 'Illegal precision: 99')
@@ -0,0 +1,94 @@
+import unittest
+from io import StringIO
+
+import pandas as pd
+from requests import get
+
+from test.utility import create_dataset, create_variable, delete_dataset, delete_variable, delete_variable_data, \
+    upload_canonical_data
+
+COLUMNS = ('main_subject', 'value', 'value_unit', 'time', 'time_precision', 'country')
+
+
+class TestVariableWide(unittest.TestCase):
+    def setUp(self):
+        self.url = 'http://localhost:12543'
+        self.wide_url = f'{self.url}/datasets/unittestdataset/variables?format=wide'
+        self.tearDown()
+        create_dataset(self.url)
+        create_variable(self.url, 'unittestdataset', name='first variable')
+        create_variable(self.url, 'unittestdataset', variable_id='unittestvariable2', name='second variable')
+
+    def tearDown(self):
+        for variable_id in ('unittestvariable', 'unittestvariable2'):
+            delete_variable_data(self.url, variable_id=variable_id)
+            delete_variable(self.url, variable_id=variable_id)
+        delete_dataset(self.url)
+
+    def upload(self):
+        response = upload_canonical_data(self.url, [
+            ['Ethiopia', 1, 'dollars', '2019-01-01T00:00:00Z', 'year', 'Ethiopia'],
+            ['Ethiopia', 2, 'dollars', '2020-01-01T00:00:00Z', 'year', 'Ethiopia'],
+        ], columns=COLUMNS)
+        self.assertEqual(response.status_code, 201, response.text)
+        response = upload_canonical_data(self.url, [
+            ['Ethiopia', 10, 'people', '2020-01-01T00:00:00Z', 'year', 'Ethiopia'],
+            ['Kenya', 20, 'people', '2020-01-01T00:00:00Z', 'year', 'Kenya'],
+        ], columns=COLUMNS, variable_id='unittestvariable2')
+        self.assertEqual(response.status_code, 201, response.text)
+
+    def get_wide(self, query='', headers=None):
+        response = get(f'{self.wide_url}{query}', headers=headers)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.headers['Content-Type'], 'text/csv')
+        return pd.read_csv(StringIO(response.text), dtype=object).fillna('')
+
+    def test_columns(self):
+        self.upload()
+        df = self.get_wide()
+        self.assertEqual(list(df.columns[:2]), ['main_subject_id', 'time'])
+        self.assertEqual(list(df.columns[-6:]), [
+            'unittestvariable', 'unittestvariable_UNIT', 'unittestvariable_NAME',
+            'unittestvariable2', 'unittestvariable2_UNIT', 'unittestvariable2_NAME'])
+        for column in ('dataset_id', 'main_subject', 'time_precision', 'country', 'country_id'):
+            self.assertIn(column, df.columns)
+        for column in ('variable_id', 'variable', 'value', 'value_unit'):
+            self.assertNotIn(column, df.columns)
+
+    def test_variable_order(self):
+        # The variable columns follow the order of the variable arguments
+        self.upload()
+        df = self.get_wide('&variable=unittestvariable2&variable=unittestvariable')
+        self.assertEqual(list(df.columns[-6:]), [
+            'unittestvariable2', 'unittestvariable2_UNIT', 'unittestvariable2_NAME',
+            'unittestvariable', 'unittestvariable_UNIT', 'unittestvariable_NAME'])
+
+    def test_rows(self):
+        # One row per main subject and time, with the variables that were observed then
+        self.upload()
+        df = self.get_wide().sort_values(['main_subject_id', 'time']).reset_index(drop=True)
+        self.assertEqual(len(df), 3)
+        self.assertFalse(df.duplicated(['main_subject_id', 'time']).any())
+
+        ethiopia = df[df['main_subject_id'] == 'Q115']
+        both = ethiopia[ethiopia['time'] == '2020-01-01T00:00:00Z'].iloc[0]
+        self.assertEqual(float(both['unittestvariable']), 2.0)
+        self.assertEqual(both['unittestvariable_UNIT'], 'dollars')
+        self.assertEqual(both['unittestvariable_NAME'], 'first variable')
+        self.assertEqual(float(both['unittestvariable2']), 10.0)
+        self.assertEqual(both['unittestvariable2_UNIT'], 'people')
+        self.assertEqual(both['unittestvariable2_NAME'], 'second variable')
+
+        first_only = ethiopia[ethiopia['time'] == '2019-01-01T00:00:00Z'].iloc[0]
+        self.assertEqual(float(first_only['unittestvariable']), 1.0)
+        self.assertEqual(first_only['unittestvariable2'], '')
+        self.assertEqual(first_only['unittestvariable2_UNIT'], '')
+
+    def test_always_csv(self):
+        self.upload()
+        self.get_wide(headers={'Accept': 'application/vnd.apache.parquet'})
+
+    def test_empty(self):
+        response = get(self.wide_url)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.text.strip(), '')
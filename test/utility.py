@@ -171,3 +171,9 @@ def update_dataset_metadata(datamart_url, dataset_id='unittestdataset', name=Non
 def get_data(datamart_url, dataset_id='unittestdataset', variable_id='unittestvariable'):
     url = f'{datamart_url}/datasets/{dataset_id}/variables/{variable_id}'
     return get(url)
+
+def upload_canonical_data(datamart_url, rows, columns=('main_subject', 'value', 'time', 'time_precision', 'country'),
+                          dataset_id='unittestdataset', variable_id='unittestvariable', method=put):
+    df = pd.DataFrame(rows, columns=list(columns))
+    url = f'{datamart_url}/datasets/{dataset_id}/variables/{variable_id}'
+    return method(url, files={'file': ('data.csv', io.StringIO(df.to_csv(index=False)), 'application/octet-stream')})